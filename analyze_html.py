@@ -0,0 +1,386 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+HTML 体积分析
+把转换生成的 HTML 按字节拆分为块级公式图片、行内公式图片、本地图片、代码高亮的内联样式、
+CSS、脚本、正文文本和其余标签，列出最大的若干个嵌入资源（带有在 HTML 中的行列位置）和重复出现的公式。
+报告可以输出为文本或 JSON，--budget 超出时返回非零退出码，适合在 CI 中限制每个页面的体积
+
+用法: python analyze_html.py 文件.html... [--top N] [--json] [--budget 类别=大小]...
+"""
+
+import os
+import re
+import sys
+import json
+import bisect
+import hashlib
+import unicodedata
+from html import unescape
+from collections import Counter, defaultdict
+
+
+# 分类，按报告中的顺序
+CATEGORIES = (
+    "formula_block",     # 块级公式图片
+    "formula_inline",    # 行内公式图片
+    "images",            # 其他嵌入图片
+    "highlight_styles",  # 代码高亮 <span style="..."> 的内联样式
+    "css",               # <style> 元素和其他 style 属性
+    "scripts",           # <script> 元素
+    "text",              # 正文文本（包括代码文本）
+    "markup"             # 其余标签、属性和空白
+)
+CATEGORY_LABELS = {
+    "formula_block": "块级公式图片",
+    "formula_inline": "行内公式图片",
+    "images": "本地图片",
+    "highlight_styles": "代码高亮样式",
+    "css": "CSS",
+    "scripts": "脚本",
+    "text": "文本",
+    "markup": "标签",
+}
+DEFAULT_TOP = 10
+# 没有公式源码的旧版输出中公式图片的 alt
+GENERIC_FORMULA_ALT = "Math formula"
+
+TOKEN_PATTERN = re.compile(
+    r'<!--.*?-->|<(/?)([a-zA-Z][a-zA-Z0-9]*)((?:[^>"\']|"[^"]*"|\'[^\']*\')*)>',
+    re.DOTALL
+)
+ATTRIBUTE_PATTERN = re.compile(r'''([^\s=/>]+)(?:\s*=\s*("[^"]*"|'[^']*'|[^\s>]+))?''')
+STYLE_ATTRIBUTE_PATTERN = re.compile(r'''\sstyle\s*=\s*("[^"]*"|'[^']*')''', re.IGNORECASE)
+# 内容不是正文的元素
+RAW_TEXT_ELEMENTS = {"style": "css", "script": "scripts"}
+# md2html_with_images.py --math-sprite 生成的行内公式拼图：<style> 中的背景图规则，以及每个公式的 <span>
+SPRITE_RULE_PATTERN = re.compile(r'\.(math-sprite-[\w-]+)\s*\{\s*background-image:\s*url\((data:[^)]*)\);?\s*\}')
+SPRITE_CLASS = "math-sprite"
+
+
+def parse_attributes(attribute_text):
+    """把属性文本解析为字典，值已反转义"""
+    attributes = {}
+    for match in ATTRIBUTE_PATTERN.finditer(attribute_text):
+        value = match.group(2) or ""
+        if value[:1] in ("'", '"'):
+            value = value[1:-1]
+        attributes[match.group(1).lower()] = unescape(value)
+    return attributes
+
+
+def _byte_length(text):
+    return len(text.encode("utf-8"))
+
+
+class PayloadAnalyzer:
+    """一次扫描 HTML，按分类累计字节数并收集嵌入资源"""
+    
+    def __init__(self, html_content, base_dir=None):
+        self.html = html_content
+        self.base_dir = base_dir
+        self.bytes = Counter()
+        self.assets = []
+        self._line_starts = [0] + [match.end() for match in re.finditer("\n", html_content)]
+    
+    def position(self, offset):
+        """字符偏移 -> (行, 列)，都从 1 开始"""
+        line = bisect.bisect_right(self._line_starts, offset)
+        return line, offset - self._line_starts[line - 1] + 1
+    
+    def run(self):
+        # 打开的 div 是否是公式块或代码高亮块
+        div_stack = []
+        raw_element = None
+        pos = 0
+        for match in TOKEN_PATTERN.finditer(self.html):
+            closing, name, attribute_text = match.group(1), (match.group(2) or "").lower(), match.group(3) or ""
+            if raw_element is not None and not (closing and name == raw_element):
+                # <style>/<script> 内容中的 < 不是标签
+                continue
+            self._add_text(self.html[pos:match.start()], raw_element, pos)
+            pos = match.end()
+            tag = match.group(0)
+            
+            if raw_element is not None:
+                self.bytes["markup"] += _byte_length(tag)
+                raw_element = None
+                continue
+            if not name:
+                # 注释
+                self.bytes["markup"] += _byte_length(tag)
+                continue
+            if not closing and name in RAW_TEXT_ELEMENTS:
+                raw_element = name
+            
+            if name == "div":
+                if closing:
+                    if div_stack:
+                        div_stack.pop()
+                else:
+                    classes = parse_attributes(attribute_text).get("class", "").split()
+                    div_stack.append("math-block" if "math-block" in classes else
+                                     "highlight" if "highlight" in classes else None)
+            
+            if name == "img" and not closing:
+                self._add_image(tag, attribute_text, match.start(), "math-block" in div_stack)
+            elif name == "span" and not closing and SPRITE_CLASS in attribute_text:
+                self._add_sprite_formula(tag, attribute_text, match.start())
+            else:
+                self._add_tag(tag, "highlight" in div_stack)
+        self._add_text(self.html[pos:], raw_element, pos)
+        return self
+    
+    def _add_text(self, text, raw_element, offset):
+        if not text:
+            return
+        if raw_element == "style":
+            # 公式拼图计入行内公式图片，其余计入 CSS
+            for match in SPRITE_RULE_PATTERN.finditer(text):
+                size = _byte_length(match.group(0))
+                self.bytes["formula_inline"] += size
+                self.bytes["css"] -= size
+                line, column = self.position(offset + match.start())
+                self.assets.append({
+                    "kind": "formula_inline",
+                    "bytes": size,
+                    "embedded": True,
+                    "line": line,
+                    "column": column,
+                    "source": f"公式拼图 .{match.group(1)}",
+                    "digest": hashlib.sha1(match.group(2).encode("ascii", "replace")).hexdigest()[:12],
+                    "sprite": True
+                })
+        if raw_element is not None:
+            self.bytes[RAW_TEXT_ELEMENTS[raw_element]] += _byte_length(text)
+        elif text.strip():
+            self.bytes["text"] += _byte_length(text)
+        else:
+            self.bytes["markup"] += _byte_length(text)
+    
+    def _add_tag(self, tag, in_highlight):
+        """标签中的 style 属性计入样式，其余计入标签"""
+        style_bytes = sum(_byte_length(match.group(0)) for match in STYLE_ATTRIBUTE_PATTERN.finditer(tag))
+        self.bytes["highlight_styles" if in_highlight else "css"] += style_bytes
+        self.bytes["markup"] += _byte_length(tag) - style_bytes
+    
+    def _add_sprite_formula(self, tag, attribute_text, offset):
+        """显示拼图一部分的行内公式，图片数据在拼图中，这里只计入标签本身"""
+        attributes = parse_attributes(attribute_text)
+        if SPRITE_CLASS not in attributes.get("class", "").split():
+            self._add_tag(tag, False)
+            return
+        size = _byte_length(tag)
+        self.bytes["formula_inline"] += size
+        line, column = self.position(offset)
+        self.assets.append({
+            "kind": "formula_inline",
+            "bytes": size,
+            "embedded": True,
+            "line": line,
+            "column": column,
+            "source": attributes.get("aria-label", ""),
+            "digest": hashlib.sha1(attributes.get("style", "").encode("utf-8")).hexdigest()[:12]
+        })
+    
+    def _add_image(self, tag, attribute_text, offset, in_math_block):
+        attributes = parse_attributes(attribute_text)
+        src = attributes.get("src", "")
+        style = attributes.get("style", "").replace(" ", "")
+        if in_math_block:
+            kind = "formula_block"
+        elif "vertical-align:middle" in style and "display:inline" in style:
+            kind = "formula_inline"
+        else:
+            kind = "images"
+        
+        embedded = src.startswith("data:")
+        if embedded:
+            size = _byte_length(tag)
+            self.bytes[kind] += size
+            digest = hashlib.sha1(src.encode("ascii", "replace")).hexdigest()[:12]
+        else:
+            # 书籍模式等把图片写成单独的文件，计入资源列表但不计入 HTML 体积
+            self._add_tag(tag, False)
+            path = os.path.join(self.base_dir or ".", src.split("?", 1)[0].split("#", 1)[0])
+            if not os.path.isfile(path):
+                return
+            size = os.path.getsize(path)
+            digest = os.path.basename(path)
+        
+        line, column = self.position(offset)
+        alt = attributes.get("alt", "")
+        self.assets.append({
+            "kind": kind,
+            "bytes": size,
+            "embedded": embedded,
+            "line": line,
+            "column": column,
+            "source": alt if kind != "images" else (src if not embedded else alt),
+            "digest": digest
+        })
+
+
+def repeated_formulas(assets):
+    """按图片内容分组，返回出现多次的公式，按重复浪费的字节数从大到小排序"""
+    groups = defaultdict(list)
+    for asset in assets:
+        if asset["kind"] in ("formula_block", "formula_inline") and not asset.get("sprite"):
+            groups[asset["digest"]].append(asset)
+    repeats = []
+    for digest, items in groups.items():
+        if len(items) < 2:
+            continue
+        source = items[0]["source"]
+        repeats.append({
+            "latex": source if source != GENERIC_FORMULA_ALT else f"#{digest}",
+            "kind": items[0]["kind"],
+            "count": len(items),
+            "bytes_each": items[0]["bytes"],
+            # 嵌入的图片每次出现都重复一份数据
+            "wasted_bytes": items[0]["bytes"] * (len(items) - 1) if items[0]["embedded"] else 0,
+            "lines": [item["line"] for item in items]
+        })
+    repeats.sort(key=lambda item: (-item["wasted_bytes"], -item["count"]))
+    return repeats
+
+
+def analyze_file(path, top=DEFAULT_TOP):
+    """
+    分析一个 HTML 文件
+    
+    Returns:
+        报告字典 {file, total_bytes, categories, formulas, linked_bytes, top_assets, repeated_formulas}
+    """
+    with open(path, "r", encoding="utf-8") as f:
+        html_content = f.read()
+    analyzer = PayloadAnalyzer(html_content, os.path.dirname(os.path.abspath(path))).run()
+    
+    kinds = Counter(asset["kind"] for asset in analyzer.assets if not asset.get("sprite"))
+    return {
+        "file": path,
+        "total_bytes": os.path.getsize(path),
+        "categories": {category: analyzer.bytes[category] for category in CATEGORIES},
+        "formulas": {"block": kinds["formula_block"], "inline": kinds["formula_inline"],
+                     "images": kinds["images"]},
+        # 以单独文件引用（书籍模式的 assets/）的图片，不计入 total_bytes
+        "linked_bytes": sum(asset["bytes"] for asset in analyzer.assets if not asset["embedded"]),
+        "top_assets": sorted(analyzer.assets, key=lambda asset: -asset["bytes"])[:top],
+        "repeated_formulas": repeated_formulas(analyzer.assets)[:top]
+    }
+
+
+def format_size(size):
+    if size >= 1024 * 1024:
+        return f"{size / 1024 / 1024:.1f}MB"
+    if size >= 1024:
+        return f"{size / 1024:.1f}KB"
+    return f"{size}B"
+
+
+def _pad(text, width):
+    """按终端显示宽度（中文占两列）右侧补齐空格"""
+    display_width = sum(2 if unicodedata.east_asian_width(char) in "WF" else 1 for char in text)
+    return text + " " * max(width - display_width, 0)
+
+
+def format_report(report):
+    """文本报告"""
+    total = report["total_bytes"]
+    lines = [f"{report['file']}: {format_size(total)}"]
+    for category in CATEGORIES:
+        size = report["categories"][category]
+        lines.append(f"  {_pad(CATEGORY_LABELS[category], 14)}{format_size(size):>10}  {size / max(total, 1):>6.1%}")
+    formulas = report["formulas"]
+    lines.append(f"  块级公式 {formulas['block']} 个，行内公式 {formulas['inline']} 个，图片 {formulas['images']} 个")
+    if report["linked_bytes"]:
+        lines.append(f"  以单独文件引用的图片共 {format_size(report['linked_bytes'])}（不计入页面体积）")
+    
+    if report["top_assets"]:
+        lines.append("  最大的资源:")
+        for asset in report["top_assets"]:
+            where = f"{asset['line']}:{asset['column']}"
+            location = "" if asset["embedded"] else "（外部文件）"
+            source = asset["source"].replace("\n", " ")
+            lines.append(f"    {format_size(asset['bytes']):>9}  {CATEGORY_LABELS[asset['kind']]}{location}  "
+                         f"行 {where}  {source[:60]}")
+    if report["repeated_formulas"]:
+        lines.append("  重复的公式:")
+        for item in report["repeated_formulas"]:
+            latex = item["latex"].replace("\n", " ")
+            lines.append(f"    {item['count']} 次  每次 {format_size(item['bytes_each'])}  "
+                         f"重复 {format_size(item['wasted_bytes'])}  {latex[:60]}")
+    return "\n".join(lines)
+
+
+def parse_budget(spec):
+    """解析 --budget 类别=大小，类别为 total 或 CATEGORIES 之一"""
+    from html2image import parse_size
+    
+    category, _, size = spec.partition("=")
+    if category != "total" and category not in CATEGORIES:
+        raise ValueError(f"未知的类别: {category}. 支持的类别: total, {', '.join(CATEGORIES)}")
+    return category, parse_size(size)
+
+
+def check_budgets(report, budgets):
+    """返回超出预算的说明列表"""
+    violations = []
+    for category, limit in budgets:
+        size = report["total_bytes"] if category == "total" else report["categories"][category]
+        if size > limit:
+            violations.append(f"{report['file']}: {category} {format_size(size)} 超出预算 {format_size(limit)}")
+    return violations
+
+
+def main():
+    """命令行主函数"""
+    paths = []
+    top = DEFAULT_TOP
+    as_json = False
+    budgets = []
+    i = 1
+    while i < len(sys.argv):
+        arg = sys.argv[i]
+        if arg == "--top" and i + 1 < len(sys.argv):
+            top = int(sys.argv[i + 1])
+            i += 2
+        elif arg == "--json":
+            as_json = True
+            i += 1
+        elif arg == "--budget" and i + 1 < len(sys.argv):
+            try:
+                budgets.append(parse_budget(sys.argv[i + 1]))
+            except ValueError as e:
+                print(e)
+                sys.exit(1)
+            i += 2
+        elif arg.startswith("--"):
+            print(f"未知选项: {arg}")
+            sys.exit(1)
+        else:
+            paths.append(arg)
+            i += 1
+    
+    if not paths:
+        print("用法: python analyze_html.py 文件.html... [--top N] [--json] [--budget 类别=大小]...")
+        print(f"  --top N              列出最大的 N 个资源和重复最多的 N 个公式 (默认: {DEFAULT_TOP})")
+        print("  --json               输出 JSON")
+        print("  --budget 类别=大小    超出时返回非零退出码，如 total=10M、formula_inline=2M，可重复")
+        print(f"                       类别: total, {', '.join(CATEGORIES)}")
+        sys.exit(1)
+    
+    reports = [analyze_file(path, top) for path in paths]
+    violations = [violation for report in reports for violation in check_budgets(report, budgets)]
+    if as_json:
+        print(json.dumps({"reports": reports, "budget_violations": violations}, ensure_ascii=False, indent=2))
+    else:
+        print("\n\n".join(format_report(report) for report in reports))
+        for violation in violations:
+            print(violation)
+    if violations:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,338 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+可恢复的批量转换
+把一批 Markdown 文档转换为 HTML（md2html_with_images）或图片（md2image），
+每完成或失败一项就向只追加的进度日志（JSON Lines）写一条记录，成功的记录带有输入和输出的哈希；
+中断后用同一个日志重新运行时，跳过已完成且输入、输出都没有变化的项，失败的项按次数上限重试
+
+用法: python batch.py html|image 输入文件或目录... -o 输出目录 [选项]
+"""
+
+import os
+import sys
+import json
+import time
+import asyncio
+import logging
+import threading
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from file_utils import configure_logging, file_sha256, temp_path_for
+
+
+logger = logging.getLogger(__name__)
+
+# 批量转换的模式 -> 默认输出扩展名
+BATCH_MODES = {"html": ".html", "image": ".png"}
+# 默认的进度日志文件名，放在输出目录下
+JOURNAL_NAME = "batch-journal.jsonl"
+# 每一项（同一份输入内容）最多尝试的次数，跨多次运行累计
+DEFAULT_MAX_ATTEMPTS = 3
+
+
+class BatchJournal:
+    """
+    只追加的进度日志
+    
+    每行一条记录 {key, status, input, input_sha256, output, output_sha256, error, time}，
+    status 为 done 或 failed；进程在写一行的中途退出时，最后一行不完整，读取时忽略
+    """
+    
+    def __init__(self, path):
+        self.path = path
+        # 输出路径 -> 最近一次成功的记录
+        self.done = {}
+        # (输出路径, 输入哈希) -> 失败次数；输入改变后重新计数
+        self.failures = Counter()
+        self._lock = threading.Lock()
+        # 最后一行不完整时，下一条记录先换行，避免与残留内容连在一起
+        self._needs_newline = False
+        self._load()
+    
+    def _load(self):
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                lines = f.readlines()
+        except FileNotFoundError:
+            return
+        self._needs_newline = bool(lines) and not lines[-1].endswith("\n")
+        for number, line in enumerate(lines, start=1):
+            try:
+                record = json.loads(line)
+            except ValueError:
+                logger.warning("忽略进度日志中不完整的第 %d 行: %s", number, self.path)
+                continue
+            self._apply(record)
+    
+    def _apply(self, record):
+        if record["status"] == "done":
+            self.done[record["key"]] = record
+        else:
+            self.failures[(record["key"], record.get("input_sha256"))] += 1
+    
+    def is_complete(self, key, input_sha256):
+        """该项已成功完成，且输入没有变化、输出文件仍然存在且内容与记录一致"""
+        record = self.done.get(key)
+        if record is None or record.get("input_sha256") != input_sha256:
+            return False
+        output = record["output"]
+        return os.path.isfile(output) and file_sha256(output) == record["output_sha256"]
+    
+    def attempts(self, key, input_sha256):
+        """同一份输入已经失败的次数"""
+        return self.failures[(key, input_sha256)]
+    
+    def append(self, record):
+        """追加一条记录并立即落盘，多个线程可以同时调用"""
+        record = dict(record, time=time.time())
+        line = json.dumps(record, ensure_ascii=False) + "\n"
+        with self._lock:
+            with open(self.path, "a", encoding="utf-8") as f:
+                if self._needs_newline:
+                    line = "\n" + line
+                    self._needs_newline = False
+                f.write(line)
+                f.flush()
+                os.fsync(f.fileno())
+            self._apply(record)
+
+
+def collect_jobs(inputs, output_dir, extension):
+    """
+    把输入文件和目录展开为 (Markdown 文件, 输出文件) 列表
+    
+    目录递归查找 .md 文件，输出保持相对于该目录的子目录结构
+    """
+    jobs = []
+    for path in inputs:
+        if os.path.isdir(path):
+            for root, dirs, files in os.walk(path):
+                dirs.sort()
+                for name in sorted(files):
+                    if name.endswith(".md"):
+                        md_path = os.path.join(root, name)
+                        relative = os.path.relpath(md_path, path)
+                        jobs.append((md_path, os.path.join(output_dir, os.path.splitext(relative)[0] + extension)))
+        else:
+            name = os.path.splitext(os.path.basename(path))[0]
+            jobs.append((path, os.path.join(output_dir, name + extension)))
+    return jobs
+
+
+def convert_html_jobs(jobs, options, record, workers):
+    """
+    用 md_to_html_with_math_images 并行转换 (Markdown 文件, 输出文件) 列表，输出本身就是原子写出的
+    
+    每一项完成时调用 record(job, result)，result 成功为输出路径，失败为异常对象
+    """
+    from md2html_with_images import md_to_html_with_math_images
+    
+    # 出错时抛出原来的异常，进度日志中记录真正的失败原因
+    convert_options = dict(options, output_dir=None, raise_errors=True)
+    
+    def convert(job):
+        md_path, output_path = job
+        try:
+            md_to_html_with_math_images(md_path, output_path, convert_options)
+        except Exception as e:
+            record(job, e)
+            return
+        record(job, output_path)
+    
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        list(executor.map(convert, jobs))
+
+
+def convert_image_jobs(jobs, options, record):
+    """
+    用 MD2Image.convert_files 的流水线转换，截图先写入临时文件，完成后改名
+    
+    每一项完成时调用 record(job, result)，同 convert_html_jobs
+    """
+    from md2image import MD2Image
+    
+    temp_jobs = [(md_path, temp_path_for(output_path)) for md_path, output_path in jobs]
+    
+    def on_result(index, result):
+        temp_path = temp_jobs[index][1]
+        if not isinstance(result, Exception):
+            try:
+                os.replace(temp_path, jobs[index][1])
+                result = jobs[index][1]
+            except OSError as e:
+                result = e
+        if os.path.exists(temp_path):
+            os.unlink(temp_path)
+        record(jobs[index], result)
+    
+    asyncio.run(MD2Image().convert_files(temp_jobs, options, callback=on_result))
+
+
+def run_batch(jobs, mode="html", options=None, journal_path=None, max_attempts=DEFAULT_MAX_ATTEMPTS, workers=None):
+    """
+    可恢复地批量转换
+    
+    Args:
+        jobs: (Markdown 文件路径, 输出文件路径) 列表
+        mode: html 或 image
+        options: 转换选项，html 模式传给 md_to_html_with_math_images，image 模式传给 MD2Image.convert_files
+        journal_path: 进度日志路径，默认为第一个输出文件所在目录下的 batch-journal.jsonl
+        max_attempts: 同一份输入最多尝试的次数（跨多次运行累计），本次运行中失败的项立即重试直到达到上限
+        workers: html 模式同时转换的文档数（默认: CPU 核数）
+    
+    Returns:
+        统计 Counter：done（本次完成）、skipped（之前已完成）、failed（仍然失败）、exhausted（已达到重试上限）
+    """
+    if mode not in BATCH_MODES:
+        raise ValueError(f"未知的批量转换模式: {mode}. 支持的模式: {', '.join(BATCH_MODES)}")
+    if options is None:
+        options = {}
+    if mode == "image" and options.get("tile_output") == "split":
+        raise ValueError("批量转换的每一项只能有一个输出文件，不支持 tile_output=split")
+    if not jobs:
+        return Counter()
+    if journal_path is None:
+        journal_path = os.path.join(os.path.dirname(jobs[0][1]) or ".", JOURNAL_NAME)
+    
+    journal = BatchJournal(journal_path)
+    stats = Counter()
+    input_hashes = {}
+    pending = []
+    for md_path, output_path in jobs:
+        if os.path.dirname(output_path):
+            os.makedirs(os.path.dirname(output_path), exist_ok=True)
+        key = os.path.abspath(output_path)
+        input_hashes[key] = file_sha256(md_path) if os.path.isfile(md_path) else None
+        if journal.is_complete(key, input_hashes[key]):
+            stats["skipped"] += 1
+        else:
+            pending.append((md_path, output_path))
+    logger.info("共 %d 项，已完成 %d 项，待转换 %d 项", len(jobs), stats["skipped"], len(pending))
+    
+    failed = set()
+    
+    def record(job, result):
+        md_path, output_path = job
+        key = os.path.abspath(output_path)
+        entry = {"key": key, "input": md_path, "input_sha256": input_hashes[key], "output": key}
+        if isinstance(result, Exception):
+            failed.add(job)
+            journal.append(dict(entry, status="failed", error=str(result)))
+            logger.warning("转换失败（第 %d 次）: %s: %s", journal.attempts(key, input_hashes[key]), md_path, result)
+        else:
+            failed.discard(job)
+            journal.append(dict(entry, status="done", output_sha256=file_sha256(output_path)))
+            stats["done"] += 1
+            logger.debug("完成: %s -> %s", md_path, output_path)
+    
+    while pending:
+        runnable = []
+        for job in pending:
+            key = os.path.abspath(job[1])
+            if journal.attempts(key, input_hashes[key]) < max_attempts:
+                runnable.append(job)
+            else:
+                # 只在第一次遇到时计数和提示，之后不再放回 pending
+                failed.add(job)
+                stats["exhausted"] += 1
+                logger.warning("已达到重试上限 %d 次，跳过: %s", max_attempts, job[0])
+        if not runnable:
+            break
+        
+        for job in runnable:
+            if input_hashes[os.path.abspath(job[1])] is None:
+                record(job, FileNotFoundError(f"Markdown 文件不存在: {job[0]}"))
+        existing = [job for job in runnable if input_hashes[os.path.abspath(job[1])] is not None]
+        if mode == "html":
+            convert_html_jobs(existing, options, record, workers or os.cpu_count())
+        else:
+            convert_image_jobs(existing, options, record)
+        pending = [job for job in runnable if job in failed]
+    
+    stats["failed"] = len(failed)
+    return stats
+
+
+def main():
+    """命令行主函数"""
+    args = []
+    output_dir = None
+    journal_path = None
+    max_attempts = DEFAULT_MAX_ATTEMPTS
+    workers = None
+    extension = None
+    options = {}
+    verbose = False
+    
+    i = 1
+    while i < len(sys.argv):
+        arg = sys.argv[i]
+        if arg in ("-o", "--output") and i + 1 < len(sys.argv):
+            output_dir = sys.argv[i + 1]
+            i += 2
+        elif arg == "--journal" and i + 1 < len(sys.argv):
+            journal_path = sys.argv[i + 1]
+            i += 2
+        elif arg == "--max-attempts" and i + 1 < len(sys.argv):
+            max_attempts = int(sys.argv[i + 1])
+            i += 2
+        elif arg == "--workers" and i + 1 < len(sys.argv):
+            workers = int(sys.argv[i + 1])
+            i += 2
+        elif arg == "--format" and i + 1 < len(sys.argv):
+            extension = "." + sys.argv[i + 1].lstrip(".")
+            i += 2
+        elif arg == "--width" and i + 1 < len(sys.argv):
+            options["viewport"] = {"width": int(sys.argv[i + 1]), "height": 800}
+            i += 2
+        elif arg == "--math-backend" and i + 1 < len(sys.argv):
+            options["math_backend"] = sys.argv[i + 1]
+            i += 2
+        elif arg == "--math-output" and i + 1 < len(sys.argv):
+            options["math_output"] = sys.argv[i + 1]
+            i += 2
+        elif arg == "--workspace" and i + 1 < len(sys.argv):
+            options["workspace"] = sys.argv[i + 1]
+            i += 2
+        elif arg == "--verbose":
+            verbose = True
+            i += 1
+        elif arg.startswith("-"):
+            print(f"未知选项: {arg}")
+            sys.exit(1)
+        else:
+            args.append(arg)
+            i += 1
+    
+    if len(args) < 2 or args[0] not in BATCH_MODES or output_dir is None:
+        print("用法: python batch.py html|image 输入文件或目录... -o 输出目录 [选项]")
+        print("  html   用 md2html_with_images 转换为 HTML")
+        print("  image  用 md2image 转换为图片")
+        print("选项:")
+        print(f"  --journal FILE       进度日志 (默认: 输出目录/{JOURNAL_NAME})，中断后用同一个日志重新运行即可继续")
+        print(f"  --max-attempts N     同一份输入最多尝试的次数，跨多次运行累计 (默认: {DEFAULT_MAX_ATTEMPTS})")
+        print("  --workers N          html 模式同时转换的文档数 (默认: CPU 核数)")
+        print("  --format EXT         输出扩展名，如 html、png、jpg、webp (默认: html 或 png)")
+        print("  --width W            image 模式的视口宽度 (默认: 1200)")
+        print("  --math-backend NAME  html 模式的公式渲染后端")
+        print("  --math-output MODE   html 模式的公式输出: image（默认）, mathml")
+        print("  --workspace DIR      html 模式的公式图片工作目录，跨次复用已渲染的公式")
+        print("  --verbose            输出每一项的处理详情")
+        sys.exit(1)
+    
+    configure_logging(verbose)
+    
+    mode = args[0]
+    jobs = collect_jobs(args[1:], output_dir, extension or BATCH_MODES[mode])
+    os.makedirs(output_dir, exist_ok=True)
+    stats = run_batch(jobs, mode, options, journal_path or os.path.join(output_dir, JOURNAL_NAME),
+                      max_attempts, workers)
+    print(f"完成 {stats['done']} 项，跳过 {stats['skipped']} 项（之前已完成），"
+          f"失败 {stats['failed']} 项（其中 {stats['exhausted']} 项已达到重试上限）")
+    if stats["failed"]:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
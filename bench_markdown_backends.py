@@ -0,0 +1,69 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Markdown 后端基准测试
+用同一份文档（默认把 conformance/ 和 example/ 下的文档重复拼接）比较各已安装后端的吞吐量
+"""
+
+import os
+import sys
+import time
+
+from markdown_backends import available_markdown_backends, render_markdown
+
+
+# 默认测试文档的来源目录和重复次数
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+SOURCE_DIRS = ("conformance", "example")
+DEFAULT_REPEAT = 20
+# 每个后端测量的次数，取最快的一次
+RUNS = 5
+
+
+def load_default_document(repeat=DEFAULT_REPEAT):
+    """拼接样例文档，模拟大文档"""
+    parts = []
+    for directory in SOURCE_DIRS:
+        path = os.path.join(REPO_DIR, directory)
+        for name in sorted(os.listdir(path)):
+            if name.endswith(".md"):
+                with open(os.path.join(path, name), "r", encoding="utf-8") as f:
+                    parts.append(f.read())
+    return "\n\n".join(parts * repeat)
+
+
+def main():
+    """命令行主函数"""
+    if len(sys.argv) > 2 or (len(sys.argv) == 2 and sys.argv[1].startswith("--")):
+        print("用法: python bench_markdown_backends.py [文档.md]")
+        sys.exit(1)
+    
+    if len(sys.argv) == 2:
+        with open(sys.argv[1], "r", encoding="utf-8") as f:
+            text = f.read()
+    else:
+        text = load_default_document()
+    size = len(text.encode("utf-8"))
+    print(f"文档大小: {size / 1024:.0f}KB")
+    
+    results = []
+    for backend in available_markdown_backends():
+        # 预热一次，排除导入和 Pygments 词法分析器加载的耗时
+        render_markdown(text[:10000], backend, math=True)
+        best = None
+        for _ in range(RUNS):
+            start = time.perf_counter()
+            render_markdown(text, backend, math=True)
+            elapsed = time.perf_counter() - start
+            best = elapsed if best is None else min(best, elapsed)
+        results.append((backend, best))
+    
+    baseline = dict(results).get("markdown")
+    print(f"{'后端':<14}{'耗时(ms)':>10}{'吞吐(MB/s)':>12}{'相对markdown':>14}")
+    for backend, elapsed in results:
+        speedup = f"{baseline / elapsed:.2f}x" if baseline else "-"
+        print(f"{backend:<14}{elapsed * 1000:>10.0f}{size / elapsed / 1024 / 1024:>12.2f}{speedup:>14}")
+
+
+if __name__ == "__main__":
+    main()
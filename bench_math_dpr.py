@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+公式渲染像素比基准测试
+按不同的设备像素比渲染同一组公式，对比渲染耗时、像素数和 base64 体积，
+并与原来固定 800 DPI 的渲染方式比较
+"""
+
+import base64
+import os
+import sys
+import tempfile
+import time
+
+from md2html_with_images import (DEFAULT_MATH_FONT_SIZE, MATH_RENDER_POINTS, latex_to_image,
+                                 math_render_dpi, png_size, select_math_backends)
+
+
+# 基准测试使用的公式：(LaTeX, 是否行内)
+FORMULAS = [
+    (r'x^2 + y^2 = z^2', True),
+    (r'\alpha + \beta', True),
+    (r'O(\log n)', True),
+    (r'\sum_{i=1}^{n} i = \frac{n(n+1)}{2}', False),
+    (r'\int_0^\infty e^{-x^2} dx = \frac{\sqrt{\pi}}{2}', False),
+    (r'T(n) = T(\lfloor n/2 \rfloor) + O(1)', False),
+    (r'\sqrt{a^2 + b^2} \leq |a| + |b|', False),
+]
+
+# 原来的渲染方式：20 磅字号、800 DPI
+LEGACY_FONT_POINTS = 20
+LEGACY_DPI = 800
+
+
+def run_setting(label, fontsize, dpi, backends, work_dir):
+    """渲染全部公式，返回 (标签, DPI, 耗时秒, 总像素数, base64 字节数, 失败数)"""
+    pixels = encoded = failed = 0
+    start = time.perf_counter()
+    for index, (latex_code, is_inline) in enumerate(FORMULAS):
+        output_path = os.path.join(work_dir, f'{label}-{index}.png')
+        if not latex_to_image(latex_code, output_path, fontsize=fontsize, dpi=dpi, is_inline=is_inline,
+                              timeout=None, backends=backends):
+            failed += 1
+            continue
+        with open(output_path, 'rb') as f:
+            data = f.read()
+        width, height = png_size(data)
+        pixels += width * height
+        encoded += len(base64.b64encode(data))
+    return label, dpi, time.perf_counter() - start, pixels, encoded, failed
+
+
+def main():
+    """命令行主函数"""
+    mode = 'auto'
+    font_size = DEFAULT_MATH_FONT_SIZE
+
+    i = 1
+    while i < len(sys.argv):
+        arg = sys.argv[i]
+        if arg == "--math-backend" and i + 1 < len(sys.argv):
+            mode = sys.argv[i + 1]
+            i += 2
+        elif arg == "--math-font-size" and i + 1 < len(sys.argv):
+            font_size = float(sys.argv[i + 1])
+            i += 2
+        else:
+            print("用法: python bench_math_dpr.py [--math-backend NAME] [--math-font-size PX]")
+            sys.exit(1)
+
+    backends = select_math_backends(mode)
+    print(f"渲染后端: {', '.join(backends)}，公式数: {len(FORMULAS)}，显示字号: {font_size}px")
+
+    settings = [(f'{dpr}x', MATH_RENDER_POINTS, math_render_dpi(font_size, dpr)) for dpr in (1, 2, 3)]
+    settings.append(('800dpi', LEGACY_FONT_POINTS, LEGACY_DPI))
+
+    with tempfile.TemporaryDirectory(prefix='md2html-bench-') as work_dir:
+        # 先渲染一次预热，排除首次导入和字体加载的耗时
+        run_setting('warmup', MATH_RENDER_POINTS, math_render_dpi(font_size, 1), backends, work_dir)
+        results = [run_setting(label, fontsize, dpi, backends, work_dir)
+                   for label, fontsize, dpi in settings]
+
+    legacy = results[-1]
+    print(f"{'设置':<8}{'DPI':>6}{'耗时(ms)':>10}{'像素(K)':>10}{'base64(KB)':>12}{'相对800DPI体积':>16}{'失败':>6}")
+    for label, dpi, elapsed, pixels, encoded, failed in results:
+        ratio = encoded / legacy[4] if legacy[4] else 0
+        print(f"{label:<8}{dpi:>6}{elapsed * 1000:>10.0f}{pixels / 1000:>10.0f}"
+              f"{encoded / 1024:>12.1f}{ratio:>16.1%}{failed:>6}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,191 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+公式拼图基准测试
+生成一个包含大量行内公式的文档，分别按单独图片和拼图（--math-sprite）转换，
+对比转换耗时、HTML 体积（原始和 gzip）、嵌入图片数量和解码全部图片的耗时；
+安装了 Playwright 浏览器时（--browser）再对比页面加载和重新排版的耗时
+
+用法: python bench_math_sprites.py [--formulas N] [--math-backend NAME] [--browser] [--repeat N]
+"""
+
+import os
+import re
+import sys
+import gzip
+import time
+import base64
+import shutil
+import logging
+import tempfile
+import statistics
+from io import BytesIO
+
+from md2html_with_images import md_to_html_with_math_images
+
+
+DEFAULT_FORMULAS = 300
+DEFAULT_REPEAT = 5
+# 生成行内公式的模板，按序号填入不同的数字，保证公式互不相同
+FORMULA_TEMPLATES = (
+    r'x_{{{0}}}^2',
+    r'\alpha_{{{0}}} + \beta',
+    r'\frac{{a_{{{0}}}}}{{b}}',
+    r'O(n^{{{0}}})',
+    r'\sqrt{{{0} + y}}',
+    r'\sum_{{i=1}}^{{{0}}} i',
+)
+# 每段的公式数
+FORMULAS_PER_PARAGRAPH = 6
+DATA_URI_PATTERN = re.compile(r'data:image/png;base64,([A-Za-z0-9+/=]+)')
+# 浏览器中测量重新排版耗时：改变正文宽度后强制计算布局
+RELAYOUT_SCRIPT = """() => {
+    const start = performance.now();
+    document.body.style.width = document.body.style.width === '600px' ? '700px' : '600px';
+    document.body.getBoundingClientRect();
+    return performance.now() - start;
+}"""
+LOAD_SCRIPT = """() => {
+    const entry = performance.getEntriesByType('navigation')[0];
+    return entry.loadEventEnd - entry.startTime;
+}"""
+
+
+def make_document(path, count):
+    """生成包含 count 个互不相同的行内公式的文档"""
+    lines = ["# 公式拼图基准测试", ""]
+    paragraph = []
+    for index in range(count):
+        latex_code = FORMULA_TEMPLATES[index % len(FORMULA_TEMPLATES)].format(index // len(FORMULA_TEMPLATES) + 1)
+        paragraph.append(f"公式 ${latex_code}$")
+        if len(paragraph) == FORMULAS_PER_PARAGRAPH:
+            lines += ["，".join(paragraph) + "。", ""]
+            paragraph = []
+    if paragraph:
+        lines += ["，".join(paragraph) + "。", ""]
+    with open(path, "w", encoding="utf-8") as f:
+        f.write("\n".join(lines))
+
+
+def convert(md_path, html_path, options):
+    start = time.perf_counter()
+    md_to_html_with_math_images(md_path, html_path, options)
+    return time.perf_counter() - start
+
+
+def decode_seconds(html_content):
+    """解码 HTML 中全部嵌入的 PNG 图片的耗时和图片数量，近似浏览器中的解码开销"""
+    from PIL import Image
+    
+    encoded = DATA_URI_PATTERN.findall(html_content)
+    start = time.perf_counter()
+    for data in encoded:
+        with Image.open(BytesIO(base64.b64decode(data))) as img:
+            img.load()
+    return time.perf_counter() - start, len(encoded)
+
+
+def measure_browser(html_paths, repeat):
+    """
+    在浏览器中测量页面加载和重新排版的耗时（毫秒，取中位数）
+    
+    Returns:
+        {路径: (加载耗时, 排版耗时)}；无法启动浏览器时返回 None
+    """
+    from playwright.sync_api import sync_playwright
+    
+    results = {}
+    with sync_playwright() as playwright:
+        try:
+            browser = playwright.chromium.launch()
+        except Exception as e:
+            print(f"无法启动浏览器，跳过浏览器测量: {str(e).splitlines()[0]}")
+            return None
+        try:
+            page = browser.new_page()
+            for path in html_paths:
+                loads = []
+                layouts = []
+                for _ in range(repeat):
+                    page.goto(f"file://{os.path.abspath(path)}", wait_until="load")
+                    loads.append(page.evaluate(LOAD_SCRIPT))
+                    layouts.append(page.evaluate(RELAYOUT_SCRIPT))
+                results[path] = (statistics.median(loads), statistics.median(layouts))
+        finally:
+            browser.close()
+    return results
+
+
+def main():
+    """命令行主函数"""
+    count = DEFAULT_FORMULAS
+    repeat = DEFAULT_REPEAT
+    backend = "auto"
+    browser = False
+    i = 1
+    while i < len(sys.argv):
+        arg = sys.argv[i]
+        if arg == "--formulas" and i + 1 < len(sys.argv):
+            count = int(sys.argv[i + 1])
+            i += 2
+        elif arg == "--math-backend" and i + 1 < len(sys.argv):
+            backend = sys.argv[i + 1]
+            i += 2
+        elif arg == "--repeat" and i + 1 < len(sys.argv):
+            repeat = int(sys.argv[i + 1])
+            i += 2
+        elif arg == "--browser":
+            browser = True
+            i += 1
+        else:
+            print("用法: python bench_math_sprites.py [--formulas N] [--math-backend NAME] [--browser] [--repeat N]")
+            sys.exit(1)
+    
+    logging.basicConfig(level=logging.WARNING, format="%(message)s")
+    work_dir = tempfile.mkdtemp(prefix="md2html-sprites-")
+    try:
+        md_path = os.path.join(work_dir, "formulas.md")
+        make_document(md_path, count)
+        workspace = os.path.join(work_dir, "workspace")
+        options = {"workspace": workspace, "math_backend": backend}
+        
+        # 第一次转换渲染全部公式，之后两种方式都复用工作目录中的公式图片，只比较嵌入方式的差别
+        render_seconds = convert(md_path, os.path.join(work_dir, "warmup.html"), options)
+        print(f"{count} 个行内公式，渲染耗时 {render_seconds:.1f}s")
+        
+        settings = [("单独图片", "images.html", dict(options)),
+                    ("拼图", "sprites.html", dict(options, math_sprite=True))]
+        rows = []
+        for label, name, setting in settings:
+            html_path = os.path.join(work_dir, name)
+            first = convert(md_path, html_path, setting)
+            seconds = statistics.median(convert(md_path, html_path, setting) for _ in range(repeat))
+            with open(html_path, "r", encoding="utf-8") as f:
+                html_content = f.read()
+            size = len(html_content.encode("utf-8"))
+            compressed = len(gzip.compress(html_content.encode("utf-8"), 9))
+            decode, images = min(decode_seconds(html_content) for _ in range(repeat))
+            rows.append((label, html_path, first, seconds, size, compressed, images, decode))
+        
+        print(f"{'方式':<8}{'首次转换(ms)':>14}{'转换(ms)':>10}{'HTML(KB)':>10}{'gzip(KB)':>10}{'图片数':>8}{'解码(ms)':>10}")
+        for label, _, first, seconds, size, compressed, images, decode in rows:
+            print(f"{label:<8}{first * 1000:>14.0f}{seconds * 1000:>10.0f}{size / 1024:>10.1f}"
+                  f"{compressed / 1024:>10.1f}{images:>8}{decode * 1000:>10.1f}")
+        baseline = rows[0]
+        for label, _, _, _, size, compressed, _, decode in rows[1:]:
+            print(f"{label}相对单独图片: HTML {size / baseline[4]:.1%}，gzip {compressed / baseline[5]:.1%}，"
+                  f"解码 {decode / baseline[7]:.1%}")
+        
+        if browser:
+            results = measure_browser([row[1] for row in rows], repeat)
+            if results is not None:
+                print(f"{'方式':<8}{'页面加载(ms)':>14}{'重新排版(ms)':>14}")
+                for label, html_path, *_ in rows:
+                    load, layout = results[html_path]
+                    print(f"{label:<8}{load:>14.1f}{layout:>14.2f}")
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,225 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+后台浏览器
+在后台启动一个无头 Chromium，并把 CDP 地址记录在缓存目录的状态文件中，
+之后每次运行 html2image / md2image 都通过 connect_over_cdp 连接它，不再重新启动浏览器；
+空闲超过一定时间后自动退出
+
+用法: python html2image.py daemon start|stop|status [--idle-timeout SEC]
+"""
+
+import os
+import sys
+import json
+import time
+import signal
+import socket
+import asyncio
+import logging
+import subprocess
+from file_utils import get_cache_dir
+
+
+logger = logging.getLogger(__name__)
+
+# 默认空闲多久后退出（秒）
+DEFAULT_IDLE_TIMEOUT = 600
+# 检查空闲时间的间隔（秒）
+CHECK_INTERVAL = 5
+# 等待后台浏览器启动的时间（秒）
+START_TIMEOUT = 30
+# 连接后台浏览器的超时（毫秒），超时后自行启动浏览器
+CONNECT_TIMEOUT_MS = 5000
+
+
+def state_path():
+    """状态文件路径；文件的修改时间就是最近一次使用时间"""
+    return os.path.join(get_cache_dir("daemon"), "browser.json")
+
+
+def read_state():
+    """返回正在运行的后台浏览器的状态 {endpoint, pid, idle_timeout, started}，没有时返回 None"""
+    try:
+        with open(state_path(), "r", encoding="utf-8") as f:
+            state = json.load(f)
+    except (FileNotFoundError, ValueError):
+        return None
+    try:
+        os.kill(state["pid"], 0)
+    except (OSError, KeyError):
+        return None
+    return state
+
+
+def touch_state():
+    """记录一次使用，推迟后台浏览器的空闲退出"""
+    try:
+        os.utime(state_path())
+    except OSError:
+        pass
+
+
+def _write_state(state):
+    path = state_path()
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(state, f)
+    os.replace(tmp_path, path)
+
+
+def _remove_state(pid):
+    """只删除属于 pid 的状态文件，避免误删新启动的后台浏览器的状态"""
+    try:
+        with open(state_path(), "r", encoding="utf-8") as f:
+            if json.load(f).get("pid") != pid:
+                return
+        os.unlink(state_path())
+    except (FileNotFoundError, ValueError):
+        pass
+
+
+def _free_port():
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+async def connect(playwright):
+    """
+    连接正在运行的后台浏览器
+    
+    Returns:
+        连接上的 Browser；没有后台浏览器或连接失败时返回 None
+    """
+    state = read_state()
+    if state is None:
+        return None
+    try:
+        browser = await playwright.chromium.connect_over_cdp(state["endpoint"], timeout=CONNECT_TIMEOUT_MS)
+    except Exception as e:
+        logger.debug("连接后台浏览器失败: %s", e)
+        return None
+    touch_state()
+    logger.debug("使用后台浏览器: %s", state["endpoint"])
+    return browser
+
+
+async def run(idle_timeout=DEFAULT_IDLE_TIMEOUT):
+    """在当前进程中运行后台浏览器，空闲超过 idle_timeout 秒或收到 SIGTERM 时退出"""
+    from playwright.async_api import async_playwright
+    
+    port = _free_port()
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        loop.add_signal_handler(sig, stop.set)
+    
+    async with async_playwright() as p:
+        browser = await p.chromium.launch(headless=True, args=[f"--remote-debugging-port={port}"])
+        _write_state({
+            "endpoint": f"http://127.0.0.1:{port}",
+            "pid": os.getpid(),
+            "idle_timeout": idle_timeout,
+            "started": time.time()
+        })
+        logger.info("后台浏览器已启动: http://127.0.0.1:%d", port)
+        try:
+            while not stop.is_set() and browser.is_connected():
+                try:
+                    await asyncio.wait_for(stop.wait(), CHECK_INTERVAL)
+                except asyncio.TimeoutError:
+                    pass
+                try:
+                    idle = time.time() - os.stat(state_path()).st_mtime
+                except FileNotFoundError:
+                    break
+                if idle > idle_timeout:
+                    logger.info("空闲 %.0f 秒，后台浏览器退出", idle)
+                    break
+        finally:
+            _remove_state(os.getpid())
+            await browser.close()
+
+
+def start(idle_timeout=DEFAULT_IDLE_TIMEOUT):
+    """
+    在独立的会话中启动后台浏览器，等待其写出状态文件
+    
+    Returns:
+        状态字典
+    """
+    state = read_state()
+    if state is not None:
+        return state
+    
+    log_path = os.path.join(get_cache_dir("daemon"), "daemon.log")
+    with open(log_path, "ab") as log:
+        process = subprocess.Popen(
+            [sys.executable, os.path.abspath(__file__), "run", "--idle-timeout", str(idle_timeout)],
+            stdin=subprocess.DEVNULL, stdout=log, stderr=log, start_new_session=True
+        )
+    
+    deadline = time.monotonic() + START_TIMEOUT
+    while time.monotonic() < deadline:
+        state = read_state()
+        if state is not None and state["pid"] == process.pid:
+            return state
+        if process.poll() is not None:
+            raise RuntimeError(f"后台浏览器启动失败，详见 {log_path}")
+        time.sleep(0.1)
+    process.terminate()
+    raise RuntimeError(f"后台浏览器启动超时，详见 {log_path}")
+
+
+def stop():
+    """停止后台浏览器，没有运行时返回 False"""
+    state = read_state()
+    if state is None:
+        return False
+    os.kill(state["pid"], signal.SIGTERM)
+    return True
+
+
+def main(args):
+    """daemon 子命令"""
+    command = args[0] if args else None
+    idle_timeout = DEFAULT_IDLE_TIMEOUT
+    i = 1
+    while i < len(args):
+        if args[i] == "--idle-timeout" and i + 1 < len(args):
+            idle_timeout = float(args[i + 1])
+            i += 2
+        else:
+            print(f"未知选项: {args[i]}")
+            sys.exit(1)
+    
+    if command == "start":
+        try:
+            state = start(idle_timeout)
+        except RuntimeError as e:
+            print(e)
+            sys.exit(1)
+        print(f"后台浏览器运行中: {state['endpoint']} (pid {state['pid']}，空闲 {state['idle_timeout']:.0f} 秒后退出)")
+    elif command == "stop":
+        print("后台浏览器已停止" if stop() else "后台浏览器没有运行")
+    elif command == "status":
+        state = read_state()
+        if state is None:
+            print("后台浏览器没有运行")
+            sys.exit(1)
+        idle = time.time() - os.stat(state_path()).st_mtime
+        print(f"后台浏览器运行中: {state['endpoint']} (pid {state['pid']}，已空闲 {idle:.0f} 秒)")
+    elif command == "run":
+        logging.basicConfig(level=logging.INFO, format="%(asctime)s %(message)s")
+        asyncio.run(run(idle_timeout))
+    else:
+        print("用法: python html2image.py daemon start|stop|status [--idle-timeout SEC]")
+        print("  start   在后台启动无头 Chromium，之后的转换通过 CDP 连接它，不再每次启动浏览器")
+        print(f"  stop    停止后台浏览器（空闲 --idle-timeout 秒后也会自动退出，默认 {DEFAULT_IDLE_TIMEOUT}）")
+        print("  status  查看后台浏览器的状态")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,60 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+HTML 压缩检查
+用一组样例检查 minify_html 不改变显示效果：行内元素（代码、公式脚本）之间的空格保留，
+块级元素之间的空白去掉，<pre> 等受保护元素的内容不变；有问题时返回非零退出码
+
+用法: python check_html_minify.py
+"""
+
+import sys
+
+from html_minify import minify_html
+
+
+# (说明, 输入, 期望的输出)
+CASES = [
+    ("行内代码之间的空格",
+     "<p>Use <code>x</code> <code>y</code></p>",
+     "<p>Use <code>x</code> <code>y</code></p>"),
+    ("行内公式脚本之间的空格",
+     '<p><script type="math/tex">a</script> <script type="math/tex">b</script></p>',
+     '<p><script type="math/tex">a</script> <script type="math/tex">b</script></p>'),
+    ("代码和公式之间的换行",
+     '<p><code>x</code>\n  <script type="math/tex">y</script></p>',
+     '<p><code>x</code> <script type="math/tex">y</script></p>'),
+    ("行内标签之间的空格",
+     "<p><em>a</em> <strong>b</strong></p>",
+     "<p><em>a</em> <strong>b</strong></p>"),
+    ("块级元素之间的空白",
+     "<div>\n    <p>a</p>\n    <p>b</p>\n</div>",
+     "<div><p>a</p><p>b</p></div>"),
+    ("块级元素和受保护元素之间的空白",
+     "<div>\n<pre>  a\n  b</pre>\n</div>",
+     "<div><pre>  a\n  b</pre></div>"),
+    ("文本中的连续空白",
+     "<p>a   b\n   c</p>",
+     "<p>a b c</p>"),
+]
+
+
+def main():
+    """命令行主函数"""
+    if len(sys.argv) > 1:
+        print("用法: python check_html_minify.py")
+        sys.exit(1)
+    
+    failed = 0
+    for label, source, expected in CASES:
+        result = minify_html(source)
+        if result != expected:
+            failed += 1
+            print(f"{label}: 输出 {result!r}，应为 {expected!r}")
+    if failed:
+        sys.exit(1)
+    print(f"{len(CASES)} 个样例全部通过")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,66 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+导入耗时检查
+基于 python -X importtime 测量各模块的导入耗时，md2html 超出预算时返回非零退出码
+"""
+
+import os
+import re
+import subprocess
+import sys
+
+
+# md2html 的导入耗时预算（毫秒）
+DEFAULT_BUDGET_MS = 50
+# 每个模块测量的次数，取最小值以降低系统抖动的影响
+DEFAULT_RUNS = 5
+# 报告耗时的模块
+MODULES = ["md2html", "md2html_with_images", "html2image", "md2image"]
+
+
+def measure_import_time(module, runs=DEFAULT_RUNS):
+    """返回导入 module 的累计耗时（毫秒），取 runs 次中的最小值"""
+    repo_dir = os.path.dirname(os.path.abspath(__file__))
+    pattern = re.compile(r"import time:\s*\d+\s*\|\s*(\d+)\s*\|\s*" + re.escape(module) + r"\s*$")
+    best = None
+    for _ in range(runs):
+        result = subprocess.run(
+            [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+            cwd=repo_dir, capture_output=True, text=True, check=True
+        )
+        for line in result.stderr.splitlines():
+            match = pattern.match(line)
+            if match:
+                cost = int(match.group(1)) / 1000
+                best = cost if best is None else min(best, cost)
+    return best
+
+
+def main():
+    """命令行主函数"""
+    budget = DEFAULT_BUDGET_MS
+    
+    i = 1
+    while i < len(sys.argv):
+        arg = sys.argv[i]
+        if arg == "--budget-ms" and i + 1 < len(sys.argv):
+            budget = float(sys.argv[i + 1])
+            i += 2
+        else:
+            print("用法: python check_import_time.py [--budget-ms 毫秒]")
+            print(f"检查 md2html 的导入耗时不超过预算（默认: {DEFAULT_BUDGET_MS}ms）")
+            sys.exit(1)
+    
+    for module in MODULES:
+        print(f"{module:24s} {measure_import_time(module):8.1f} ms")
+    
+    cost = measure_import_time("md2html")
+    if cost > budget:
+        print(f"md2html 导入耗时 {cost:.1f}ms 超出预算 {budget:.0f}ms")
+        sys.exit(1)
+    print(f"md2html 导入耗时在预算 {budget:.0f}ms 以内")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,131 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Markdown 后端一致性检查
+用 conformance/ 下的样例文档比较各个已安装后端与 Python-Markdown 的输出，
+规范化后（忽略标签间空白、自闭合写法、属性顺序和样式写法）的 HTML 或标题目录不一致时返回非零退出码
+"""
+
+import os
+import sys
+import difflib
+from html.parser import HTMLParser
+
+from markdown_backends import DEFAULT_MARKDOWN_BACKEND, available_markdown_backends, render_markdown
+
+
+# 样例文档目录
+CORPUS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "conformance")
+
+
+class HTMLNormalizer(HTMLParser):
+    """把 HTML 转换为规范化的标签序列，每个标签或文本一行"""
+    
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.lines = []
+        self.pre_depth = 0
+    
+    def handle_starttag(self, tag, attrs):
+        normalized = []
+        for name, value in sorted(attrs):
+            value = value or ""
+            if name == "style":
+                value = ";".join(part.replace(" ", "") for part in value.split(";") if part.strip())
+            normalized.append(f'{name}="{value}"')
+        self.lines.append(f"<{tag}{''.join(' ' + item for item in normalized)}>")
+        if tag == "pre":
+            self.pre_depth += 1
+    
+    def handle_startendtag(self, tag, attrs):
+        self.handle_starttag(tag, attrs)
+    
+    def handle_endtag(self, tag):
+        self.lines.append(f"</{tag}>")
+        if tag == "pre":
+            self.pre_depth -= 1
+    
+    def handle_data(self, data):
+        if self.pre_depth:
+            # 代码块中的空白有意义，只去掉结尾换行
+            if data.strip("\n"):
+                self.lines.append(repr(data.rstrip("\n")))
+            return
+        text = " ".join(data.split())
+        if text:
+            self.lines.append(text)
+
+
+def normalize_html(html_content):
+    """返回规范化后的行列表"""
+    parser = HTMLNormalizer()
+    parser.feed(html_content)
+    parser.close()
+    return parser.lines
+
+
+def flatten_toc(tokens):
+    """把标题树展开为 (级别, id, 名称) 列表"""
+    result = []
+    for token in tokens:
+        result.append((token["level"], token["id"], token["name"]))
+        result.extend(flatten_toc(token["children"]))
+    return result
+
+
+def render(text, backend):
+    """返回规范化后的 HTML 行列表和标题目录"""
+    toc = []
+    lines = normalize_html(render_markdown(text, backend, math=True, toc=toc))
+    return lines, flatten_toc(toc)
+
+
+def check_file(path, backends):
+    """
+    比较一个样例文档在各后端下的输出
+    
+    Returns:
+        不一致的后端名称列表
+    """
+    with open(path, "r", encoding="utf-8") as f:
+        text = f.read()
+    
+    reference, reference_toc = render(text, DEFAULT_MARKDOWN_BACKEND)
+    failed = []
+    for backend in backends:
+        lines, toc = render(text, backend)
+        if lines != reference or toc != reference_toc:
+            failed.append(backend)
+            print(f"{os.path.basename(path)}: {backend} 与 {DEFAULT_MARKDOWN_BACKEND} 不一致")
+            diff = difflib.unified_diff(reference + [repr(item) for item in reference_toc],
+                                        lines + [repr(item) for item in toc],
+                                        DEFAULT_MARKDOWN_BACKEND, backend, lineterm="")
+            for line in diff:
+                print(f"    {line}")
+    return failed
+
+
+def main():
+    """命令行主函数"""
+    paths = sys.argv[1:] or sorted(
+        os.path.join(CORPUS_DIR, name) for name in os.listdir(CORPUS_DIR) if name.endswith(".md")
+    )
+    backends = [name for name in available_markdown_backends() if name != DEFAULT_MARKDOWN_BACKEND]
+    if not backends:
+        print("没有安装其他 Markdown 后端（markdown-it-py 或 mistune），无需检查")
+        return
+    
+    failures = 0
+    for path in paths:
+        failed = check_file(path, backends)
+        failures += len(failed)
+        status = "一致" if not failed else f"不一致: {', '.join(failed)}"
+        print(f"{os.path.basename(path):<24} {status}")
+    
+    if failures:
+        sys.exit(1)
+    print(f"全部一致: {', '.join(backends)} 与 {DEFAULT_MARKDOWN_BACKEND}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+表格中的公式检查
+用 conformance/pipeline/ 下的样例文档完整转换（公式在 Markdown 解析前替换），
+检查每个表格各行的单元格数与表头一致，且公式的标签没有被单元格分隔符拆开或变成转义后的文本；有问题时返回非零退出码
+
+用法: python check_math_tables.py [文档.md...]
+"""
+
+import os
+import sys
+import shutil
+import logging
+import tempfile
+from html.parser import HTMLParser
+
+from md2html_with_images import md_to_html_with_math_images
+
+
+# 完整转换的样例文档目录
+CORPUS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "conformance", "pipeline")
+# 按每种公式输出方式各转换一次
+MATH_OUTPUTS = ("image", "mathml")
+# 没有结束标签的元素
+VOID_TAGS = {"img", "br", "hr", "input", "meta", "link", "col", "wbr"}
+
+
+class TableChecker(HTMLParser):
+    """
+    统计每个表格各行的单元格数，收集单元格中看起来像标签的文本，
+    以及跨单元格的元素（公式的标签被单元格分隔符拆开时，开始和结束标签落在不同的单元格中）
+    """
+    
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.tables = []
+        self.cell_depth = 0
+        # 当前单元格中未结束的元素
+        self.open_tags = []
+        self.leaked = []
+        self.unbalanced = []
+    
+    def handle_starttag(self, tag, attrs):
+        if tag == "table":
+            self.tables.append([])
+        elif tag == "tr" and self.tables:
+            self.tables[-1].append(0)
+        elif tag in ("td", "th") and self.tables and self.tables[-1]:
+            self.tables[-1][-1] += 1
+            self.cell_depth += 1
+            self.open_tags = []
+        elif self.cell_depth and tag not in VOID_TAGS:
+            self.open_tags.append(tag)
+    
+    def handle_endtag(self, tag):
+        if tag in ("td", "th") and self.cell_depth:
+            self.cell_depth -= 1
+            if self.open_tags:
+                self.unbalanced.append(f"<{self.open_tags[-1]}> 没有在单元格内结束")
+            self.open_tags = []
+        elif self.cell_depth:
+            if tag in self.open_tags:
+                del self.open_tags[len(self.open_tags) - 1 - self.open_tags[::-1].index(tag):]
+            else:
+                self.unbalanced.append(f"</{tag}> 没有对应的开始标签")
+    
+    def handle_data(self, data):
+        if self.cell_depth and ("<img" in data or "<math" in data or "<span" in data or "</" in data):
+            self.leaked.append(data.strip())
+
+
+def check_file(path, math_output, work_dir):
+    """
+    转换一个样例文档并检查表格
+    
+    Returns:
+        问题描述列表
+    """
+    html_path = os.path.join(work_dir, f"{math_output}.html")
+    md_to_html_with_math_images(path, html_path, {"workspace": work_dir, "math_output": math_output})
+    with open(html_path, "r", encoding="utf-8") as f:
+        checker = TableChecker()
+        checker.feed(f.read())
+    
+    problems = []
+    for index, rows in enumerate(checker.tables, 1):
+        if any(count != rows[0] for count in rows):
+            problems.append(f"表格 {index} 各行的单元格数不一致: {rows}")
+    for text in checker.leaked:
+        problems.append(f"单元格中出现转义后的标签: {text[:60]}")
+    for text in checker.unbalanced:
+        problems.append(f"单元格中的标签被拆开: {text}")
+    return problems
+
+
+def main():
+    """命令行主函数"""
+    paths = sys.argv[1:] or sorted(
+        os.path.join(CORPUS_DIR, name) for name in os.listdir(CORPUS_DIR) if name.endswith(".md")
+    )
+    
+    logging.basicConfig(level=logging.WARNING, format="%(message)s")
+    work_dir = tempfile.mkdtemp(prefix="md2html-tables-")
+    failures = 0
+    try:
+        for path in paths:
+            for math_output in MATH_OUTPUTS:
+                problems = check_file(path, math_output, work_dir)
+                failures += len(problems)
+                status = "通过" if not problems else "有问题"
+                print(f"{os.path.basename(path):<24} {math_output:<8} {status}")
+                for problem in problems:
+                    print(f"    {problem}")
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+    
+    if failures:
+        sys.exit(1)
+    print("表格中的公式全部完整")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+成本预估检查
+在临时工作目录中先转换一次文档（公式图片全部缓存），再用 preflight 预估，
+检查默认方式和按体积预算选择的方式下预计的输出体积与实际写出的 HTML 相差不超过 TOLERANCE，
+且已缓存的公式不计渲染耗时；有问题时返回非零退出码
+
+用法: python check_preflight.py [文档.md] [--math-backend NAME]
+"""
+
+import os
+import sys
+import shutil
+import logging
+import tempfile
+
+from md2html_with_images import md_to_html_with_math_images
+from preflight import preflight, write_plan, load_plan
+
+
+DEFAULT_DOCUMENT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "example", "快速幂算法.md")
+# 预计体积与实际体积的最大相对误差
+TOLERANCE = 0.1
+
+
+def convert(md_path, html_path, options):
+    md_to_html_with_math_images(md_path, html_path, options)
+    return os.path.getsize(html_path)
+
+
+def compare(label, predicted, actual):
+    """比较预计和实际的字节数，超出误差时返回 False"""
+    error = abs(predicted - actual) / actual
+    print(f"{label}: 预计 {predicted} 字节，实际 {actual} 字节，误差 {error:.1%}")
+    return error <= TOLERANCE
+
+
+def main():
+    """命令行主函数"""
+    md_path = DEFAULT_DOCUMENT
+    backend = "auto"
+    i = 1
+    while i < len(sys.argv):
+        arg = sys.argv[i]
+        if arg == "--math-backend" and i + 1 < len(sys.argv):
+            backend = sys.argv[i + 1]
+            i += 2
+        elif not arg.startswith("--"):
+            md_path = arg
+            i += 1
+        else:
+            print("用法: python check_preflight.py [文档.md] [--math-backend NAME]")
+            sys.exit(1)
+    
+    logging.basicConfig(level=logging.WARNING, format="%(message)s")
+    work_dir = tempfile.mkdtemp(prefix="md2html-preflight-")
+    try:
+        options = {"workspace": os.path.join(work_dir, "workspace"), "math_backend": backend}
+        # 第一次转换渲染并缓存全部公式
+        convert(md_path, os.path.join(work_dir, "warmup.html"), options)
+        
+        ok = True
+        report = preflight([md_path], options)
+        if report["default"]["strategies"]["png"] or report["default"]["strategies"]["svg"]:
+            print(f"缓存后仍有公式需要渲染: {dict(report['default']['strategies'])}")
+            ok = False
+        actual = convert(md_path, os.path.join(work_dir, "default.html"), options)
+        ok = compare("默认方式", report["default"]["bytes"], actual) and ok
+        
+        # 体积预算取默认输出的一半，迫使部分公式换成更小的方式
+        report = preflight([md_path], options, size_budget=report["default"]["bytes"] // 2)
+        plan_path = os.path.join(work_dir, "plan.json")
+        write_plan(report, plan_path)
+        actual = convert(md_path, os.path.join(work_dir, "planned.html"),
+                         dict(options, math_strategies=load_plan(plan_path)))
+        ok = compare("按体积预算", report["planned"]["bytes"], actual) and ok
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+    if not ok:
+        sys.exit(1)
+    print("预计体积与实际输出一致")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,140 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+共享目录工作队列检查
+在本机用多个工作进程处理同一个队列：其中一个领取在开始前就已“失效”（模拟崩溃的机器），
+另一个工作进程在处理中途被 SIGKILL 杀掉。检查所有任务都完成、输出与记录的哈希一致，
+有问题时返回非零退出码
+
+用法: python check_work_queue.py [--workers N] [--jobs N]
+"""
+
+import os
+import sys
+import json
+import time
+import shutil
+import signal
+import tempfile
+import subprocess
+
+from file_utils import file_sha256
+from work_queue import WorkQueue
+
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+# 测试文档的来源，不含公式，不依赖公式渲染后端
+SOURCE_DOCS = ("basic.md", "code.md", "tables.md")
+DEFAULT_WORKERS = 4
+DEFAULT_JOBS = 60
+# 测试用的心跳间隔和失效时间（秒）
+HEARTBEAT = 0.5
+STALE_AFTER = 3
+# 等待所有工作进程退出的时间（秒）
+TIMEOUT = 300
+
+
+def make_documents(directory, count):
+    """生成 count 个内容互不相同的文档"""
+    os.makedirs(directory)
+    for index in range(count):
+        source = os.path.join(REPO_DIR, "conformance", SOURCE_DOCS[index % len(SOURCE_DOCS)])
+        with open(source, "r", encoding="utf-8") as f:
+            text = f.read()
+        with open(os.path.join(directory, f"doc{index:04d}.md"), "w", encoding="utf-8") as f:
+            f.write(f"# 文档 {index}\n\n{text}")
+
+
+def start_worker(queue_dir):
+    return subprocess.Popen(
+        [sys.executable, os.path.join(REPO_DIR, "work_queue.py"), "worker", queue_dir, "--claim", "2",
+         "--heartbeat", str(HEARTBEAT), "--stale-after", str(STALE_AFTER)],
+        cwd=REPO_DIR, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+
+
+def check(work_dir, workers, jobs):
+    """返回发现的问题列表"""
+    docs_dir = os.path.join(work_dir, "docs")
+    output_dir = os.path.join(work_dir, "out")
+    queue_dir = os.path.join(work_dir, "queue")
+    make_documents(docs_dir, jobs)
+    
+    queue = WorkQueue(queue_dir, worker_id="checker")
+    md_files = sorted(os.listdir(docs_dir))
+    queue.submit([(os.path.join(docs_dir, name), os.path.join(output_dir, name[:-3] + ".html"))
+                  for name in md_files], "html")
+    
+    # 模拟一台已经崩溃的机器：领取了任务但不再有心跳
+    dead = WorkQueue(queue_dir, worker_id="crashed-host-1")
+    for claim_path, _ in dead.claim(2):
+        old = time.time() - STALE_AFTER * 10
+        os.utime(claim_path, (old, old))
+    
+    processes = [start_worker(queue_dir) for _ in range(workers)]
+    # 第一个工作进程在有任务完成后被杀掉
+    deadline = time.monotonic() + TIMEOUT
+    while queue.status()["done"] < 2 and time.monotonic() < deadline:
+        time.sleep(0.05)
+    processes[0].send_signal(signal.SIGKILL)
+    
+    for process in processes:
+        process.wait(timeout=max(deadline - time.monotonic(), 1))
+    # 被杀掉的进程留下的领取要等失效后才能收回，启动一个新进程处理剩余任务
+    subprocess.run(
+        [sys.executable, os.path.join(REPO_DIR, "work_queue.py"), "worker", queue_dir,
+         "--heartbeat", str(HEARTBEAT), "--stale-after", str(STALE_AFTER)],
+        cwd=REPO_DIR, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, timeout=TIMEOUT
+    )
+    
+    problems = []
+    status = queue.status()
+    expected = {"pending": 0, "claimed": 0, "done": jobs, "failed": 0}
+    if status != expected:
+        problems.append(f"队列状态 {status}，应为 {expected}")
+    for name in os.listdir(os.path.join(queue_dir, "done")):
+        with open(os.path.join(queue_dir, "done", name), "r", encoding="utf-8") as f:
+            record = json.load(f)
+        if not os.path.isfile(record["output"]) or file_sha256(record["output"]) != record["output_sha256"]:
+            problems.append(f"输出与记录不一致: {record['output']}")
+    # 被杀掉的进程来不及删除自己的临时文件，其他进程不应留下临时文件
+    killed = f".{processes[0].pid}-"
+    leftovers = [name for name in os.listdir(output_dir) if ".tmp" in name and killed not in name]
+    if leftovers:
+        problems.append(f"残留的临时文件: {', '.join(leftovers)}")
+    return problems
+
+
+def main():
+    """命令行主函数"""
+    workers = DEFAULT_WORKERS
+    jobs = DEFAULT_JOBS
+    i = 1
+    while i < len(sys.argv):
+        if sys.argv[i] == "--workers" and i + 1 < len(sys.argv):
+            workers = int(sys.argv[i + 1])
+            i += 2
+        elif sys.argv[i] == "--jobs" and i + 1 < len(sys.argv):
+            jobs = int(sys.argv[i + 1])
+            i += 2
+        else:
+            print("用法: python check_work_queue.py [--workers N] [--jobs N]")
+            sys.exit(1)
+    
+    work_dir = tempfile.mkdtemp(prefix="md2html-queue-")
+    try:
+        start = time.perf_counter()
+        problems = check(work_dir, workers, jobs)
+        elapsed = time.perf_counter() - start
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+    
+    for problem in problems:
+        print(problem)
+    if problems:
+        sys.exit(1)
+    print(f"{workers} 个工作进程处理 {jobs} 个任务（含失效的领取和被杀掉的进程）: 全部完成，耗时 {elapsed:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
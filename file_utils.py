@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+文件与缓存目录工具，以及命令行共用的日志配置
+"""
+
+import os
+import logging
+import hashlib
+import threading
+import contextlib
+
+
+# 调试日志过多的第三方库，--verbose 时仍只输出 INFO 以上
+QUIET_LOGGERS = ("matplotlib", "PIL", "asyncio", "MARKDOWN", "markdown_it", "urllib3")
+
+
+def configure_logging(verbose=False, log_format="%(message)s"):
+    """
+    配置根日志，命令行入口调用
+    
+    verbose 时根日志为 DEBUG，被调用的库模块（渲染子进程、缓存、资源路由等）的调试日志也会输出
+    """
+    logging.basicConfig(level=logging.DEBUG if verbose else logging.INFO, format=log_format)
+    if verbose:
+        for name in QUIET_LOGGERS:
+            logging.getLogger(name).setLevel(logging.INFO)
+
+
+def get_cache_dir(*parts):
+    """
+    返回缓存目录下的子目录，不存在时自动创建
+    
+    优先使用环境变量 MD2HTML_CACHE_DIR，其次是 $XDG_CACHE_HOME/md2html，最后是 ~/.cache/md2html
+    """
+    base = os.environ.get("MD2HTML_CACHE_DIR")
+    if not base:
+        xdg = os.environ.get("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache")
+        base = os.path.join(xdg, "md2html")
+    path = os.path.join(base, *parts)
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+def temp_path_for(path):
+    """
+    返回与 path 同目录、同扩展名的临时文件路径
+    
+    文件名包含进程和线程编号，多个进程或线程同时写同一个文件也不会互相覆盖；
+    扩展名保持不变，按扩展名判断格式的写出方式（如截图）不受影响
+    """
+    root, ext = os.path.splitext(path)
+    return f"{root}.{os.getpid()}-{threading.get_ident()}.tmp{ext}"
+
+
+@contextlib.contextmanager
+def atomic_path(path):
+    """
+    原子地生成文件：代码块向临时路径写出，正常结束后改名为 path
+    
+    代码块出错或进程中途退出时 path 保持原样，不会留下写了一半的文件
+    """
+    tmp_path = temp_path_for(path)
+    try:
+        yield tmp_path
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.unlink(tmp_path)
+
+
+@contextlib.contextmanager
+def atomic_write(path, mode="w", encoding=None):
+    """以文件对象的方式原子地写出 path，见 atomic_path"""
+    with atomic_path(path) as tmp_path:
+        with open(tmp_path, mode, encoding=encoding) as f:
+            yield f
+            f.flush()
+            os.fsync(f.fileno())
+
+
+def file_sha256(path):
+    """按块计算文件内容的 SHA-256"""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
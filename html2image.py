@@ -8,8 +8,265 @@ HTML 转图片工具
 import sys
 import os
 import asyncio
+import contextlib
+import logging
+import io
+import json
+import time
+import struct
+import tempfile
+import zlib
 from pathlib import Path
-from playwright.async_api import async_playwright
+from screenshot_cache import ScreenshotCache, DEFAULT_MAX_BYTES
+from resource_cache import ResourceCache, RequestRouter, DEFAULT_RESOURCE_POLICY, DEFAULT_SLOW_REQUEST_MS
+import browser_daemon
+from file_utils import configure_logging
+
+# playwright 在真正截图时才导入，保持命令行启动速度
+
+
+logger = logging.getLogger(__name__)
+
+# Chromium 单张位图的最大边长，超过后截图会空白或被截断
+MAX_TEXTURE_SIZE = 16384
+# 自动分块时每块的 CSS 像素高度
+DEFAULT_TILE_HEIGHT = 4096
+# 各格式编码器支持的最大边长（像素），Pillow 对超出的图片直接报错
+FORMAT_MAX_SIZE = {"webp": 16383, "jpeg": 65535}
+# JPEG/WEBP 拼接时需要完整位图，超过这个像素数（RGB 约 300MB）时改为分块输出
+MAX_STITCH_PIXELS = 100_000_000
+# Playwright 只能直接输出 png/jpeg，其余格式由 Pillow 转码
+NATIVE_FORMATS = ("png", "jpeg")
+# 可以按字节预算搜索编码质量的格式
+BUDGET_FORMATS = ("jpeg", "webp")
+# 按字节预算搜索时的最低质量
+MIN_BUDGET_QUALITY = 10
+# 允许缩小时，最多缩小到原尺寸的这个比例
+MIN_BUDGET_SCALE = 0.25
+
+# 计算每个章节在页面坐标系中的上下边界
+SECTION_BOUNDS_JS = """
+(selector) => {
+    const heads = Array.from(document.querySelectorAll(selector));
+    const pageTop = (el) => el.getBoundingClientRect().top + window.scrollY;
+    const docHeight = document.documentElement.scrollHeight;
+    const sections = heads.map((el, i) => ({
+        title: el.textContent.trim(),
+        top: pageTop(el),
+        bottom: i + 1 < heads.length ? pageTop(heads[i + 1]) : docHeight
+    }));
+    // 第一个标题之前有内容（文字或图片、公式、表格）时作为单独的前言章节
+    const range = document.createRange();
+    range.selectNodeContents(document.body);
+    if (heads.length) {
+        range.setEndBefore(heads[0]);
+    }
+    const media = 'img, svg, math, table, canvas, video, [role="img"]';
+    if (range.toString().trim() || range.cloneContents().querySelector(media)) {
+        sections.unshift({
+            title: document.title.trim(),
+            top: 0,
+            bottom: heads.length ? pageTop(heads[0]) : docHeight
+        });
+    }
+    return sections;
+}
+"""
+
+
+class PNGStreamWriter:
+    """逐行写入 PNG，整张图片不需要同时放在内存中"""
+    
+    def __init__(self, fp, width, height, mode="RGB"):
+        self.fp = fp
+        self.width = width
+        self.channels = {"RGB": 3, "RGBA": 4}[mode]
+        self.mode = mode
+        self.compressor = zlib.compressobj(6)
+        color_type = 2 if mode == "RGB" else 6
+        fp.write(b"\x89PNG\r\n\x1a\n")
+        self._write_chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, color_type, 0, 0, 0))
+    
+    def _write_chunk(self, tag, data):
+        self.fp.write(struct.pack(">I", len(data)))
+        self.fp.write(tag)
+        self.fp.write(data)
+        self.fp.write(struct.pack(">I", zlib.crc32(data, zlib.crc32(tag)) & 0xFFFFFFFF))
+    
+    def write_rows(self, image):
+        """追加一个与输出等宽的 Pillow 图片分块"""
+        raw = image.convert(self.mode).tobytes()
+        stride = self.width * self.channels
+        # 每行前加过滤类型 0（None）
+        rows = bytearray()
+        for offset in range(0, len(raw), stride):
+            rows += b"\x00"
+            rows += raw[offset:offset + stride]
+        data = self.compressor.compress(bytes(rows))
+        if data:
+            self._write_chunk(b"IDAT", data)
+    
+    def close(self):
+        data = self.compressor.flush()
+        if data:
+            self._write_chunk(b"IDAT", data)
+        self._write_chunk(b"IEND", b"")
+
+
+def check_image_size(output_format, width, height):
+    """图片尺寸超出格式的边长上限时抛出 ValueError"""
+    limit = FORMAT_MAX_SIZE.get(output_format)
+    if limit is not None and max(width, height) > limit:
+        raise ValueError(f"{output_format.upper()} 图片的边长不能超过 {limit} 像素（当前 {width}x{height}），"
+                         f"可以使用 --split-tiles 分块输出或改用 PNG")
+
+
+def save_image(image, output_path, output_format, quality=90):
+    """用 Pillow 按指定格式保存图片"""
+    check_image_size(output_format, *image.size)
+    if output_format == "png":
+        image.save(output_path, format="PNG")
+        return
+    if output_format == "jpeg" and image.mode != "RGB":
+        image = image.convert("RGB")
+    image.save(output_path, format=output_format.upper(), quality=quality)
+
+
+def encode_image(image, output_format, quality):
+    """在内存中按指定格式和质量编码图片，返回编码后的字节"""
+    buffer = io.BytesIO()
+    save_image(image, buffer, output_format, quality)
+    return buffer.getvalue()
+
+
+def encode_within_budget(image, output_format, max_bytes, max_quality=90, allow_scale=False):
+    """
+    在内存中二分搜索不超过 max_bytes 字节的最高编码质量
+    
+    最低质量仍超出预算且 allow_scale 为真时，按体积比例估算缩小图片后重新搜索，
+    最多缩小到 MIN_BUDGET_SCALE；仍然超出时返回能得到的最小结果
+    
+    Returns:
+        (编码后的字节, 选择信息字典 {quality, scale, bytes, fits})
+    """
+    from PIL import Image
+    
+    scale = 1.0
+    while True:
+        if scale < 1:
+            size = (max(1, round(image.width * scale)), max(1, round(image.height * scale)))
+            candidate = image.resize(size, Image.LANCZOS)
+        else:
+            candidate = image
+        
+        # 找满足预算的最高质量，质量与体积单调相关
+        best = None
+        low, high = MIN_BUDGET_QUALITY, max(MIN_BUDGET_QUALITY, max_quality)
+        smallest = None
+        while low <= high:
+            quality = (low + high) // 2
+            data = encode_image(candidate, output_format, quality)
+            if len(data) <= max_bytes:
+                best = (data, quality)
+                low = quality + 1
+            else:
+                if smallest is None or quality < smallest[1]:
+                    smallest = (data, quality)
+                high = quality - 1
+        
+        if best is not None:
+            data, quality = best
+            return data, {"quality": quality, "scale": scale, "bytes": len(data), "fits": True}
+        
+        if not allow_scale or scale <= MIN_BUDGET_SCALE:
+            data, quality = smallest
+            return data, {"quality": quality, "scale": scale, "bytes": len(data), "fits": False}
+        
+        # 体积大致与像素数成正比，按面积比例估算缩放，并多缩小一点减少重试次数
+        ratio = (max_bytes / len(smallest[0])) ** 0.5 * 0.95
+        scale = max(MIN_BUDGET_SCALE, scale * min(ratio, 0.9))
+
+
+def save_image_within_budget(image, output_path, output_format, max_bytes, max_quality=90, allow_scale=False):
+    """按字节预算编码并保存图片，返回 encode_within_budget 的选择信息"""
+    data, report = encode_within_budget(image, output_format, max_bytes, max_quality, allow_scale)
+    with open(output_path, "wb") as f:
+        f.write(data)
+    if report["fits"]:
+        logger.info("%s: 质量 %d，缩放 %.2f，%d 字节（预算 %d 字节）",
+                    output_path, report["quality"], report["scale"], report["bytes"], max_bytes)
+    else:
+        logger.warning("%s: 最低质量 %d、缩放 %.2f 时仍有 %d 字节，超出预算 %d 字节",
+                       output_path, report["quality"], report["scale"], report["bytes"], max_bytes)
+    return report
+
+
+def parse_size(value):
+    """解析字节数，支持 K/M 后缀，如 200K、1.5M"""
+    units = {"K": 1024, "M": 1024 * 1024}
+    suffix = value[-1:].upper()
+    if suffix in units:
+        return int(float(value[:-1]) * units[suffix])
+    return int(value)
+
+
+def parse_variant(spec):
+    """
+    解析命令行输出规格，如 "out.webp:width=800,quality=80,scale=2,thumb=400x300,max_bytes=200K"
+    """
+    path, _, params = spec.partition(":")
+    variant = {"path": path}
+    for item in filter(None, params.split(",")):
+        key, _, value = item.partition("=")
+        if key == "width":
+            variant["width"] = int(value)
+        elif key == "quality":
+            variant["quality"] = int(value)
+        elif key == "scale":
+            variant["device_scale_factor"] = float(value)
+        elif key == "thumb":
+            thumb_width, _, thumb_height = value.partition("x")
+            variant["thumbnail"] = (int(thumb_width), int(thumb_height))
+        elif key == "max_bytes":
+            variant["max_bytes"] = parse_size(value)
+        else:
+            raise ValueError(f"未知的输出规格参数: {key}")
+    return variant
+
+
+def stitch_tiles(tile_paths, output_path, output_format="png", quality=90):
+    """
+    将纵向分块图片拼接为一张图片
+    
+    PNG 输出逐块写入，峰值内存只有一个分块；JPEG/WEBP 编码器需要完整位图，只能整体拼接，
+    尺寸超出格式的边长上限时在分配位图前抛出 ValueError
+    """
+    from PIL import Image
+    
+    sizes = []
+    for tile_path in tile_paths:
+        with Image.open(tile_path) as tile:
+            sizes.append(tile.size)
+    width = min(size[0] for size in sizes)
+    height = sum(size[1] for size in sizes)
+    check_image_size(output_format, width, height)
+    
+    if output_format == "png":
+        with open(output_path, "wb") as f:
+            writer = PNGStreamWriter(f, width, height)
+            for tile_path in tile_paths:
+                with Image.open(tile_path) as tile:
+                    writer.write_rows(tile.crop((0, 0, width, tile.height)))
+            writer.close()
+        return
+    
+    stitched = Image.new("RGB", (width, height), "white")
+    y = 0
+    for tile_path in tile_paths:
+        with Image.open(tile_path) as tile:
+            stitched.paste(tile.convert("RGB"), (0, y))
+            y += tile.height
+    save_image(stitched, output_path, output_format, quality)
 
 
 class HTML2Image:
@@ -17,7 +274,13 @@ class HTML2Image:
     
     def __init__(self):
         self.default_viewport = {"width": 1200, "height": 800}
-        self.supported_formats = ["png", "jpeg"]
+        self.supported_formats = ["png", "jpeg", "webp"]
+        # async with 块内共享的浏览器
+        self._browser = None
+        self._playwright_manager = None
+        self._session_depth = 0
+        # 有后台浏览器（html2image.py daemon start）时连接它，不再启动新的浏览器
+        self.use_daemon = True
     
     async def convert_file(self, html_path, output_path, options=None):
         """
@@ -38,37 +301,33 @@ class HTML2Image:
         # 获取输出格式
         output_format = self._get_output_format(output_path)
         
-        async with async_playwright() as p:
-            # 启动浏览器
-            browser = await p.chromium.launch(headless=True)
-            page = await browser.new_page()
-            
+        # HTML、本地资源和选项都没有变化时直接使用缓存的截图
+        cache = self._get_cache(options)
+        if cache is not None:
+            with open(html_path, "r", encoding="utf-8", errors="replace") as f:
+                html_content = f.read()
+            cache_key = cache.make_key(html_content, os.path.dirname(os.path.abspath(html_path)),
+                                       options, output_format)
+            if cache.fetch(cache_key, output_format, output_path):
+                logger.debug("命中截图缓存: %s", output_path)
+                return
+        
+        async with self._open_page(device_scale_factor=options.get("device_scale_factor", 1)) as page:
             # 设置视口大小
             viewport = options.get("viewport", self.default_viewport)
             await page.set_viewport_size(viewport)
             
             # 加载 HTML 文件
-            html_file_url = f"file://{os.path.abspath(html_path)}"
-            await page.goto(html_file_url, wait_until="networkidle")
-            
-            # 等待页面完全加载（特别是数学公式）
-            await page.wait_for_timeout(2000)
-            
-            # 截图选项
-            screenshot_options = {
-                "path": output_path,
-                "type": output_format,
-                "full_page": options.get("full_page", True)
-            }
-            
-            # 如果是 jpeg 格式，设置质量
-            if output_format == "jpeg":
-                screenshot_options["quality"] = options.get("quality", 90)
+            await self._load_file(page, html_path, options)
             
             # 截取图片
-            await page.screenshot(**screenshot_options)
-            
-            await browser.close()
+            start = time.perf_counter()
+            outputs = await self._capture(page, output_path, output_format, options)
+            logger.debug("截图完成: %s (%.2fs)", output_path, time.perf_counter() - start)
+        
+        # 超长页面改为分块输出时没有单张图片可以缓存
+        if cache is not None and outputs == [output_path]:
+            cache.store(cache_key, output_format, output_path)
     
     async def convert_html_string(self, html_content, output_path, options=None):
         """
@@ -85,36 +344,417 @@ class HTML2Image:
         # 获取输出格式
         output_format = self._get_output_format(output_path)
         
-        async with async_playwright() as p:
-            # 启动浏览器
-            browser = await p.chromium.launch(headless=True)
-            page = await browser.new_page()
-            
+        # 页面没有文件地址，不会加载本地资源，只按 HTML 和选项缓存
+        cache = self._get_cache(options)
+        if cache is not None:
+            cache_key = cache.make_key(html_content, None, options, output_format)
+            if cache.fetch(cache_key, output_format, output_path):
+                logger.debug("命中截图缓存: %s", output_path)
+                return
+        
+        async with self._open_page(device_scale_factor=options.get("device_scale_factor", 1)) as page:
             # 设置视口大小
             viewport = options.get("viewport", self.default_viewport)
             await page.set_viewport_size(viewport)
             
             # 设置 HTML 内容
+            router = await self._route_requests(page, options)
             await page.set_content(html_content, wait_until="networkidle")
             
             # 等待页面完全加载
             await page.wait_for_timeout(2000)
+            router.report("HTML 字符串", options.get("slow_request_ms", DEFAULT_SLOW_REQUEST_MS))
+            
+            # 截取图片
+            outputs = await self._capture(page, output_path, output_format, options)
+        
+        if cache is not None and outputs == [output_path]:
+            cache.store(cache_key, output_format, output_path)
+    
+    async def convert_file_variants(self, html_path, variants, options=None):
+        """
+        只加载一次 HTML 文件，输出多个规格的图片
+        
+        同一视口宽度只截图一次（按最大设备像素比），其余规格由 Pillow 缩放和转码得到；
+        不同宽度只需调整视口重新排版，不重新加载页面
+        
+        Args:
+            html_path: HTML 文件路径
+            variants: 输出规格列表，每项为字典：
+                path: 输出图片路径，格式由扩展名决定
+                quality: JPEG/WEBP 质量（默认沿用 options 中的 quality）
+                width: 视口宽度（默认沿用 options 中的视口宽度）
+                device_scale_factor: 设备像素比（默认 1）
+                thumbnail: (宽, 高)，按比例缩小到不超过该尺寸
+                max_bytes: JPEG/WEBP 的字节预算，在 quality 以内搜索满足预算的最高质量
+            options: 转换选项
+        
+        Returns:
+            输出图片路径列表
+        """
+        from PIL import Image
+        
+        if options is None:
+            options = {}
+        
+        # 验证输入文件
+        if not os.path.exists(html_path):
+            raise FileNotFoundError(f"HTML 文件不存在: {html_path}")
+        
+        viewport = dict(options.get("viewport", self.default_viewport))
+        specs = [self._normalize_variant(variant, options, viewport) for variant in variants]
+        max_scale = max(spec["device_scale_factor"] for spec in specs)
+        
+        groups = {}
+        for spec in specs:
+            groups.setdefault(spec["width"], []).append(spec)
+        
+        # 中间截图统一为完整的 PNG，分块输出对多规格没有意义
+        capture_options = dict(options, device_scale_factor=max_scale)
+        capture_options.pop("tile_output", None)
+        
+        async with self._open_page(viewport=viewport, device_scale_factor=max_scale) as page:
+            await self._load_file(page, html_path, options)
+            
+            with tempfile.TemporaryDirectory() as tmp_dir:
+                for width, group in groups.items():
+                    if width != page.viewport_size["width"]:
+                        # 只改变视口宽度，浏览器重新排版即可
+                        await page.set_viewport_size({"width": width, "height": viewport["height"]})
+                        await page.evaluate(
+                            "() => new Promise(r => requestAnimationFrame(() => requestAnimationFrame(r)))"
+                        )
+                    
+                    capture_path = os.path.join(tmp_dir, f"capture_{width}.png")
+                    await self._capture(page, capture_path, "png", capture_options)
+                    
+                    with Image.open(capture_path) as capture:
+                        capture.load()
+                        for spec in group:
+                            self._write_variant(capture, spec, max_scale)
+                            logger.debug("输出规格: %s (宽度 %d, 像素比 %s)",
+                                         spec["path"], width, spec["device_scale_factor"])
+        
+        return [spec["path"] for spec in specs]
+    
+    async def convert_file_sections(self, html_path, output_dir, options=None):
+        """
+        只加载一次 HTML 文件，把每个章节截取为单独的图片
+        
+        章节从一个匹配的标题开始，到下一个匹配的标题（不论级别）或文档末尾结束，章节之间不重叠；
+        第一个标题之前有内容时，从页面顶部到第一个标题的部分作为第一个章节，标题为页面的 <title>
+        
+        Args:
+            html_path: HTML 文件路径
+            output_dir: 输出目录，图片命名为 section_001.png 等，并写入 manifest.json
+            options: 转换选项，额外支持：
+                section_level: 按 h1 到 hN 的标题切分（默认: 2）
+                section_selector: 按 CSS 选择器匹配的元素切分，优先于 section_level
+                section_format: 输出格式 png/jpeg/webp（默认: png）
+        
+        Returns:
+            章节清单列表，每项包含 index、title、path
+        """
+        if options is None:
+            options = {}
+        
+        # 验证输入文件
+        if not os.path.exists(html_path):
+            raise FileNotFoundError(f"HTML 文件不存在: {html_path}")
+        
+        selector = options.get("section_selector")
+        if not selector:
+            level = options.get("section_level", 2)
+            selector = ", ".join(f"h{n}" for n in range(1, level + 1))
+        output_format = options.get("section_format", "png")
+        ext = "jpg" if output_format == "jpeg" else output_format
+        os.makedirs(output_dir, exist_ok=True)
+        
+        async with self._open_page(device_scale_factor=options.get("device_scale_factor", 1)) as page:
+            await page.set_viewport_size(options.get("viewport", self.default_viewport))
+            await self._load_file(page, html_path, options)
             
-            # 截图选项
-            screenshot_options = {
-                "path": output_path,
-                "type": output_format,
-                "full_page": options.get("full_page", True)
-            }
+            sections = await page.evaluate(SECTION_BOUNDS_JS, selector)
+            width, _ = await self._measure_page(page)
             
-            # 如果是 jpeg 格式，设置质量
-            if output_format == "jpeg":
-                screenshot_options["quality"] = options.get("quality", 90)
+            manifest = []
+            for index, section in enumerate(sections, start=1):
+                output_path = os.path.join(output_dir, f"section_{index:03d}.{ext}")
+                clip = {
+                    "x": 0,
+                    "y": section["top"],
+                    "width": width,
+                    "height": max(1, section["bottom"] - section["top"])
+                }
+                await self._screenshot_clip(page, output_path, output_format, clip, options)
+                manifest.append({"index": index, "title": section["title"], "path": output_path})
+                logger.debug("章节 %d: %s (%s)", index, section["title"], output_path)
+        
+        with open(os.path.join(output_dir, "manifest.json"), "w", encoding="utf-8") as f:
+            json.dump(manifest, f, ensure_ascii=False, indent=2)
+        
+        return manifest
+    
+    def _normalize_variant(self, variant, options, viewport):
+        """补全输出规格的默认值"""
+        return {
+            "path": variant["path"],
+            "format": self._get_output_format(variant["path"]),
+            "quality": variant.get("quality", options.get("quality", 90)),
+            "width": variant.get("width", viewport["width"]),
+            "device_scale_factor": variant.get("device_scale_factor", options.get("device_scale_factor", 1)),
+            "thumbnail": variant.get("thumbnail"),
+            "max_bytes": variant.get("max_bytes"),
+            "allow_scale": variant.get("allow_scale", options.get("allow_scale", False))
+        }
+    
+    def _write_variant(self, capture, spec, capture_scale):
+        """从一次截图派生出一个输出规格"""
+        from PIL import Image
+        
+        image = capture
+        ratio = spec["device_scale_factor"] / capture_scale
+        if ratio != 1:
+            size = (max(1, round(capture.width * ratio)), max(1, round(capture.height * ratio)))
+            image = capture.resize(size, Image.LANCZOS)
+        if spec["thumbnail"]:
+            image = image.copy()
+            image.thumbnail(spec["thumbnail"], Image.LANCZOS)
+        if spec["max_bytes"] and spec["format"] in BUDGET_FORMATS:
+            save_image_within_budget(image, spec["path"], spec["format"], spec["max_bytes"],
+                                     spec["quality"], spec["allow_scale"])
+            return
+        save_image(image, spec["path"], spec["format"], spec["quality"])
+    
+    def _get_cache(self, options):
+        """
+        按选项返回截图缓存，cache 为 False 或分块输出多张图片时返回 None
+        
+        缓存相关选项：cache（默认 True）、cache_dir、cache_max_bytes
+        """
+        if not options.get("cache", True) or options.get("tile_output") == "split":
+            return None
+        return ScreenshotCache(options.get("cache_dir"), options.get("cache_max_bytes", DEFAULT_MAX_BYTES))
+    
+    def _playwright(self):
+        """返回 Playwright 的上下文管理器，playwright 在这里才导入"""
+        from playwright.async_api import async_playwright
+        return async_playwright()
+    
+    async def __aenter__(self):
+        """
+        启动一个浏览器，在 async with 块内的所有转换共用，不再每次转换都启动
+        """
+        if self._session_depth == 0:
+            self._playwright_manager = self._playwright()
+            playwright = await self._playwright_manager.__aenter__()
+            self._browser = await self._launch_browser(playwright)
+        self._session_depth += 1
+        return self
+    
+    async def __aexit__(self, exc_type, exc, tb):
+        self._session_depth -= 1
+        if self._session_depth == 0:
+            await self._browser.close()
+            await self._playwright_manager.__aexit__(exc_type, exc, tb)
+            self._browser = None
+            self._playwright_manager = None
+    
+    async def _launch_browser(self, playwright):
+        """
+        优先通过 CDP 连接后台浏览器，没有后台浏览器或连接失败时启动新的浏览器
+        
+        连接后台浏览器时 close() 只断开连接，不会关闭后台浏览器
+        """
+        if self.use_daemon:
+            browser = await browser_daemon.connect(playwright)
+            if browser is not None:
+                return browser
+        return await playwright.chromium.launch(headless=True)
+    
+    @contextlib.asynccontextmanager
+    async def _open_page(self, **page_options):
+        """
+        打开一个新页面，用完后关闭
+        
+        在 async with HTML2Image() 块内时使用共享的浏览器，否则临时启动一个
+        """
+        if self.use_daemon:
+            browser_daemon.touch_state()
+        if self._browser is not None:
+            page = await self._browser.new_page(**page_options)
+            try:
+                yield page
+            finally:
+                await page.close()
+            return
+        
+        async with self._playwright() as p:
+            # 启动浏览器
+            browser = await self._launch_browser(p)
+            try:
+                yield await browser.new_page(**page_options)
+            finally:
+                await browser.close()
+    
+    async def _route_requests(self, page, options):
+        """
+        在页面上安装请求拦截，外部资源优先从本地资源缓存返回
+        
+        相关选项：resource_cache（默认 True）、resource_cache_dir、
+        resource_policy（未缓存资源的处理策略 fetch/allow/stub/block，默认 fetch）
+        """
+        cache = None
+        if options.get("resource_cache", True):
+            cache = ResourceCache(options.get("resource_cache_dir"))
+        router = RequestRouter(cache, options.get("resource_policy", DEFAULT_RESOURCE_POLICY))
+        await router.install(page)
+        return router
+    
+    async def _load_file(self, page, html_path, options=None):
+        """加载 HTML 文件并等待渲染完成，日志中列出耗时超过 slow_request_ms 的请求"""
+        if options is None:
+            options = {}
+        
+        start = time.perf_counter()
+        router = await self._route_requests(page, options)
+        html_file_url = f"file://{os.path.abspath(html_path)}"
+        await page.goto(html_file_url, wait_until="networkidle")
+        
+        # 等待页面完全加载（特别是数学公式）
+        await page.wait_for_timeout(2000)
+        logger.debug("页面加载完成: %s (%.2fs)", html_path, time.perf_counter() - start)
+        router.report(html_path, options.get("slow_request_ms", DEFAULT_SLOW_REQUEST_MS))
+    
+    async def _capture(self, page, output_path, output_format, options):
+        """
+        按选项截取已加载的页面
+        
+        设置了 tile_height，或整页高度超过浏览器纹理上限时，改为分块截图；
+        JPEG/WEBP 设置了 max_bytes 时只截图一次，在内存中搜索满足字节预算的编码质量，
+        allow_scale 为真时必要时同时缩小图片
+        """
+        max_bytes = options.get("max_bytes")
+        if max_bytes and output_format in BUDGET_FORMATS and options.get("tile_output") != "split":
+            from PIL import Image
             
-            # 截取图片
-            await page.screenshot(**screenshot_options)
+            with tempfile.TemporaryDirectory() as tmp_dir:
+                capture_path = os.path.join(tmp_dir, "capture.png")
+                await self._capture(page, capture_path, "png", dict(options, max_bytes=None))
+                with Image.open(capture_path) as image:
+                    image.load()
+                    save_image_within_budget(image, output_path, output_format, max_bytes,
+                                             options.get("quality", 90), options.get("allow_scale", False))
+            return [output_path]
+        
+        full_page = options.get("full_page", True)
+        tile_height = options.get("tile_height")
+        if not tile_height and options.get("tile_output") == "split":
+            tile_height = DEFAULT_TILE_HEIGHT
+        
+        if full_page and not tile_height:
+            # 整页位图超过纹理上限时会出现空白或截断，自动改为分块截图
+            width, height = await self._measure_page(page)
+            scale = options.get("device_scale_factor", 1)
+            if height * scale > MAX_TEXTURE_SIZE:
+                tile_height = DEFAULT_TILE_HEIGHT
+                logger.info("页面高度 %dpx 超过纹理上限，改为分块截图", height)
+        
+        if full_page and tile_height:
+            return await self._capture_tiles(page, output_path, output_format, options, tile_height)
+        
+        if output_format not in NATIVE_FORMATS:
+            from PIL import Image
+            
+            data = await page.screenshot(type="png", full_page=full_page)
+            with Image.open(io.BytesIO(data)) as image:
+                save_image(image, output_path, output_format, options.get("quality", 90))
+            return [output_path]
+        
+        # 截图选项
+        screenshot_options = {
+            "path": output_path,
+            "type": output_format,
+            "full_page": full_page
+        }
+        
+        # 如果是 jpeg 格式，设置质量
+        if output_format == "jpeg":
+            screenshot_options["quality"] = options.get("quality", 90)
+        
+        await page.screenshot(**screenshot_options)
+        return [output_path]
+    
+    async def _measure_page(self, page):
+        """测量文档的 CSS 像素宽高"""
+        size = await page.evaluate(
+            "() => [document.documentElement.scrollWidth, document.documentElement.scrollHeight]"
+        )
+        return size[0], size[1]
+    
+    async def _capture_tiles(self, page, output_path, output_format, options, tile_height):
+        """
+        按固定高度分块截图
+        
+        tile_output 为 "split" 时每块输出为单独的编号图片，
+        否则拼接为一张图片（PNG 逐行写入，峰值内存只有一个分块）；
+        JPEG/WEBP 拼接结果超出格式的边长上限或 MAX_STITCH_PIXELS 时给出警告，改为分块输出
+        """
+        width, height = await self._measure_page(page)
+        split = options.get("tile_output") == "split"
+        if not split and output_format != "png":
+            scale = options.get("device_scale_factor", 1)
+            pixel_width, pixel_height = round(width * scale), round(height * scale)
+            limit = FORMAT_MAX_SIZE.get(output_format)
+            if limit is not None and max(pixel_width, pixel_height) > limit:
+                logger.warning("%s 图片的边长不能超过 %d 像素（当前 %dx%d），改为分块输出",
+                               output_format.upper(), limit, pixel_width, pixel_height)
+                split = True
+            elif pixel_width * pixel_height > MAX_STITCH_PIXELS:
+                logger.warning("拼接为 %s 需要 %dx%d 的完整位图，改为分块输出；需要单张图片时请使用 PNG",
+                               output_format.upper(), pixel_width, pixel_height)
+                split = True
+        output = Path(output_path)
+        
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            tile_paths = []
+            for index, y in enumerate(range(0, height, tile_height), start=1):
+                if split:
+                    tile_path = str(output.with_name(f"{output.stem}_{index:03d}{output.suffix}"))
+                else:
+                    tile_path = os.path.join(tmp_dir, f"tile_{index:05d}.png")
+                
+                clip = {"x": 0, "y": y, "width": width, "height": min(tile_height, height - y)}
+                await self._screenshot_clip(page, tile_path, output_format if split else "png", clip, options)
+                tile_paths.append(tile_path)
+                logger.debug("分块 %d: y=%d (%s)", index, y, tile_path)
+            
+            if split:
+                return tile_paths
             
-            await browser.close()
+            stitch_tiles(tile_paths, output_path, output_format, options.get("quality", 90))
+            return [output_path]
+    
+    async def _screenshot_clip(self, page, output_path, output_format, clip, options):
+        """截取页面坐标系中的一个矩形区域"""
+        native_format = output_format if output_format in NATIVE_FORMATS else "png"
+        screenshot_options = {
+            "type": native_format,
+            "full_page": True,
+            "clip": clip
+        }
+        if native_format == "jpeg":
+            screenshot_options["quality"] = options.get("quality", 90)
+        
+        data = await page.screenshot(**screenshot_options)
+        if native_format != output_format:
+            from PIL import Image
+            
+            with Image.open(io.BytesIO(data)) as image:
+                save_image(image, output_path, output_format, options.get("quality", 90))
+        else:
+            with open(output_path, "wb") as f:
+                f.write(data)
     
     def _get_output_format(self, output_path):
         """获取输出格式"""
@@ -123,12 +763,18 @@ class HTML2Image:
             return "png"
         elif ext in [".jpg", ".jpeg"]:
             return "jpeg"
+        elif ext == ".webp":
+            return "webp"
         else:
             raise ValueError(f"不支持的图片格式: {ext}. 支持的格式: {self.supported_formats}")
 
 
 def main():
     """命令行主函数"""
+    if len(sys.argv) > 1 and sys.argv[1] == "daemon":
+        browser_daemon.main(sys.argv[2:])
+        return
+    
     if len(sys.argv) < 3:
         print("用法: python html2image.py <HTML文件> <输出图片> [选项]")
         print("选项:")
@@ -136,12 +782,30 @@ def main():
         print("  --height HEIGHT   设置页面高度 (默认: 800)")
         print("  --quality QUALITY 设置JPEG质量 (1-100, 默认: 90)")
         print("  --no-full-page    不截取整个页面，只截取可见区域")
+        print("  --tile-height H   按高度 H 分块截图后拼接，适合超长页面")
+        print("  --split-tiles     分块结果输出为单独的编号图片，不拼接")
+        print("  --scale SCALE     设置设备像素比 (默认: 1)")
+        print("  --max-bytes SIZE  JPEG/WEBP 的字节预算，如 200K，在 --quality 以内搜索满足预算的最高质量")
+        print("  --allow-scale     最低质量仍超出字节预算时缩小图片")
+        print("  --no-cache        不使用截图缓存，总是重新截图")
+        print("  --resource-policy P  未缓存的外部资源: fetch 联网并缓存, allow 联网, stub 返回空内容, block 拒绝 (默认: fetch)")
+        print("  --no-resource-cache  不使用外部资源缓存")
+        print("  --variant SPEC    额外输出规格，可重复，与主输出共用一次页面加载")
+        print("                    格式: 路径[:width=W,quality=Q,scale=S,thumb=WxH,max_bytes=SIZE]")
+        print("  --sections LEVEL  按 h1~hLEVEL 标题把每个章节截为单独图片，输出参数作为目录")
+        print("  --section-selector SEL  按 CSS 选择器切分章节，输出参数作为目录")
+        print("  --no-daemon       不连接后台浏览器，总是启动新的浏览器")
+        print("  --verbose         输出详细的处理日志")
+        print()
+        print("后台浏览器: python html2image.py daemon start|stop|status [--idle-timeout SEC]")
         print()
-        print("支持的图片格式: png, jpg, jpeg")
+        print("支持的图片格式: png, jpg, jpeg, webp")
         print()
         print("示例:")
         print("  python html2image.py input.html output.png")
         print("  python html2image.py input.html output.jpg --width 800 --quality 95")
+        print("  python html2image.py input.html output.png --variant output.webp:quality=80 --variant thumb.jpg:thumb=400x300")
+        print("  python html2image.py input.html sections/ --sections 2")
         sys.exit(1)
     
     html_path = sys.argv[1]
@@ -154,6 +818,10 @@ def main():
         "quality": 90
     }
     
+    variants = []
+    sections = False
+    verbose = False
+    use_daemon = True
     i = 3
     while i < len(sys.argv):
         arg = sys.argv[i]
@@ -169,16 +837,71 @@ def main():
         elif arg == "--no-full-page":
             options["full_page"] = False
             i += 1
+        elif arg == "--tile-height" and i + 1 < len(sys.argv):
+            options["tile_height"] = int(sys.argv[i + 1])
+            i += 2
+        elif arg == "--split-tiles":
+            options["tile_output"] = "split"
+            i += 1
+        elif arg == "--no-cache":
+            options["cache"] = False
+            i += 1
+        elif arg == "--resource-policy" and i + 1 < len(sys.argv):
+            options["resource_policy"] = sys.argv[i + 1]
+            i += 2
+        elif arg == "--no-resource-cache":
+            options["resource_cache"] = False
+            i += 1
+        elif arg == "--scale" and i + 1 < len(sys.argv):
+            options["device_scale_factor"] = float(sys.argv[i + 1])
+            i += 2
+        elif arg == "--max-bytes" and i + 1 < len(sys.argv):
+            options["max_bytes"] = parse_size(sys.argv[i + 1])
+            i += 2
+        elif arg == "--allow-scale":
+            options["allow_scale"] = True
+            i += 1
+        elif arg == "--variant" and i + 1 < len(sys.argv):
+            variants.append(parse_variant(sys.argv[i + 1]))
+            i += 2
+        elif arg == "--sections" and i + 1 < len(sys.argv):
+            options["section_level"] = int(sys.argv[i + 1])
+            sections = True
+            i += 2
+        elif arg == "--section-selector" and i + 1 < len(sys.argv):
+            options["section_selector"] = sys.argv[i + 1]
+            sections = True
+            i += 2
+        elif arg == "--no-daemon":
+            use_daemon = False
+            i += 1
+        elif arg == "--verbose":
+            verbose = True
+            i += 1
         else:
             print(f"未知选项: {arg}")
             sys.exit(1)
     
+    configure_logging(verbose)
+    
     # 创建转换器并执行转换
     converter = HTML2Image()
+    converter.use_daemon = use_daemon
     
     try:
-        asyncio.run(converter.convert_file(html_path, output_path, options))
-        print(f"转换完成: {output_path}")
+        if sections:
+            manifest = asyncio.run(converter.convert_file_sections(html_path, output_path, options))
+            for item in manifest:
+                print(f"  {item['path']}: {item['title']}")
+            print(f"转换完成: {len(manifest)} 个章节 -> {output_path}")
+        elif variants:
+            # 主输出与单独输出时一样遵守 --max-bytes
+            variants.insert(0, {"path": output_path, "max_bytes": options.get("max_bytes")})
+            outputs = asyncio.run(converter.convert_file_variants(html_path, variants, options))
+            print(f"转换完成: {', '.join(outputs)}")
+        else:
+            asyncio.run(converter.convert_file(html_path, output_path, options))
+            print(f"转换完成: {output_path}")
     except Exception as e:
         print(f"转换失败: {e}")
         sys.exit(1)
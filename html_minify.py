@@ -0,0 +1,245 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+HTML 压缩与预压缩
+去掉模板缩进和多余空白、压缩 <style> 和 style 属性中的 CSS，<pre>、<code>、<textarea>、<script> 的内容保持原样；
+并在 HTML 旁边写出 .gz（安装了 brotli 时还有 .br）文件，静态服务器可以直接返回，不必在请求时压缩
+
+用法: python html_minify.py 文件.html... [--no-minify] [--no-precompress]
+"""
+
+import os
+import re
+import sys
+import gzip
+import time
+import shutil
+
+
+# 读写文件的块大小
+CHUNK_SIZE = 1024 * 1024
+# gzip 和 brotli 的压缩级别，预压缩只做一次，取最高级别
+GZIP_LEVEL = 9
+BROTLI_QUALITY = 11
+
+# 标签内部：引号中的 > 不结束标签
+TAG_BODY = r'''(?:[^>"']|"[^"]*"|'[^']*')*'''
+# 内容保持原样（<style> 只压缩 CSS）的元素；注释单独匹配，条件注释保留
+PROTECTED_PATTERN = re.compile(
+    r'<(pre|code|textarea|script|style)\b' + TAG_BODY + r'>.*?</\1\s*>|<!--.*?-->',
+    re.DOTALL | re.IGNORECASE
+)
+TAG_PATTERN = re.compile(r'<[a-zA-Z/!]' + TAG_BODY + '>')
+# 标签内的属性，值中的空白保持原样
+ATTRIBUTE_PATTERN = re.compile(r'''([^\s=/>]+)(?:\s*=\s*("[^"]*"|'[^']*'|[^\s>]+))?''')
+STYLE_ATTRIBUTE_PATTERN = re.compile(r'''(?<=\s)style=(["'])(.*?)\1''', re.DOTALL | re.IGNORECASE)
+CSS_COMMENT_PATTERN = re.compile(r'/\*.*?\*/', re.DOTALL)
+CSS_PUNCTUATION_PATTERN = re.compile(r'\s*([{};,>])\s*')
+WHITESPACE_PATTERN = re.compile(r'\s+')
+BLOCK_TAG_NAME_PATTERN = re.compile(r'</?([a-zA-Z][a-zA-Z0-9]*)')
+
+# 两侧都是块级元素时空白不影响排版，可以整个去掉；否则保留一个空格
+# （MathJax 会把 <script type="math/tex"> 替换为行内公式，script 不算块级）
+BLOCK_TAGS = {
+    'html', 'head', 'body', 'title', 'meta', 'link', 'style', 'div', 'p',
+    'h1', 'h2', 'h3', 'h4', 'h5', 'h6', 'ul', 'ol', 'li', 'dl', 'dt', 'dd',
+    'table', 'thead', 'tbody', 'tfoot', 'tr', 'th', 'td', 'blockquote', 'pre',
+    'hr', 'br', 'nav', 'section', 'article', 'header', 'footer', 'main', 'figure', 'figcaption'
+}
+
+
+def minify_css(css):
+    """去掉注释和多余空白；选择器中的空格（后代选择器）保留"""
+    css = CSS_COMMENT_PATTERN.sub('', css)
+    css = WHITESPACE_PATTERN.sub(' ', css)
+    css = CSS_PUNCTUATION_PATTERN.sub(r'\1', css)
+    # 声明中冒号后的空格可以去掉；冒号前的空格在选择器中有意义（a :hover），不动
+    css = re.sub(r':\s+', ':', css)
+    return css.replace(';}', '}').strip()
+
+
+def _minify_style_attribute(match):
+    quote, value = match.group(1), match.group(2)
+    value = re.sub(r'\s*;\s*', ';', WHITESPACE_PATTERN.sub(' ', value))
+    value = re.sub(r'\s*:\s*', ':', value).strip().rstrip(';')
+    return f'style={quote}{value}{quote}'
+
+
+def _minify_tag(tag):
+    """压缩标签内属性之间的空白和 style 属性，属性值保持原样"""
+    if tag.startswith('<!') or tag.startswith('</'):
+        return WHITESPACE_PATTERN.sub(' ', tag)
+    closing = '/>' if tag.endswith('/>') else '>'
+    name_end = re.match(r'<[^\s/>]+', tag).end()
+    body = tag[name_end:len(tag) - len(closing)]
+    attributes = [match.group(0) for match in ATTRIBUTE_PATTERN.finditer(body)]
+    result = tag[:name_end] + ''.join(' ' + attribute for attribute in attributes)
+    result = STYLE_ATTRIBUTE_PATTERN.sub(_minify_style_attribute, result)
+    return result + (' />' if closing == '/>' else '>')
+
+
+def _is_block_tag(tag):
+    match = BLOCK_TAG_NAME_PATTERN.match(tag)
+    return tag.startswith('<!') or (match is not None and match.group(1).lower() in BLOCK_TAGS)
+
+
+def _minify_markup(markup, pieces, next_tag):
+    """
+    压缩不含受保护元素的一段 HTML，结果追加到 pieces
+    
+    next_tag: 这段 HTML 之后的标签（受保护元素的开始标签），位于末尾时为 None
+    """
+    pos = 0
+    for match in TAG_PATTERN.finditer(markup):
+        _append_text(pieces, markup[pos:match.start()], match.group(0))
+        pieces.append(_minify_tag(match.group(0)))
+        pos = match.end()
+    _append_text(pieces, markup[pos:], next_tag)
+
+
+def _append_text(pieces, text, next_tag):
+    if not text:
+        return
+    text = WHITESPACE_PATTERN.sub(' ', text)
+    if text == ' ':
+        # 只有空白时，两侧都是块级标签（或位于开头结尾）才去掉，行内元素之间的空格会显示出来
+        previous = pieces[-1] if pieces else None
+        previous_block = previous is None or (previous.startswith('<') and _is_block_tag(previous))
+        next_block = next_tag is None or _is_block_tag(next_tag)
+        if previous_block and next_block:
+            return
+    pieces.append(text)
+
+
+def minify_html(html):
+    """
+    压缩 HTML
+    
+    <pre>、<code>、<textarea>、<script> 的内容和条件注释保持原样，其他注释删除；
+    文本中的连续空白合并为一个空格，两侧都是块级标签的空白删除；
+    <style> 元素和 style 属性中的 CSS 去掉多余空白
+    """
+    pieces = []
+    pos = 0
+    for match in PROTECTED_PATTERN.finditer(html):
+        _minify_markup(html[pos:match.start()], pieces, match.group(0))
+        protected = match.group(0)
+        if protected.startswith('<!--'):
+            if protected.startswith('<!--['):
+                pieces.append(protected)
+        else:
+            # 开始和结束标签仍然压缩，内容不动
+            open_end = TAG_PATTERN.match(protected).end()
+            close_start = protected.rindex('</')
+            content = protected[open_end:close_start]
+            pieces.append(_minify_tag(protected[:open_end]))
+            pieces.append(minify_css(content) if match.group(1).lower() == 'style' else content)
+            pieces.append(_minify_tag(protected[close_start:]))
+        pos = match.end()
+    _minify_markup(html[pos:], pieces, None)
+    return ''.join(pieces).strip()
+
+
+def _brotli_compressor():
+    """安装了 brotli 时返回压缩器，否则返回 None"""
+    try:
+        import brotli
+    except ImportError:
+        return None
+    return brotli.Compressor(quality=BROTLI_QUALITY)
+
+
+def write_precompressed(path):
+    """
+    在 path 旁边写出 .gz 和 .br 文件（没有安装 brotli 时跳过 .br），按块压缩，不整体读入内存
+    
+    Returns:
+        [{'path', 'bytes', 'seconds'}]，每种压缩格式一项
+    """
+    results = []
+    
+    start = time.perf_counter()
+    gz_path = path + '.gz'
+    with open(path, 'rb') as src, open(gz_path, 'wb') as raw:
+        # mtime 固定为 0，内容相同时压缩结果也相同
+        with gzip.GzipFile(filename='', mode='wb', fileobj=raw, compresslevel=GZIP_LEVEL, mtime=0) as dst:
+            shutil.copyfileobj(src, dst, CHUNK_SIZE)
+    results.append({'path': gz_path, 'bytes': os.path.getsize(gz_path), 'seconds': time.perf_counter() - start})
+    
+    compressor = _brotli_compressor()
+    if compressor is not None:
+        start = time.perf_counter()
+        br_path = path + '.br'
+        with open(path, 'rb') as src, open(br_path, 'wb') as dst:
+            for chunk in iter(lambda: src.read(CHUNK_SIZE), b''):
+                dst.write(compressor.process(chunk))
+            dst.write(compressor.finish())
+        results.append({'path': br_path, 'bytes': os.path.getsize(br_path), 'seconds': time.perf_counter() - start})
+    
+    return results
+
+
+def format_report(html_path, minify_seconds=None, saved_bytes=0, compressed=()):
+    """
+    生成压缩结果的报告行：各阶段的字节数、压缩比例和耗时
+    
+    Args:
+        html_path: 写出的 HTML 文件
+        minify_seconds: 压缩 HTML 的耗时，None 表示没有压缩
+        saved_bytes: 压缩 HTML 减少的字节数
+        compressed: write_precompressed 的返回值
+    """
+    size = os.path.getsize(html_path)
+    original_bytes = size + saved_bytes
+    lines = []
+    if minify_seconds is not None:
+        lines.append(f"压缩 HTML: {original_bytes} -> {size} 字节 "
+                     f"({size / max(original_bytes, 1):.1%})，耗时 {minify_seconds * 1000:.0f}ms")
+    for item in compressed:
+        lines.append(f"预压缩 {os.path.basename(item['path'])}: {item['bytes']} 字节 "
+                     f"({item['bytes'] / max(size, 1):.1%})，耗时 {item['seconds'] * 1000:.0f}ms")
+    return lines
+
+
+def main():
+    """命令行主函数：原地压缩已生成的 HTML 文件"""
+    paths = []
+    minify = True
+    compress = True
+    for arg in sys.argv[1:]:
+        if arg == "--no-minify":
+            minify = False
+        elif arg == "--no-precompress":
+            compress = False
+        elif arg.startswith("--"):
+            print(f"未知选项: {arg}")
+            sys.exit(1)
+        else:
+            paths.append(arg)
+    
+    if not paths:
+        print("用法: python html_minify.py 文件.html... [--no-minify] [--no-precompress]")
+        print("  原地压缩 HTML，并在旁边写出 .gz（安装了 brotli 时还有 .br）文件")
+        sys.exit(1)
+    
+    for path in paths:
+        minify_seconds = None
+        saved_bytes = 0
+        if minify:
+            with open(path, 'r', encoding='utf-8') as f:
+                html = f.read()
+            start = time.perf_counter()
+            minified = minify_html(html)
+            minify_seconds = time.perf_counter() - start
+            saved_bytes = len(html.encode('utf-8')) - len(minified.encode('utf-8'))
+            html = minified
+            with open(path, 'w', encoding='utf-8') as f:
+                f.write(html)
+        compressed = write_precompressed(path) if compress else []
+        print(path)
+        for line in format_report(path, minify_seconds, saved_bytes, compressed):
+            print(f"  {line}")
+
+
+if __name__ == "__main__":
+    main()
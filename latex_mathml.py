@@ -0,0 +1,680 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+LaTeX 转 MathML
+纯 Python 实现，不启动子进程，输出浏览器原生支持的 MathML Core：
+不需要图片也不需要 JavaScript，Chromium（包括 HTML2Image 截图）、Firefox 和 Safari 都能直接显示。
+覆盖常用的公式语法（上下标、分数、根号、希腊字母和常用符号、\\left...\\right、重音、字体、矩阵和 cases 等环境），
+遇到不支持的命令时抛出 MathMLError，由调用方改用图片等其他方式
+
+用法: python latex_mathml.py "LaTeX 公式" [--display]
+"""
+
+import re
+import html
+import sys
+
+
+class MathMLError(ValueError):
+    """公式中有无法转换的语法"""
+
+
+# 希腊字母：小写按变量显示为斜体，大写为直立体
+GREEK_LETTERS = {
+    'alpha': 'α', 'beta': 'β', 'gamma': 'γ', 'delta': 'δ', 'epsilon': 'ϵ', 'varepsilon': 'ε',
+    'zeta': 'ζ', 'eta': 'η', 'theta': 'θ', 'vartheta': 'ϑ', 'iota': 'ι', 'kappa': 'κ',
+    'lambda': 'λ', 'mu': 'μ', 'nu': 'ν', 'xi': 'ξ', 'pi': 'π', 'varpi': 'ϖ', 'rho': 'ρ',
+    'varrho': 'ϱ', 'sigma': 'σ', 'varsigma': 'ς', 'tau': 'τ', 'upsilon': 'υ', 'phi': 'ϕ',
+    'varphi': 'φ', 'chi': 'χ', 'psi': 'ψ', 'omega': 'ω',
+}
+UPPER_GREEK_LETTERS = {
+    'Gamma': 'Γ', 'Delta': 'Δ', 'Theta': 'Θ', 'Lambda': 'Λ', 'Xi': 'Ξ', 'Pi': 'Π',
+    'Sigma': 'Σ', 'Upsilon': 'Υ', 'Phi': 'Φ', 'Psi': 'Ψ', 'Omega': 'Ω',
+}
+# 不是运算符的符号（<mi>）
+SYMBOL_IDENTIFIERS = {
+    'infty': '∞', 'partial': '∂', 'nabla': '∇', 'forall': '∀', 'exists': '∃', 'nexists': '∄',
+    'emptyset': '∅', 'varnothing': '∅', 'ell': 'ℓ', 'hbar': 'ℏ', 'Re': 'ℜ', 'Im': 'ℑ',
+    'aleph': 'ℵ', 'angle': '∠', 'triangle': '△', 'top': '⊤', 'bot': '⊥', 'wp': '℘',
+    'ldots': '…', 'dots': '…', 'cdots': '⋯', 'vdots': '⋮', 'ddots': '⋱',
+}
+# 运算符、关系符和箭头（<mo>）
+SYMBOL_OPERATORS = {
+    'pm': '±', 'mp': '∓', 'times': '×', 'div': '÷', 'cdot': '⋅', 'ast': '∗', 'star': '⋆',
+    'circ': '∘', 'bullet': '∙', 'oplus': '⊕', 'ominus': '⊖', 'otimes': '⊗', 'odot': '⊙',
+    'cap': '∩', 'cup': '∪', 'wedge': '∧', 'land': '∧', 'vee': '∨', 'lor': '∨',
+    'setminus': '∖', 'neg': '¬', 'lnot': '¬', 'mid': '∣', 'parallel': '∥', 'backslash': '∖',
+    'leq': '≤', 'le': '≤', 'geq': '≥', 'ge': '≥', 'neq': '≠', 'ne': '≠', 'approx': '≈',
+    'equiv': '≡', 'sim': '∼', 'simeq': '≃', 'cong': '≅', 'propto': '∝', 'll': '≪', 'gg': '≫',
+    'in': '∈', 'notin': '∉', 'ni': '∋', 'subset': '⊂', 'supset': '⊃', 'subseteq': '⊆',
+    'supseteq': '⊇', 'perp': '⊥', 'prec': '≺', 'succ': '≻', 'preceq': '⪯', 'succeq': '⪰',
+    'vdash': '⊢', 'models': '⊨', 'colon': ':', 'to': '→', 'rightarrow': '→', 'leftarrow': '←',
+    'gets': '←', 'leftrightarrow': '↔', 'Rightarrow': '⇒', 'Leftarrow': '⇐',
+    'Leftrightarrow': '⇔', 'iff': '⟺', 'implies': '⟹', 'mapsto': '↦', 'uparrow': '↑',
+    'downarrow': '↓', 'longrightarrow': '⟶', 'longleftarrow': '⟵', 'Longrightarrow': '⟹',
+    'Longleftarrow': '⟸', 'longmapsto': '⟼', 'langle': '⟨', 'rangle': '⟩', 'lfloor': '⌊',
+    'rfloor': '⌋', 'lceil': '⌈', 'rceil': '⌉', 'vert': '|', 'lvert': '|', 'rvert': '|',
+    'Vert': '‖', 'lVert': '‖', 'rVert': '‖', 'prime': '′',
+}
+# 大型运算符；除积分外，上下限在行间公式中写在运算符的上下方
+LARGE_OPERATORS = {
+    'sum': '∑', 'prod': '∏', 'coprod': '∐', 'bigcup': '⋃', 'bigcap': '⋂', 'bigoplus': '⨁',
+    'bigotimes': '⨂', 'bigvee': '⋁', 'bigwedge': '⋀',
+    'int': '∫', 'iint': '∬', 'iiint': '∭', 'oint': '∮',
+}
+INTEGRALS = {'int', 'iint', 'iiint', 'oint'}
+# 函数名，直立体显示
+FUNCTIONS = {
+    'sin', 'cos', 'tan', 'cot', 'sec', 'csc', 'arcsin', 'arccos', 'arctan', 'sinh', 'cosh', 'tanh',
+    'coth', 'log', 'ln', 'lg', 'exp', 'dim', 'ker', 'deg', 'arg', 'hom',
+}
+LIMIT_FUNCTIONS = {
+    'lim': 'lim', 'liminf': 'lim inf', 'limsup': 'lim sup', 'max': 'max', 'min': 'min',
+    'sup': 'sup', 'inf': 'inf', 'det': 'det', 'gcd': 'gcd', 'Pr': 'Pr',
+}
+# 间距（em）
+SPACES = {
+    ',': 0.1667, ':': 0.2222, '>': 0.2222, ';': 0.2778, '!': -0.1667, ' ': 0.25,
+    'quad': 1, 'qquad': 2, 'enspace': 0.5, 'thinspace': 0.1667,
+}
+# 重音和上下方的括线：命令 -> (上方/下方, 符号, 是否可伸展)
+ACCENTS = {
+    'hat': ('over', '^', False), 'widehat': ('over', '^', True), 'bar': ('over', '¯', False),
+    'overline': ('over', '‾', True), 'vec': ('over', '→', False), 'tilde': ('over', '~', False),
+    'widetilde': ('over', '~', True), 'dot': ('over', '˙', False), 'ddot': ('over', '¨', False),
+    'check': ('over', 'ˇ', False), 'breve': ('over', '˘', False), 'acute': ('over', '´', False),
+    'grave': ('over', '`', False), 'overrightarrow': ('over', '→', True),
+    'overleftarrow': ('over', '←', True), 'overbrace': ('over', '⏞', True),
+    'underline': ('under', '‾', True), 'underbrace': ('under', '⏟', True),
+}
+# 字体命令 -> 字母表；MathML Core 的 mathvariant 只支持 normal，其他字体直接使用 Unicode 数学字母
+FONT_COMMANDS = {
+    'mathrm': 'normal', 'mathit': 'italic', 'mathbf': 'bold', 'boldsymbol': 'bold-italic',
+    'bm': 'bold-italic', 'mathbb': 'double-struck', 'mathcal': 'script', 'mathscr': 'script',
+    'mathfrak': 'fraktur', 'mathsf': 'sans-serif', 'mathtt': 'monospace',
+}
+# 各字母表中 A、a、0 的码位，以及没有放在连续区段中的字母
+ALPHABETS = {
+    'bold': (0x1D400, 0x1D41A, 0x1D7CE, {}),
+    'bold-italic': (0x1D468, 0x1D482, 0x1D7CE, {}),
+    'double-struck': (0x1D538, 0x1D552, 0x1D7D8, {
+        'C': 'ℂ', 'H': 'ℍ', 'N': 'ℕ', 'P': 'ℙ', 'Q': 'ℚ', 'R': 'ℝ', 'Z': 'ℤ'}),
+    'script': (0x1D49C, 0x1D4B6, None, {
+        'B': 'ℬ', 'E': 'ℰ', 'F': 'ℱ', 'H': 'ℋ', 'I': 'ℐ', 'L': 'ℒ', 'M': 'ℳ', 'R': 'ℛ',
+        'e': 'ℯ', 'g': 'ℊ', 'o': 'ℴ'}),
+    'fraktur': (0x1D504, 0x1D51E, None, {'C': 'ℭ', 'H': 'ℌ', 'I': 'ℑ', 'R': 'ℜ', 'Z': 'ℨ'}),
+    'sans-serif': (0x1D5A0, 0x1D5BA, 0x1D7E2, {}),
+    'monospace': (0x1D670, 0x1D68A, 0x1D7F6, {}),
+}
+TEXT_COMMANDS = {'text', 'textrm', 'mbox', 'textnormal', 'textit', 'textbf'}
+TEXT_STYLES = {'textit': 'font-style: italic', 'textbf': 'font-weight: bold'}
+# \big 等命令的分隔符大小（em）
+DELIMITER_SIZES = {
+    'big': 1.2, 'bigl': 1.2, 'bigr': 1.2, 'bigm': 1.2,
+    'Big': 1.8, 'Bigl': 1.8, 'Bigr': 1.8, 'Bigm': 1.8,
+    'bigg': 2.4, 'biggl': 2.4, 'biggr': 2.4, 'biggm': 2.4,
+    'Bigg': 3.0, 'Biggl': 3.0, 'Biggr': 3.0, 'Biggm': 3.0,
+}
+# 矩阵环境两侧的括号
+MATRIX_FENCES = {
+    'matrix': ('', ''), 'smallmatrix': ('', ''), 'array': ('', ''), 'pmatrix': ('(', ')'),
+    'bmatrix': ('[', ']'), 'Bmatrix': ('{', '}'), 'vmatrix': ('|', '|'), 'Vmatrix': ('‖', '‖'),
+}
+# 按行对齐的环境：奇数列右对齐、偶数列左对齐
+ALIGN_ENVIRONMENTS = {'aligned', 'align', 'align*', 'alignat', 'alignat*', 'split', 'eqnarray', 'eqnarray*'}
+GATHER_ENVIRONMENTS = {'gathered', 'gather', 'gather*', 'equation', 'equation*', 'multline', 'multline*'}
+# 忽略的命令
+IGNORED_COMMANDS = {'limits', 'nolimits', 'displaystyle', 'textstyle', 'scriptstyle', 'nonumber', 'notag', 'relax'}
+STYLE_COMMANDS = {'displaystyle': 'true', 'textstyle': 'false'}
+
+# 输出到 HTML 时转义的字符：除了 & < > 以外，Markdown 中有特殊含义的字符也转为字符引用，
+# 公式在 Markdown 解析前插入时不会被当作强调、链接、转义或表格的单元格分隔符处理
+TEXT_ESCAPES = {
+    '&': '&amp;', '<': '&lt;', '>': '&gt;', '"': '&quot;',
+    '*': '&#42;', '_': '&#95;', '[': '&#91;', ']': '&#93;', '`': '&#96;', '\\': '&#92;', '$': '&#36;',
+    '|': '&#124;',
+}
+TEXT_ESCAPE_PATTERN = re.compile('[' + re.escape(''.join(TEXT_ESCAPES)) + ']')
+COMMAND_PATTERN = re.compile(r'\\([a-zA-Z]+|.)')
+NUMBER_PATTERN = re.compile(r'[0-9]+(?:\.[0-9]+)?')
+LENGTH_PATTERN = re.compile(r'\s*(-?[0-9.]+)\s*(em|ex|pt|px|mm|cm|in|mu)\s*$')
+# 作为运算符（<mo>）输出的 ASCII 字符
+OPERATOR_CHARACTERS = set('+-=<>()[]|/,;:!?.*\'')
+# mdx_math 等生成的 MathJax 公式脚本，第 1 组非空表示行间公式
+MATH_SCRIPT_PATTERN = re.compile(r'<script type="math/tex(; mode=display)?">(.*?)</script>', re.DOTALL)
+# 函数名之后的函数应用符，上下标加在函数名上，函数应用符放在最后
+FUNCTION_APPLY = '<mo lspace="0em" rspace="0.1667em">&#8289;</mo>'
+
+
+def escape_text(text):
+    """转义文本节点和属性值"""
+    return TEXT_ESCAPE_PATTERN.sub(lambda m: TEXT_ESCAPES[m.group(0)], text)
+
+
+def styled_letter(char, variant):
+    """按字体把字母或数字转为 Unicode 数学字母，字母表中没有的字符原样返回"""
+    upper, lower, digit, exceptions = ALPHABETS[variant]
+    if char in exceptions:
+        return exceptions[char]
+    if 'A' <= char <= 'Z':
+        return chr(upper + ord(char) - ord('A'))
+    if 'a' <= char <= 'z':
+        return chr(lower + ord(char) - ord('a'))
+    if '0' <= char <= '9' and digit is not None:
+        return chr(digit + ord(char) - ord('0'))
+    return char
+
+
+def _mrow(nodes):
+    if len(nodes) == 1 and not nodes[0].endswith(FUNCTION_APPLY):
+        return nodes[0]
+    return f'<mrow>{"".join(nodes)}</mrow>'
+
+
+def _mo(char, attributes=''):
+    return f'<mo{attributes}>{escape_text(char)}</mo>'
+
+
+class _Parser:
+    """递归下降解析 LaTeX 公式，每个方法返回 MathML 字符串"""
+    
+    def __init__(self, latex_code):
+        self.source = latex_code
+        self.pos = 0
+        # 当前字体（FONT_COMMANDS 的值），None 表示默认
+        self.variant = None
+    
+    # 词法
+    
+    def error(self, message):
+        raise MathMLError(f"{message}（位置 {self.pos}）: {self.source}")
+    
+    def skip_spaces(self):
+        while self.pos < len(self.source) and self.source[self.pos].isspace():
+            self.pos += 1
+    
+    def peek(self):
+        """返回下一个记号（命令为 \\name）但不前进，结尾返回 None"""
+        self.skip_spaces()
+        if self.pos >= len(self.source):
+            return None
+        if self.source[self.pos] == '\\':
+            match = COMMAND_PATTERN.match(self.source, self.pos)
+            if match is None:
+                self.error("公式以反斜杠结尾")
+            return match.group(0)
+        return self.source[self.pos]
+    
+    def next(self):
+        token = self.peek()
+        if token is not None:
+            self.pos += len(token)
+        return token
+    
+    def expect(self, token):
+        if self.next() != token:
+            self.error(f"缺少 {token}")
+    
+    def read_braced_text(self):
+        """读取 {...} 中的原始文本（允许嵌套的花括号）"""
+        self.expect('{')
+        depth = 1
+        start = self.pos
+        while self.pos < len(self.source):
+            char = self.source[self.pos]
+            if char == '\\':
+                self.pos += 2
+                continue
+            if char == '{':
+                depth += 1
+            elif char == '}':
+                depth -= 1
+                if depth == 0:
+                    self.pos += 1
+                    return self.source[start:self.pos - 1]
+            self.pos += 1
+        self.error("花括号不匹配")
+    
+    def read_optional(self):
+        """读取可选参数 [...] 的原始文本，没有时返回 None"""
+        if self.peek() != '[':
+            return None
+        end = self.source.find(']', self.pos)
+        if end < 0:
+            self.error("方括号不匹配")
+        text = self.source[self.pos + 1:end]
+        self.pos = end + 1
+        return text
+    
+    # 语法
+    
+    def parse(self):
+        nodes = self.parse_list(())
+        if self.pos < len(self.source):
+            self.error(f"多余的 {self.peek()}")
+        return nodes
+    
+    def parse_list(self, terminators):
+        """解析到 terminators 中的记号（不消耗）或结尾为止，返回节点列表"""
+        nodes = []
+        while True:
+            token = self.peek()
+            if token is None or token in terminators:
+                return nodes
+            if token == '}':
+                self.error("多余的 }")
+            if token in ('\\displaystyle', '\\textstyle'):
+                # 对当前组中剩余的部分生效
+                self.next()
+                rest = self.parse_list(terminators)
+                nodes.append(f'<mstyle displaystyle="{STYLE_COMMANDS[token[1:]]}">{"".join(rest)}</mstyle>')
+                return nodes
+            if token == '\\color':
+                self.next()
+                color = self.read_braced_text().strip()
+                rest = self.parse_list(terminators)
+                nodes.append(f'<mstyle mathcolor="{escape_text(color)}">{"".join(rest)}</mstyle>')
+                return nodes
+            node = self.parse_scripted()
+            if node is not None:
+                nodes.append(node)
+    
+    def parse_scripted(self):
+        """解析一个元素及其上下标和撇号"""
+        token = self.peek()
+        if token in ('^', '_'):
+            # 没有底数的上下标，如 {}^{14}C 的写法中省略了 {}
+            base, limits = '<mrow></mrow>', False
+        else:
+            base, limits = self.parse_atom()
+            if base is None:
+                return None
+        
+        primes = ''
+        while self.peek() == "'":
+            self.next()
+            primes += '′'
+        superscript = _mo(primes) if primes else None
+        subscript = None
+        while self.peek() in ('^', '_'):
+            token = self.next()
+            argument = self.parse_argument()
+            if token == '^':
+                if superscript is not None and not primes:
+                    self.error("重复的上标")
+                superscript = argument if superscript is None else f'<mrow>{superscript}{argument}</mrow>'
+                primes = ''
+            else:
+                if subscript is not None:
+                    self.error("重复的下标")
+                subscript = argument
+        
+        if superscript is None and subscript is None:
+            return base
+        if base.endswith(FUNCTION_APPLY):
+            return self.attach_scripts(base[:-len(FUNCTION_APPLY)], superscript, subscript, limits) + FUNCTION_APPLY
+        return self.attach_scripts(base, superscript, subscript, limits)
+    
+    @staticmethod
+    def attach_scripts(base, superscript, subscript, limits):
+        if limits:
+            if superscript is None:
+                return f'<munder>{base}{subscript}</munder>'
+            if subscript is None:
+                return f'<mover>{base}{superscript}</mover>'
+            return f'<munderover>{base}{subscript}{superscript}</munderover>'
+        if superscript is None:
+            return f'<msub>{base}{subscript}</msub>'
+        if subscript is None:
+            return f'<msup>{base}{superscript}</msup>'
+        return f'<msubsup>{base}{subscript}{superscript}</msubsup>'
+    
+    def parse_argument(self):
+        """命令的参数：{...} 组，或者单个字符/命令"""
+        token = self.peek()
+        if token is None:
+            self.error("缺少参数")
+        if token == '{':
+            self.next()
+            nodes = self.parse_list(('}',))
+            self.expect('}')
+            return _mrow(nodes) if nodes else '<mrow></mrow>'
+        if token[0] == '\\':
+            node, _ = self.parse_atom()
+            if node is None:
+                self.error(f"{token} 不能作为参数")
+            return _mrow([node])
+        # 不带花括号的参数只取一个字符，如 \frac12、x^10 中的 1
+        self.pos += 1
+        return self.atom_for_char(token)
+    
+    def atom_for_char(self, char):
+        if char.isdigit():
+            if self.variant not in (None, 'italic', 'normal'):
+                return f'<mn>{styled_letter(char, self.variant)}</mn>'
+            return f'<mn>{char}</mn>'
+        if char.isalpha():
+            if self.variant == 'normal':
+                return f'<mi mathvariant="normal">{escape_text(char)}</mi>'
+            if self.variant in ALPHABETS:
+                return f'<mi>{styled_letter(char, self.variant)}</mi>'
+            return f'<mi>{escape_text(char)}</mi>'
+        if char == '~':
+            return '<mtext>&#160;</mtext>'
+        if char in OPERATOR_CHARACTERS or not char.isalnum():
+            if char in ('&', '#', '%'):
+                self.error(f"不支持的字符 {char}")
+            if char == '-':
+                char = '−'
+            if char == '*':
+                char = '∗'
+            return _mo(char)
+        return f'<mi>{escape_text(char)}</mi>'
+    
+    def parse_atom(self):
+        """
+        解析一个不带上下标的元素
+        
+        Returns:
+            (MathML, 上下标是否写在上下方)；被忽略的命令返回 (None, False)
+        """
+        token = self.peek()
+        if token == '{':
+            self.next()
+            nodes = self.parse_list(('}',))
+            self.expect('}')
+            return _mrow(nodes) if nodes else '<mrow></mrow>', False
+        if token[0] != '\\':
+            if token.isdigit() and self.variant in (None, 'italic', 'normal'):
+                number = NUMBER_PATTERN.match(self.source, self.pos).group(0)
+                self.pos += len(number)
+                return f'<mn>{number}</mn>', False
+            self.pos += 1
+            return self.atom_for_char(token), False
+        
+        self.next()
+        return self.parse_command(token[1:])
+    
+    def parse_command(self, name):
+        if name in IGNORED_COMMANDS:
+            return None, False
+        if name in GREEK_LETTERS:
+            if self.variant == 'normal':
+                return f'<mi mathvariant="normal">{GREEK_LETTERS[name]}</mi>', False
+            return f'<mi>{GREEK_LETTERS[name]}</mi>', False
+        if name in UPPER_GREEK_LETTERS:
+            return f'<mi mathvariant="normal">{UPPER_GREEK_LETTERS[name]}</mi>', False
+        if name in SYMBOL_IDENTIFIERS:
+            return f'<mi>{SYMBOL_IDENTIFIERS[name]}</mi>', False
+        if name in SYMBOL_OPERATORS:
+            return _mo(SYMBOL_OPERATORS[name]), False
+        if name in LARGE_OPERATORS:
+            limits = name not in INTEGRALS
+            if self.peek() == '\\limits':
+                self.next()
+                limits = True
+            elif self.peek() == '\\nolimits':
+                self.next()
+                limits = False
+            attributes = ' movablelimits="true"' if limits else ''
+            return _mo(LARGE_OPERATORS[name], attributes), limits
+        if name in FUNCTIONS:
+            return f'<mi>{name}</mi>{FUNCTION_APPLY}', False
+        if name in LIMIT_FUNCTIONS:
+            return _mo(LIMIT_FUNCTIONS[name], ' movablelimits="true" form="prefix"'), True
+        if name == 'operatorname':
+            text = self.read_braced_text().strip()
+            if not re.fullmatch(r'[a-zA-Z]+', text):
+                self.error("\\operatorname 只支持字母")
+            return f'<mi>{text}</mi>{FUNCTION_APPLY}', False
+        if name in SPACES:
+            return f'<mspace width="{SPACES[name]}em"></mspace>', False
+        if name in ('{', '}', '|', '#', '%', '&', '_', '$'):
+            char = {'|': '‖'}.get(name, name)
+            if name in ('#', '%', '&', '_', '$'):
+                return f'<mi>{escape_text(char)}</mi>', False
+            return _mo(char), False
+        if name in ('frac', 'dfrac', 'tfrac', 'cfrac'):
+            numerator = self.parse_argument()
+            denominator = self.parse_argument()
+            fraction = f'<mfrac>{numerator}{denominator}</mfrac>'
+            if name == 'dfrac':
+                fraction = f'<mstyle displaystyle="true">{fraction}</mstyle>'
+            elif name == 'tfrac':
+                fraction = f'<mstyle displaystyle="false">{fraction}</mstyle>'
+            return fraction, False
+        if name in ('binom', 'dbinom', 'tbinom'):
+            top = self.parse_argument()
+            bottom = self.parse_argument()
+            return f'<mrow><mo>(</mo><mfrac linethickness="0">{top}{bottom}</mfrac><mo>)</mo></mrow>', False
+        if name == 'sqrt':
+            index = self.read_optional()
+            radicand = self.parse_argument()
+            if index is None:
+                return f'<msqrt>{radicand}</msqrt>', False
+            return f'<mroot>{radicand}{_mrow(_Parser(index).parse() or ["<mrow></mrow>"])}</mroot>', False
+        if name in ACCENTS:
+            position, mark, stretchy = ACCENTS[name]
+            base = self.parse_argument()
+            attributes = ' stretchy="true"' if stretchy else ' stretchy="false"'
+            if position == 'over':
+                return f'<mover accent="true">{base}{_mo(mark, attributes)}</mover>', name == 'overbrace'
+            return f'<munder accentunder="true">{base}{_mo(mark, attributes)}</munder>', name == 'underbrace'
+        if name in ('overset', 'stackrel', 'underset'):
+            script = self.parse_argument()
+            base = self.parse_argument()
+            tag = 'munder' if name == 'underset' else 'mover'
+            return f'<{tag}>{base}{script}</{tag}>', False
+        if name in FONT_COMMANDS:
+            saved = self.variant
+            self.variant = FONT_COMMANDS[name]
+            try:
+                return self.parse_argument(), False
+            finally:
+                self.variant = saved
+        if name in TEXT_COMMANDS:
+            text = self.read_braced_text()
+            if '$' in text or '\\' in text:
+                self.error("文本中不支持公式和命令")
+            style = TEXT_STYLES.get(name)
+            attributes = f' style="{style}"' if style else ''
+            return f'<mtext{attributes}>{escape_text(text)}</mtext>', False
+        if name == 'textcolor':
+            color = self.read_braced_text().strip()
+            return f'<mstyle mathcolor="{escape_text(color)}">{self.parse_argument()}</mstyle>', False
+        if name == 'phantom':
+            return f'<mphantom>{self.parse_argument()}</mphantom>', False
+        if name in ('hspace', 'hspace*', 'kern', 'mkern', 'hskip'):
+            length = self.read_braced_text() if self.peek() == '{' else self.read_length()
+            match = LENGTH_PATTERN.match(length)
+            if match is None:
+                self.error("无法识别的长度")
+            value, unit = match.groups()
+            if unit == 'mu':
+                value, unit = f'{float(value) / 18:.4f}', 'em'
+            return f'<mspace width="{value}{unit}"></mspace>', False
+        if name in ('bmod', 'mod'):
+            return _mo('mod', ' lspace="0.2778em" rspace="0.2778em"'), False
+        if name == 'pmod':
+            argument = self.parse_argument()
+            return (f'<mrow><mspace width="1em"></mspace><mo>(</mo><mi>mod</mi>'
+                    f'<mspace width="0.3333em"></mspace>{argument}<mo>)</mo></mrow>'), False
+        if name == 'not':
+            following = self.parse_argument()
+            match = re.fullmatch(r'<mo>(.|&[#a-z0-9]+;)</mo>', following)
+            if match is None:
+                self.error("\\not 后面只能是关系符")
+            return _mo(html.unescape(match.group(1)) + '̸'), False
+        if name == 'left':
+            return self.parse_left_right(), False
+        if name in DELIMITER_SIZES:
+            size = DELIMITER_SIZES[name]
+            delimiter = self.read_delimiter()
+            if not delimiter:
+                return None, False
+            return _mo(delimiter, f' minsize="{size}em" maxsize="{size}em"'), False
+        if name == 'begin':
+            return self.parse_environment(), False
+        self.error(f"不支持的命令 \\{name}")
+    
+    def read_length(self):
+        match = re.compile(r'\s*-?[0-9.]+\s*[a-z]{2}').match(self.source, self.pos)
+        if match is None:
+            self.error("缺少长度")
+        self.pos = match.end()
+        return match.group(0)
+    
+    def read_delimiter(self):
+        """读取 \\left、\\right、\\big 等后面的分隔符，. 表示没有分隔符"""
+        token = self.next()
+        if token is None:
+            self.error("缺少分隔符")
+        if token == '.':
+            return ''
+        if token in ('\\{', '\\}'):
+            return token[1]
+        if token == '\\|':
+            return '‖'
+        if token[0] == '\\':
+            char = SYMBOL_OPERATORS.get(token[1:])
+            if char is None:
+                self.error(f"无法识别的分隔符 {token}")
+            return char
+        if token in '()[]|/<>':
+            return {'<': '⟨', '>': '⟩'}.get(token, token)
+        self.error(f"无法识别的分隔符 {token}")
+    
+    def parse_left_right(self):
+        opening = self.read_delimiter()
+        nodes = [_mo(opening, ' fence="true" stretchy="true"')] if opening else []
+        while True:
+            nodes.extend(self.parse_list(('\\right', '\\middle')))
+            token = self.next()
+            if token is None:
+                self.error("\\left 缺少对应的 \\right")
+            delimiter = self.read_delimiter()
+            if token == '\\middle':
+                nodes.append(_mo(delimiter, ' stretchy="true"'))
+                continue
+            if delimiter:
+                nodes.append(_mo(delimiter, ' fence="true" stretchy="true"'))
+            return f'<mrow>{"".join(nodes)}</mrow>'
+    
+    def parse_environment(self):
+        name = self.read_braced_text().strip()
+        columns = None
+        if name in ('array', 'alignat', 'alignat*'):
+            columns = self.read_braced_text()
+        elif name not in MATRIX_FENCES and name not in ALIGN_ENVIRONMENTS \
+                and name not in GATHER_ENVIRONMENTS and name not in ('cases', 'rcases'):
+            self.error(f"不支持的环境 {name}")
+        
+        rows = []
+        cells = []
+        while True:
+            cells.append(''.join(self.parse_list(('&', '\\\\', '\\end'))))
+            token = self.next()
+            if token == '&':
+                continue
+            rows.append(cells)
+            cells = []
+            if token == '\\\\':
+                # 忽略换行后的 [2pt] 这类行距参数
+                if self.peek() == '[':
+                    self.read_optional()
+                continue
+            if token is None:
+                self.error(f"环境 {name} 没有结束")
+            if self.read_braced_text().strip() != name:
+                self.error(f"环境 {name} 的结束标记不匹配")
+            break
+        # 以 \\ 结尾时最后多出一个空行
+        if len(rows) > 1 and rows[-1] == ['']:
+            rows.pop()
+        
+        table_attributes = ''
+        if name in ALIGN_ENVIRONMENTS:
+            width = max(len(row) for row in rows)
+            table_attributes = f' columnalign="{" ".join("right" if i % 2 == 0 else "left" for i in range(width))}"' \
+                               ' columnspacing="0"'
+        elif name in ('cases', 'rcases'):
+            table_attributes = ' columnalign="left left"'
+        elif columns is not None and name == 'array':
+            aligns = [{'l': 'left', 'c': 'center', 'r': 'right'}[char] for char in columns if char in 'lcr']
+            if aligns:
+                table_attributes = f' columnalign="{" ".join(aligns)}"'
+        
+        body = ''.join(
+            '<mtr>' + ''.join(f'<mtd>{cell}</mtd>' for cell in row) + '</mtr>' for row in rows
+        )
+        display = ' displaystyle="true"' if name in ALIGN_ENVIRONMENTS or name in GATHER_ENVIRONMENTS else ''
+        table = f'<mtable{table_attributes}{display}>{body}</mtable>'
+        if name == 'cases':
+            return f'<mrow><mo>{{</mo>{table}</mrow>'
+        if name == 'rcases':
+            return f'<mrow>{table}<mo>}}</mo></mrow>'
+        opening, closing = MATRIX_FENCES.get(name, ('', ''))
+        if opening:
+            return f'<mrow>{_mo(opening)}{table}{_mo(closing)}</mrow>'
+        return table
+
+
+def latex_to_mathml(latex_code, display=False):
+    """
+    把 LaTeX 公式转换为 MathML
+    
+    Args:
+        latex_code: 不含 $ 定界符的公式
+        display: True 为行间公式（display="block"），False 为行内公式
+    
+    Returns:
+        <math> 元素的 HTML 字符串。其中 Markdown 的特殊字符已转为字符引用，可以在 Markdown 解析前插入；
+        原始的 LaTeX 保存在 annotation 中，复制公式时可以得到源码
+    
+    Raises:
+        MathMLError: 公式中有不支持的命令或语法错误
+    """
+    nodes = _Parser(latex_code).parse()
+    body = _mrow(nodes) if nodes else '<mrow></mrow>'
+    display_attribute = ' display="block"' if display else ''
+    return (f'<math{display_attribute}><semantics>{body}'
+            f'<annotation encoding="application/x-tex">{escape_text(latex_code)}</annotation></semantics></math>')
+
+
+def convert_math_scripts(html_content):
+    """
+    把 HTML 中 MathJax 的 <script type="math/tex"> 公式替换为 MathML
+    
+    无法转换的公式保留原来的脚本，交给 MathJax 渲染
+    
+    Returns:
+        (替换后的 HTML, 保留下来的公式脚本数量)
+    """
+    remaining = 0
+    
+    def replace(match):
+        nonlocal remaining
+        try:
+            return latex_to_mathml(match.group(2).strip(), display=bool(match.group(1)))
+        except MathMLError:
+            remaining += 1
+            return match.group(0)
+    
+    return MATH_SCRIPT_PATTERN.sub(replace, html_content), remaining
+
+
+def main():
+    """命令行主函数：输出公式的 MathML"""
+    args = [arg for arg in sys.argv[1:] if arg != '--display']
+    if len(args) != 1:
+        print('用法: python latex_mathml.py "LaTeX 公式" [--display]')
+        sys.exit(1)
+    try:
+        print(latex_to_mathml(args[0], display='--display' in sys.argv))
+    except MathMLError as e:
+        print(f"无法转换: {e}")
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
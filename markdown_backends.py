@@ -0,0 +1,232 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Markdown 解析后端
+统一 Python-Markdown、markdown-it-py 和 mistune 的调用方式，
+各后端都支持表格、Pygments 代码高亮（与 codehilite 的输出一致）、数学公式和标题目录
+"""
+
+import re
+import html
+import importlib.util
+import logging
+
+
+logger = logging.getLogger(__name__)
+
+# 后端名称 -> 需要安装的模块
+MARKDOWN_BACKENDS = {
+    'markdown': 'markdown',
+    'markdown-it': 'markdown_it',
+    'mistune': 'mistune',
+}
+# 默认后端，与之前的输出完全一致
+DEFAULT_MARKDOWN_BACKEND = 'markdown'
+# auto 模式按该顺序选择第一个已安装的后端（从快到慢）
+AUTO_BACKEND_ORDER = ('markdown-it', 'mistune', 'markdown')
+
+# codehilite 的配置，所有后端的代码块都按此高亮
+CODEHILITE_CONFIG = {
+    'css_class': 'highlight',
+    'use_pygments': True,
+    'noclasses': True  # 内联样式，不依赖外部CSS
+}
+
+# 与 python-markdown-math（mdx_math）相同的公式语法，$...$ 留给 MathJax 处理
+DISPLAY_MATH_PATTERNS = (
+    re.compile(r'(?<!\\)(\$\$)([^\$]+)(\$\$)', re.DOTALL),
+    re.compile(r'(?<!\\)(\\\[)(.+?)(\\\])', re.DOTALL),
+    re.compile(r'(?<!\\)(\\begin{([a-z]+?\*?)})(.+?)(\\end{\2})', re.DOTALL),
+)
+INLINE_MATH_PATTERN = re.compile(r'(?<!\\)(\\\()(.+?)(\\\))', re.DOTALL)
+# protect_math 生成的占位符
+MATH_PLACEHOLDER_PATTERN = re.compile(r'MD2HTMLMATH\d+X')
+# 代码块和行内代码中的内容不是公式
+CODE_PATTERN = re.compile(r'^(`{3,}|~{3,}).*?^\1[ \t]*$|`+[^`\n]+`+', re.DOTALL | re.MULTILINE)
+# 没有属性的标题，其他后端的标题 id 在渲染后补上
+HEADING_PATTERN = re.compile(r'<h([1-6])>(.*?)</h\1>', re.DOTALL)
+
+
+def available_markdown_backends():
+    """返回已安装的后端名称"""
+    return [name for name, module in MARKDOWN_BACKENDS.items() if importlib.util.find_spec(module)]
+
+
+def select_markdown_backend(mode=DEFAULT_MARKDOWN_BACKEND):
+    """
+    选择 Markdown 解析后端
+    
+    mode 为后端名称时，未安装则警告并使用默认后端；为 auto 时选择最快的已安装后端
+    """
+    installed = available_markdown_backends()
+    if mode == 'auto':
+        return next(name for name in AUTO_BACKEND_ORDER if name in installed)
+    if mode not in MARKDOWN_BACKENDS:
+        raise ValueError(f"未知的 Markdown 后端: {mode}. 支持的后端: auto, {', '.join(MARKDOWN_BACKENDS)}")
+    if mode not in installed:
+        logger.warning("Markdown 后端 %s 未安装，改用 %s", mode, DEFAULT_MARKDOWN_BACKEND)
+        return DEFAULT_MARKDOWN_BACKEND
+    return mode
+
+
+def highlight_code(code, lang=None, shebang=False):
+    """按 codehilite 扩展的默认配置高亮代码，输出与 Python-Markdown 完全一致"""
+    from markdown.extensions.codehilite import CodeHilite, CodeHiliteExtension
+    
+    config = CodeHiliteExtension(**CODEHILITE_CONFIG).getConfigs()
+    return CodeHilite(code, lang=lang or None, style=config.pop('pygments_style', 'default'),
+                      **config).hilite(shebang=shebang)
+
+
+def protect_math(text):
+    """
+    把公式替换为占位符，避免被其他解析器当作 Markdown 处理
+    
+    Returns:
+        (替换后的文本, 占位符 -> <script type="math/tex"> 的字典)
+    """
+    scripts = {}
+    
+    def store(script):
+        placeholder = f'MD2HTMLMATH{len(scripts)}X'
+        scripts[placeholder] = script
+        return placeholder
+    
+    def replace_display(match):
+        # 与 mdx_math 一样只在一个段落内匹配
+        if re.search(r'\n[ \t]*\n', match.group(0)):
+            return match.group(0)
+        body = match.group(0) if '\\begin' in match.group(1) else match.group(2)
+        return store(f'<script type="math/tex; mode=display">{body}</script>')
+    
+    def replace_inline(match):
+        if re.search(r'\n[ \t]*\n', match.group(0)):
+            return match.group(0)
+        return store(f'<script type="math/tex">{match.group(2)}</script>')
+    
+    def replace_segment(segment):
+        for pattern in DISPLAY_MATH_PATTERNS:
+            segment = pattern.sub(replace_display, segment)
+        return INLINE_MATH_PATTERN.sub(replace_inline, segment)
+    
+    # 只替换代码之外的部分
+    parts = []
+    pos = 0
+    for match in CODE_PATTERN.finditer(text):
+        parts.append(replace_segment(text[pos:match.start()]))
+        parts.append(match.group(0))
+        pos = match.end()
+    parts.append(replace_segment(text[pos:]))
+    return ''.join(parts), scripts
+
+
+def restore_math(html_content, scripts):
+    """把占位符替换回公式脚本，一次扫描完成所有替换"""
+    if not scripts:
+        return html_content
+    return MATH_PLACEHOLDER_PATTERN.sub(lambda m: scripts.get(m.group(0), m.group(0)), html_content)
+
+
+def add_heading_ids(html_content, toc, prefix=''):
+    """
+    给没有属性的标题加上 id，并按 toc 扩展的格式把标题树追加到 toc
+    
+    id 的生成方式与 toc 扩展（slugify_unicode）相同，两种后端的目录和锚点一致
+    """
+    from markdown.extensions.toc import nest_toc_tokens, slugify_unicode, strip_tags, unique
+    
+    used_ids = set()
+    tokens = []
+    
+    def replace(match):
+        level, inner = int(match.group(1)), match.group(2)
+        name = strip_tags(inner)
+        heading_id = unique(prefix + slugify_unicode(html.unescape(name), '-'), used_ids)
+        tokens.append({'level': level, 'id': heading_id, 'name': name, 'html': inner, 'data-toc-label': ''})
+        return f'<h{level} id="{heading_id}">{inner}</h{level}>'
+    
+    html_content = HEADING_PATTERN.sub(replace, html_content)
+    toc.extend(nest_toc_tokens(tokens))
+    return html_content
+
+
+def _render_python_markdown(text, math, toc, heading_id_prefix, output_format):
+    from markdown import Markdown
+    
+    extensions = ['tables', 'fenced_code', 'codehilite']
+    extension_configs = {'codehilite': dict(CODEHILITE_CONFIG)}
+    if math:
+        extensions.insert(0, 'mdx_math')
+    if toc is not None:
+        from markdown.extensions.toc import slugify_unicode
+        
+        extensions.append('toc')
+        extension_configs['toc'] = {
+            'slugify': lambda value, separator: heading_id_prefix + slugify_unicode(value, separator)
+        }
+    
+    md = Markdown(extensions=extensions, extension_configs=extension_configs, output_format=output_format)
+    html_content = md.convert(text)
+    if toc is not None:
+        toc.extend(md.toc_tokens)
+    return html_content
+
+
+def _render_markdown_it(text):
+    from markdown_it import MarkdownIt
+    
+    md = MarkdownIt('commonmark', {'html': True}).enable('table')
+    
+    def render_fence(self, tokens, idx, options, env):
+        token = tokens[idx]
+        lang = token.info.strip().split(maxsplit=1)[0] if token.info.strip() else None
+        return highlight_code(token.content, lang) + '\n'
+    
+    def render_code_block(self, tokens, idx, options, env):
+        return highlight_code(tokens[idx].content, shebang=True) + '\n'
+    
+    md.add_render_rule('fence', render_fence)
+    md.add_render_rule('code_block', render_code_block)
+    return md.render(text)
+
+
+def _render_mistune(text):
+    import mistune
+    
+    class HighlightRenderer(mistune.HTMLRenderer):
+        def block_code(self, code, info=None):
+            if info is None:
+                return highlight_code(code, shebang=True) + '\n'
+            lang = info.strip().split(maxsplit=1)[0] if info.strip() else None
+            return highlight_code(code, lang) + '\n'
+    
+    md = mistune.create_markdown(escape=False, renderer=HighlightRenderer(escape=False), plugins=['table'])
+    return md(text)
+
+
+def render_markdown(text, backend=DEFAULT_MARKDOWN_BACKEND, math=False, toc=None,
+                    heading_id_prefix='', output_format='xhtml'):
+    """
+    用指定后端把 Markdown 转换为 HTML 片段
+    
+    Args:
+        text: Markdown 内容
+        backend: markdown、markdown-it、mistune 或 auto，见 select_markdown_backend
+        math: 为 True 时按 python-markdown-math 的语法把 $$...$$、\\[...\\]、\\(...\\) 等
+              转换为 MathJax 的 <script type="math/tex"> 标签
+        toc: 可选的列表。提供时给标题加上 id，并追加标题树（toc 扩展的 toc_tokens 格式）
+        heading_id_prefix: 标题 id 的前缀
+        output_format: Python-Markdown 的输出格式（xhtml 或 html5），其他后端总是输出 HTML5
+    """
+    backend = select_markdown_backend(backend)
+    if backend == 'markdown':
+        return _render_python_markdown(text, math, toc, heading_id_prefix, output_format)
+    
+    scripts = {}
+    if math:
+        text, scripts = protect_math(text)
+    html_content = _render_markdown_it(text) if backend == 'markdown-it' else _render_mistune(text)
+    html_content = restore_math(html_content, scripts)
+    if toc is not None:
+        html_content = add_heading_ids(html_content, toc, heading_id_prefix)
+    return html_content
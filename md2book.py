@@ -0,0 +1,403 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+多文档书籍构建工具
+按章节列表或目录文件并行转换多个 Markdown 文件，输出一个合并的 HTML，
+或共用一个样式表的多个互相链接的页面；图片和公式图片去重后保存在 assets/ 目录中
+"""
+
+import sys
+import os
+import re
+import html
+import base64
+import shutil
+import hashlib
+import logging
+import tempfile
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from md2html_with_images import PAGE_CSS, convert_markdown
+from file_utils import configure_logging
+
+
+logger = logging.getLogger(__name__)
+
+# 导航中列出的最深标题级别（章节标题本身之外）
+DEFAULT_NAV_DEPTH = 2
+
+# 书籍额外的样式：导航和章节分隔
+BOOK_CSS = """        nav.book-nav {
+            border-bottom: 1px solid #ddd;
+            margin-bottom: 2em;
+            padding-bottom: 1em;
+        }
+        nav.book-nav ol {
+            padding-left: 1.5em;
+            margin: 0.3em 0;
+        }
+        nav.book-nav a, nav.page-nav a {
+            color: #2c3e50;
+            text-decoration: none;
+        }
+        nav.page-nav {
+            display: flex;
+            justify-content: space-between;
+            border-top: 1px solid #ddd;
+            margin-top: 3em;
+            padding-top: 1em;
+        }
+        section.chapter + section.chapter {
+            border-top: 1px solid #ddd;
+            margin-top: 3em;
+        }
+"""
+
+# 目录文件中的章节链接 [标题](路径.md)
+TOC_LINK_PATTERN = re.compile(r'\[([^\]]*)\]\(([^)\s]+\.(?:md|markdown))\)')
+# HTML 中内嵌的图片（公式图片和本地图片），以及写出时才编码的大图片占位符
+DATA_URI_PATTERN = re.compile(r'data:(image/[a-z0-9.+-]+);base64,(md2html-asset-\d+|[A-Za-z0-9+/=]+)')
+# MIME 类型对应的扩展名
+MIME_EXTENSIONS = {
+    'image/png': '.png',
+    'image/jpeg': '.jpg',
+    'image/gif': '.gif',
+    'image/bmp': '.bmp',
+    'image/webp': '.webp',
+    'image/svg+xml': '.svg',
+}
+
+
+def read_toc(toc_file):
+    """
+    读取目录文件，返回章节列表 [(标题或None, 路径)]
+    
+    目录文件中按顺序出现的 [标题](章节.md) 链接即章节顺序；没有链接时每个非空行是一个章节路径。
+    相对路径相对于目录文件所在的目录
+    """
+    base_dir = os.path.dirname(os.path.abspath(toc_file))
+    with open(toc_file, 'r', encoding='utf-8') as f:
+        content = f.read()
+    
+    chapters = [(title.strip() or None, path) for title, path in TOC_LINK_PATTERN.findall(content)]
+    if not chapters:
+        chapters = [(None, line.strip()) for line in content.splitlines()
+                    if line.strip() and not line.lstrip().startswith('#')]
+    return [(title, os.path.join(base_dir, path)) for title, path in chapters]
+
+
+class AssetStore:
+    """
+    把 HTML 中内嵌的图片写到资源目录，同样内容的图片只写一次
+    
+    文件按内容哈希命名，多个章节引用同一图片时共用一个文件
+    """
+    
+    def __init__(self, asset_dir):
+        self.asset_dir = asset_dir
+        os.makedirs(asset_dir, exist_ok=True)
+        # 已写出的文件名
+        self.names = set()
+        self.references = 0
+    
+    def externalize(self, html_content, assets, url_prefix):
+        """
+        把 html_content 中的 data: 图片替换为资源目录中的文件地址
+        
+        Args:
+            html_content: HTML 片段
+            assets: convert_markdown 登记的大图片占位符 -> 文件路径
+            url_prefix: 页面引用资源目录的相对地址，如 "assets/"
+        """
+        def replace(match):
+            mime_type, data = match.group(1), match.group(2)
+            ext = MIME_EXTENSIONS.get(mime_type, '.bin')
+            path = assets.get(data) if assets else None
+            digest = hashlib.sha256()
+            if path is not None:
+                with open(path, 'rb') as f:
+                    for chunk in iter(lambda: f.read(1024 * 1024), b''):
+                        digest.update(chunk)
+            else:
+                digest.update(data.encode('ascii'))
+            name = digest.hexdigest()[:20] + ext
+            
+            self.references += 1
+            if name not in self.names:
+                target = os.path.join(self.asset_dir, name)
+                if path is not None:
+                    shutil.copyfile(path, target)
+                else:
+                    with open(target, 'wb') as f:
+                        f.write(base64.b64decode(data))
+                self.names.add(name)
+            return url_prefix + name
+        
+        return DATA_URI_PATTERN.sub(replace, html_content)
+
+
+def convert_chapter(index, title, md_file, options):
+    """
+    转换一个章节
+    
+    Returns:
+        字典：index、title、path、html、toc（标题树）、stats（公式统计）、assets
+    """
+    with open(md_file, 'r', encoding='utf-8') as f:
+        md_content = f.read()
+    
+    # 合并输出时各章节的标题 id 不能重复
+    chapter_options = dict(options, heading_id_prefix=f'c{index}-')
+    stats = Counter()
+    assets = {}
+    toc = []
+    html_content = convert_markdown(md_content, os.path.dirname(os.path.abspath(md_file)),
+                                    chapter_options, stats, assets, toc)
+    if title is None:
+        title = html.unescape(toc[0]['name']) if toc else os.path.splitext(os.path.basename(md_file))[0]
+    logger.debug("章节 %d 转换完成: %s", index, md_file)
+    return {
+        'index': index,
+        'title': title,
+        'path': md_file,
+        'html': html_content,
+        'toc': toc,
+        'stats': stats,
+        'assets': assets,
+    }
+
+
+def render_nav(chapters, depth, href):
+    """
+    根据各章节的标题树生成导航，不需要重新解析章节
+    
+    href(chapter, anchor) 返回链接地址，anchor 为 None 时指向章节开头
+    """
+    def render_tokens(chapter, tokens):
+        items = []
+        for token in tokens:
+            if token['level'] > depth:
+                continue
+            children = render_tokens(chapter, token['children'])
+            # toc 扩展给出的 name 已经是转义过的 HTML 文本
+            items.append(f'<li><a href="{href(chapter, token["id"])}">{token["name"]}</a>{children}</li>')
+        return f'<ol>{"".join(items)}</ol>' if items else ''
+    
+    items = []
+    for chapter in chapters:
+        tokens = chapter['toc']
+        # 章节的一级标题即章节标题，导航中只列出其下的小节
+        if len(tokens) == 1 and tokens[0]['level'] == 1:
+            tokens = tokens[0]['children']
+        items.append(f'<li><a href="{href(chapter, None)}">{html.escape(chapter["title"])}</a>'
+                     f'{render_tokens(chapter, tokens)}</li>')
+    return f'<nav class="book-nav"><ol>{"".join(items)}</ol></nav>'
+
+
+def page_html(title, body, stylesheet=None):
+    """生成完整的页面，stylesheet 为样式表地址，None 时内联样式"""
+    if stylesheet is None:
+        style = f'    <style>\n{PAGE_CSS}{BOOK_CSS}    </style>'
+    else:
+        style = f'    <link rel="stylesheet" href="{stylesheet}">'
+    return f"""<!DOCTYPE html>
+<html lang="zh-CN">
+<head>
+    <meta charset="UTF-8">
+    <meta name="viewport" content="width=device-width, initial-scale=1.0">
+    <title>{html.escape(title)}</title>
+{style}
+</head>
+<body>
+{body}
+</body>
+</html>"""
+
+
+def build_book(chapters, output, options=None):
+    """
+    并行转换各章节并输出书籍
+    
+    Args:
+        chapters: 章节列表 [(标题或None, Markdown文件路径)]，标题为 None 时使用章节的第一个标题
+        output: split 为 False 时是输出的 HTML 文件，否则是输出目录
+        options: 转换选项，传给 convert_markdown，另外支持：
+            title: 书名（默认使用输出文件名）
+            split: 为 True 时每章输出一个页面，共用 style.css，并生成 index.html 目录页
+            chapter_workers: 同时转换的章节数（默认: CPU 核数）
+            nav_depth: 导航中列出的最深标题级别（默认: 2）
+            workspace: 公式图片的工作目录，所有章节共用，默认使用临时目录
+    
+    Returns:
+        写出的 HTML 文件列表
+    """
+    if options is None:
+        options = {}
+    split = options.get('split', False)
+    nav_depth = options.get('nav_depth', DEFAULT_NAV_DEPTH)
+    output_dir = output if split else (os.path.dirname(output) or '.')
+    os.makedirs(output_dir, exist_ok=True)
+    book_title = options.get('title') or os.path.splitext(os.path.basename(os.path.normpath(output)))[0]
+    
+    # 所有章节共用一个工作目录，重复出现的公式只渲染一次
+    temp_workspace = None
+    if options.get('workspace') is None:
+        temp_workspace = tempfile.mkdtemp(prefix='md2book-')
+    chapter_options = dict(options, workspace=options.get('workspace') or temp_workspace)
+    
+    try:
+        with ThreadPoolExecutor(max_workers=options.get('chapter_workers', os.cpu_count())) as executor:
+            futures = [executor.submit(convert_chapter, index, title, path, chapter_options)
+                       for index, (title, path) in enumerate(chapters, start=1)]
+            converted = [future.result() for future in futures]
+    finally:
+        if temp_workspace is not None:
+            shutil.rmtree(temp_workspace, ignore_errors=True)
+    
+    stats = Counter()
+    for chapter in converted:
+        stats.update(chapter['stats'])
+    logger.info("公式统计: 渲染 %d, 复用 %d, 失败 %d, 跳过 %d",
+                stats['rendered'], stats['cached'], stats['failed'], stats['skipped'])
+    
+    store = AssetStore(os.path.join(output_dir, 'assets'))
+    for chapter in converted:
+        chapter['html'] = store.externalize(chapter['html'], chapter['assets'], 'assets/')
+    logger.info("资源: %d 处引用, %d 个文件", store.references, len(store.names))
+    
+    if not split:
+        nav = render_nav(converted, nav_depth,
+                         lambda chapter, anchor: f'#{anchor or "chapter-%d" % chapter["index"]}')
+        sections = [f'<section class="chapter" id="chapter-{chapter["index"]}">\n{chapter["html"]}\n</section>'
+                    for chapter in converted]
+        with open(output, 'w', encoding='utf-8') as f:
+            f.write(page_html(book_title, nav + '\n' + '\n'.join(sections)))
+        return [output]
+    
+    with open(os.path.join(output_dir, 'style.css'), 'w', encoding='utf-8') as f:
+        f.write(PAGE_CSS + BOOK_CSS)
+    
+    for chapter in converted:
+        chapter['file'] = f'{chapter["index"]:03d}.html'
+    
+    def href(chapter, anchor):
+        return chapter['file'] + (f'#{anchor}' if anchor else '')
+    
+    nav = render_nav(converted, nav_depth, href)
+    written = []
+    index_path = os.path.join(output_dir, 'index.html')
+    with open(index_path, 'w', encoding='utf-8') as f:
+        f.write(page_html(book_title, f'<h1>{html.escape(book_title)}</h1>\n{nav}', 'style.css'))
+    written.append(index_path)
+    
+    for position, chapter in enumerate(converted):
+        links = ['<a href="index.html">目录</a>']
+        if position > 0:
+            previous = converted[position - 1]
+            links.insert(0, f'<a href="{previous["file"]}">← {html.escape(previous["title"])}</a>')
+        else:
+            links.insert(0, '<span></span>')
+        if position + 1 < len(converted):
+            following = converted[position + 1]
+            links.append(f'<a href="{following["file"]}">{html.escape(following["title"])} →</a>')
+        else:
+            links.append('<span></span>')
+        body = f'{chapter["html"]}\n<nav class="page-nav">{"".join(links)}</nav>'
+        
+        page_path = os.path.join(output_dir, chapter['file'])
+        with open(page_path, 'w', encoding='utf-8') as f:
+            f.write(page_html(f'{chapter["title"]} - {book_title}', body, 'style.css'))
+        written.append(page_path)
+    return written
+
+
+def main():
+    """命令行主函数"""
+    chapters = []
+    output = None
+    options = {}
+    verbose = False
+    
+    i = 1
+    while i < len(sys.argv):
+        arg = sys.argv[i]
+        if arg == "--toc" and i + 1 < len(sys.argv):
+            chapters.extend(read_toc(sys.argv[i + 1]))
+            i += 2
+        elif arg in ("-o", "--output") and i + 1 < len(sys.argv):
+            output = sys.argv[i + 1]
+            i += 2
+        elif arg == "--split":
+            options["split"] = True
+            i += 1
+        elif arg == "--title" and i + 1 < len(sys.argv):
+            options["title"] = sys.argv[i + 1]
+            i += 2
+        elif arg == "--workers" and i + 1 < len(sys.argv):
+            options["chapter_workers"] = int(sys.argv[i + 1])
+            i += 2
+        elif arg == "--nav-depth" and i + 1 < len(sys.argv):
+            options["nav_depth"] = int(sys.argv[i + 1])
+            i += 2
+        elif arg == "--workspace" and i + 1 < len(sys.argv):
+            options["workspace"] = sys.argv[i + 1]
+            i += 2
+        elif arg == "--math-backend" and i + 1 < len(sys.argv):
+            options["math_backend"] = sys.argv[i + 1]
+            i += 2
+        elif arg == "--math-output" and i + 1 < len(sys.argv):
+            options["math_output"] = sys.argv[i + 1]
+            i += 2
+        elif arg == "--math-sprite":
+            options["math_sprite"] = True
+            i += 1
+        elif arg == "--markdown-backend" and i + 1 < len(sys.argv):
+            options["markdown_backend"] = sys.argv[i + 1]
+            i += 2
+        elif arg == "--verbose":
+            verbose = True
+            i += 1
+        elif arg.startswith("--"):
+            print(f"未知选项: {arg}")
+            sys.exit(1)
+        else:
+            chapters.append((None, arg))
+            i += 1
+    
+    if not chapters or not output:
+        print("用法: python md2book.py -o <输出> [--toc 目录文件] [章节.md ...] [选项]")
+        print("功能:")
+        print("  - 按顺序并行转换多个章节，公式和图片在所有章节间去重")
+        print("  - 默认输出一个合并的 HTML，资源保存在同目录的 assets/ 下")
+        print("选项:")
+        print("  -o, --output PATH     输出的 HTML 文件，--split 时为输出目录")
+        print("  --toc FILE            目录文件，按其中 [标题](章节.md) 链接的顺序组织章节")
+        print("  --split               每章输出一个页面，共用 style.css，并生成 index.html")
+        print("  --title TITLE         书名 (默认: 输出文件名)")
+        print("  --workers N           同时转换的章节数 (默认: CPU 核数)")
+        print(f"  --nav-depth N         导航中列出的最深标题级别 (默认: {DEFAULT_NAV_DEPTH})")
+        print("  --workspace DIR       公式图片的工作目录，保留后重复构建时直接复用")
+        print("  --math-backend NAME   公式渲染后端: auto, tex, matplotlib (默认: auto)")
+        print("  --math-output MODE    公式输出: image（默认，渲染为图片）, mathml（转换为 MathML，无法转换的公式仍为图片）")
+        print("  --math-sprite         每章的行内公式拼成一张或几张拼图，减少图片文件和解码次数")
+        print("  --markdown-backend NAME  Markdown 解析后端: markdown, markdown-it, mistune, auto (默认: markdown)")
+        print("  --verbose             输出每个章节的处理详情")
+        sys.exit(1)
+    
+    configure_logging(verbose)
+    
+    for _, path in chapters:
+        if not os.path.exists(path):
+            print(f"章节文件不存在: {path}")
+            sys.exit(1)
+    
+    try:
+        written = build_book(chapters, output, options)
+    except Exception as e:
+        print(f"构建失败: {e}")
+        sys.exit(1)
+    print(f"构建完成: {len(chapters)} 个章节 -> {written[0]}")
+
+
+if __name__ == "__main__":
+    main()
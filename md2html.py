@@ -1,25 +1,62 @@
 import sys
 import os
-from markdown import markdown
+import time
 
 
-def md_to_html(md_path, html_path):
+# 公式的处理方式：mathjax 在浏览器中用 MathJax 渲染，mathml 在转换时转为 MathML
+MATH_MODES = ('mathjax', 'mathml')
+
+# 加载 MathJax 的脚本，放在 <head> 中
+MATHJAX_HEAD = """    <!-- MathJax for math formulas -->
+    <script type="text/javascript" async
+        src="https://cdnjs.cloudflare.com/ajax/libs/mathjax/2.7.7/MathJax.js?config=TeX-MML-AM_CHTML">
+    </script>
+    <script type="text/x-mathjax-config">
+        MathJax.Hub.Config({
+            tex2jax: {
+                inlineMath: [['$', '$'], ['\\\\(', '\\\\)']],
+                displayMath: [['$$', '$$'], ['\\\\[', '\\\\]']],
+                processEscapes: true
+            }
+        });
+    </script>
+"""
+# MathML 公式使用的数学字体
+MATHML_CSS = """        math {
+            font-family: "Latin Modern Math", "STIX Two Math", "Cambria Math", math;
+        }
+"""
+
+
+def md_to_html(md_path, html_path, markdown_backend='markdown', minify=False, precompress=False, math='mathjax'):
+    """
+    markdown_backend: Markdown 解析后端 markdown、markdown-it、mistune 或 auto，
+                      见 markdown_backends.select_markdown_backend
+    minify: 压缩 HTML（<pre>、<code> 和公式脚本的内容保持原样）
+    precompress: 在 HTML 旁边写出 .gz（安装了 brotli 时还有 .br）文件
+    math: 公式的处理方式 mathjax（默认，浏览器加载 MathJax 渲染）或 mathml（转换时用 latex_mathml 转为 MathML，
+          浏览器直接显示，不需要脚本；无法转换的公式保留给 MathJax，只有这时才加载 MathJax）
+    
+    Returns:
+        压缩结果的报告行，没有压缩时为空列表
+    """
+    # 解析器在需要转换时才导入，保持命令行启动速度
+    from markdown_backends import render_markdown
+    
     # 读取md文件
     with open(md_path, 'r', encoding='utf-8') as f:
         md_content = f.read()
-    # 转为HTML
-    html_content = markdown(md_content, output_format='html5', extensions=[
-        'mdx_math',
-        'fenced_code',
-        'codehilite',
-        'tables'
-    ], extension_configs={
-        'codehilite': {
-            'css_class': 'highlight',
-            'use_pygments': True,
-            'noclasses': True  # 内联样式，不依赖外部CSS
-        }
-    })
+    # 转为HTML（数学公式、代码块高亮和表格）
+    html_content = render_markdown(md_content, markdown_backend, math=True, output_format='html5')
+    
+    math_head = MATHJAX_HEAD
+    if math == 'mathml':
+        from latex_mathml import convert_math_scripts
+        
+        html_content, remaining = convert_math_scripts(html_content)
+        math_head = MATHML_CSS.join(('    <style>\n', '    </style>\n')) + (MATHJAX_HEAD if remaining else '')
+    elif math not in MATH_MODES:
+        raise ValueError(f"未知的公式处理方式: {math}，可选: {', '.join(MATH_MODES)}")
     
     # 创建完整的HTML文档
     filename = os.path.splitext(os.path.basename(md_path))[0]
@@ -103,40 +140,77 @@ def md_to_html(md_path, html_path):
             height: auto;
         }}
     </style>
-    <!-- MathJax for math formulas -->
-    <script type="text/javascript" async
-        src="https://cdnjs.cloudflare.com/ajax/libs/mathjax/2.7.7/MathJax.js?config=TeX-MML-AM_CHTML">
-    </script>
-    <script type="text/x-mathjax-config">
-        MathJax.Hub.Config({{
-            tex2jax: {{
-                inlineMath: [['$', '$'], ['\\\\(', '\\\\)']],
-                displayMath: [['$$', '$$'], ['\\\\[', '\\\\]']],
-                processEscapes: true
-            }}
-        }});
-    </script>
-</head>
+{math_head}</head>
 <body>
 {html_content}
 </body>
 </html>"""
     
-    # 保存HTML文件
-    with open(html_path, 'w', encoding='utf-8') as f:
+    minify_seconds = None
+    saved_bytes = 0
+    if minify:
+        from html_minify import minify_html
+        
+        start = time.perf_counter()
+        minified = minify_html(full_html)
+        minify_seconds = time.perf_counter() - start
+        saved_bytes = len(full_html.encode('utf-8')) - len(minified.encode('utf-8'))
+        full_html = minified
+    
+    # 保存HTML文件，先写入临时文件再改名
+    from file_utils import atomic_write
+    
+    with atomic_write(html_path, 'w', encoding='utf-8') as f:
         f.write(full_html)
+    
+    if not (minify or precompress):
+        return []
+    from html_minify import format_report, write_precompressed
+    
+    compressed = write_precompressed(html_path) if precompress else []
+    return format_report(html_path, minify_seconds, saved_bytes, compressed)
 
 
 def main():
-    if len(sys.argv) != 3:
-        print('用法: python md2html.py 输入文件.md 输出文件.html')
+    args = []
+    markdown_backend = 'markdown'
+    math = 'mathjax'
+    minify = False
+    precompress = False
+    i = 1
+    while i < len(sys.argv):
+        arg = sys.argv[i]
+        if arg == '--markdown-backend' and i + 1 < len(sys.argv):
+            markdown_backend = sys.argv[i + 1]
+            i += 2
+        elif arg == '--math' and i + 1 < len(sys.argv):
+            math = sys.argv[i + 1]
+            i += 2
+        elif arg == '--minify':
+            minify = True
+            i += 1
+        elif arg == '--precompress':
+            precompress = True
+            i += 1
+        elif arg.startswith('--'):
+            print(f'未知选项: {arg}')
+            sys.exit(1)
+        else:
+            args.append(arg)
+            i += 1
+    if len(args) != 2:
+        print('用法: python md2html.py 输入文件.md 输出文件.html [--markdown-backend NAME] [--math MODE] [--minify] [--precompress]')
+        print('  NAME: markdown（默认）, markdown-it, mistune, auto（最快的已安装后端）')
+        print('  --math MODE    公式: mathjax（默认，浏览器加载 MathJax）, mathml（转换为 MathML，不需要脚本）')
+        print('  --minify       压缩 HTML，<pre>、<code> 和公式的内容保持原样')
+        print('  --precompress  在 HTML 旁边写出 .gz（安装了 brotli 时还有 .br）文件')
         sys.exit(1)
-    md_path = sys.argv[1]
-    html_path = sys.argv[2]
+    md_path, html_path = args
     if not os.path.isfile(md_path):
         print(f'输入文件不存在: {md_path}')
         sys.exit(1)
-    md_to_html(md_path, html_path)
+    for line in md_to_html(md_path, html_path, markdown_backend, minify, precompress, math):
+        print(line)
     print(f'转换完成: {html_path}')
 
 
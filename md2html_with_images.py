@@ -3,17 +3,35 @@ import os
 import re
 import tempfile
 import shutil
-from markdown import markdown
+import signal
+import subprocess
+import threading
+import time
+import json
+import hashlib
+import logging
+import mmap
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor
+from collections import Counter
 import base64
-from sympy import preview
-from PIL import Image
+import html
+from file_utils import get_cache_dir, atomic_write, configure_logging
+
+# markdown、sympy、PIL 等较重的依赖在用到时才导入，保持命令行启动速度
+
+
+logger = logging.getLogger(__name__)
 
 
 def latex_to_image_sympy(latex_code, output_path, fontsize=12, dpi=800, is_inline=False):
     """
     使用sympy的preview函数将LaTeX数学公式转换为高质量PNG图片
+    失败时直接返回 False，由 latex_to_image 切换到下一个后端
     """
     try:
+        from sympy import preview
+        
         # 准备LaTeX代码
         if not latex_code.startswith('$'):
             if is_inline:
@@ -25,103 +43,427 @@ def latex_to_image_sympy(latex_code, output_path, fontsize=12, dpi=800, is_inlin
         
         # 使用高质量PNG直接生成
         base_path = os.path.splitext(output_path)[0]
+        preview(latex_expr, filename=base_path, viewer='file',
+                dvioptions=['-D', str(dpi), '-T', 'tight'])
         
-        # 尝试使用高DPI参数
-        try:
-            preview(latex_expr, filename=base_path, viewer='file', 
-                   dvioptions=[f'-D {dpi}', '-T tight'])
-            
-            if os.path.exists(base_path):
-                shutil.move(base_path, output_path)
-                print(f"Sympy 超高清PNG 成功生成图片: {output_path} (DPI: {dpi})")
-                return True
-        except:
-            # 如果高级参数失败，使用基本模式
-            preview(latex_expr, filename=base_path, viewer='file')
-            
-            if os.path.exists(base_path):
-                shutil.move(base_path, output_path)
-                print(f"Sympy PNG 成功生成图片: {output_path}")
-                return True
+        if os.path.exists(base_path):
+            shutil.move(base_path, output_path)
+            logger.debug("Sympy 超高清PNG 成功生成图片: %s (DPI: %s)", output_path, dpi)
+            return True
         
-        print(f"Sympy 生成图片失败: {latex_code}")
+        logger.debug("Sympy 生成图片失败: %s", latex_code)
         return False
-            
+    
     except Exception as e:
-        print(f"Sympy 渲染错误: {e}")
-        print(f"尝试降级到matplotlib...")
-        # 如果sympy失败，降级到原来的matplotlib方法
-        return latex_to_image_matplotlib(latex_code, output_path, fontsize, dpi, is_inline)
+        logger.debug("Sympy 渲染错误: %s", e)
+        return False
 
 
-def latex_to_image_matplotlib(latex_code, output_path, fontsize=12, dpi=800, is_inline=False):
+def latex_to_image_matplotlib(latex_code, output_path, fontsize=12, dpi=800, is_inline=False, image_format='png'):
     """
     使用matplotlib将LaTeX数学公式转换为超高清PNG图片（备用方法）
+    
+    image_format='svg' 时输出字形转为路径的 SVG，尺寸以磅为单位，与同样 DPI 的 PNG 显示大小一致
     """
     try:
-        import matplotlib.pyplot as plt
-        import matplotlib
-        
-        # 配置matplotlib使用最佳渲染质量
-        matplotlib.rcParams['figure.dpi'] = dpi
-        matplotlib.rcParams['savefig.dpi'] = dpi
-        matplotlib.rcParams['text.usetex'] = False
-        matplotlib.rcParams['font.size'] = fontsize
-        matplotlib.rcParams['text.antialiased'] = True
-        matplotlib.rcParams['figure.facecolor'] = 'white'
-        matplotlib.rcParams['savefig.facecolor'] = 'white'
-        matplotlib.rcParams['savefig.edgecolor'] = 'white'
-        matplotlib.rcParams['savefig.transparent'] = False
-        # 使用Computer Modern字体，更接近LaTeX效果
-        matplotlib.rcParams['mathtext.fontset'] = 'cm'
-        matplotlib.rcParams['font.family'] = 'serif'
+        from matplotlib.figure import Figure
+        from matplotlib.backends.backend_agg import FigureCanvasAgg
         
-        fig, ax = plt.subplots(figsize=(1, 1), dpi=dpi)
-        ax.axis('off')
+        # 直接使用 Figure 对象并显式传入渲染参数，不修改全局 rcParams，多线程同时渲染互不影响
+        fig = Figure(figsize=(1, 1), dpi=dpi, facecolor='white')
+        canvas = FigureCanvasAgg(fig)
         
         # 添加数学文本，使用超高质量渲染
+        # matplotlib 的 mathtext 不支持 $$...$$，块级公式同样用单个 $ 包裹
         if not latex_code.startswith('$'):
-            if is_inline:
-                latex_expr = f'${latex_code}$'
-            else:
-                latex_expr = f'$${latex_code}$$'
+            latex_expr = f'${latex_code}$'
         else:
-            latex_expr = latex_code
-            
-        text = ax.text(0.5, 0.5, latex_expr, fontsize=fontsize, 
-                      ha='center', va='center', transform=ax.transAxes,
-                      antialiased=True)
+            latex_expr = '$' + latex_code.strip('$') + '$'
+        
+        # 使用Computer Modern字体，更接近LaTeX效果
+        text = fig.text(0.5, 0.5, latex_expr, fontsize=fontsize,
+                        ha='center', va='center', family='serif',
+                        math_fontfamily='cm', antialiased=True)
         
         # 调整图片大小以适应文本
-        fig.canvas.draw()
-        bbox = text.get_window_extent(renderer=fig.canvas.get_renderer())
+        canvas.draw()
+        bbox = text.get_window_extent(renderer=canvas.get_renderer())
         bbox_inches = bbox.transformed(fig.dpi_scale_trans.inverted())
         
         # 添加一些边距
         padding = 0.1
         bbox_inches = bbox_inches.expanded(1 + padding, 1 + padding)
         
-        # 保存为超高质量PNG
-        plt.savefig(output_path, bbox_inches=bbox_inches, 
-                   dpi=dpi, format='png', 
-                   facecolor='white', edgecolor='white',
-                   transparent=False, pad_inches=0.05)
-        plt.close(fig)
+        # 保存为超高质量PNG；SVG 不写入日期，内容相同的公式输出也相同
+        fig.savefig(output_path, bbox_inches=bbox_inches,
+                    dpi=dpi, format=image_format,
+                    facecolor='white', edgecolor='white',
+                    transparent=False, pad_inches=0.05,
+                    metadata={'Date': None} if image_format == 'svg' else None)
         
-        print(f"Matplotlib 超高清渲染成功: {output_path} (DPI: {dpi})")
+        logger.debug("Matplotlib 超高清渲染成功: %s (DPI: %s)", output_path, dpi)
         return True
-        
+    
     except Exception as e:
-        print(f"Matplotlib 渲染错误: {e}")
+        logger.debug("Matplotlib 渲染错误: %s", e)
         return False
 
 
-# 重命名原函数为新的函数名
-def latex_to_image(latex_code, output_path, fontsize=12, dpi=300, is_inline=False):
+def latex_to_svg_matplotlib(latex_code, output_path, fontsize=12, dpi=800, is_inline=False):
+    """使用matplotlib将LaTeX数学公式转换为SVG图片"""
+    return latex_to_image_matplotlib(latex_code, output_path, fontsize, dpi, is_inline, image_format='svg')
+
+
+# 可用的渲染后端，顺序即 tex 不可用时的默认优先级
+MATH_BACKENDS = {
+    'tex': latex_to_image_sympy,
+    'matplotlib': latex_to_image_matplotlib,
+}
+# 能输出 SVG 的后端（dvipng 只能输出位图）
+SVG_BACKENDS = {
+    'matplotlib': latex_to_svg_matplotlib,
+}
+
+# 单个公式每个后端的默认渲染时限（秒）
+DEFAULT_FORMULA_TIMEOUT = 30
+
+# 公式的显示字号（CSS 像素）和目标设备像素比
+DEFAULT_MATH_FONT_SIZE = 20
+DEFAULT_MATH_DPR = 2
+# 渲染时使用的字号（磅），与 LaTeX 默认正文字号一致
+MATH_RENDER_POINTS = 10
+
+
+def math_render_dpi(font_size=DEFAULT_MATH_FONT_SIZE, dpr=DEFAULT_MATH_DPR):
+    """
+    计算公式渲染的 DPI，使 MATH_RENDER_POINTS 磅的字在图片中正好是 font_size * dpr 像素
+    
+    1 磅 = 1/72.27 英寸，所以 DPI = 像素数 * 72.27 / 磅数
+    """
+    return max(1, round(font_size * dpr * 72.27 / MATH_RENDER_POINTS))
+
+
+def formula_image_path(images_dir, kind, latex_code, dpi, backends, image_format='png'):
+    """
+    公式图片在工作目录中的路径，按公式内容和渲染参数命名
+    
+    extract_and_replace_math 渲染前据此判断能否复用已有图片，preflight.py 不渲染也能据此判断公式是否已缓存
+    """
+    key = f'{kind}\0{latex_code}\0{MATH_RENDER_POINTS}\0{dpi}\0{",".join(backends)}'
+    if image_format != 'png':
+        key += f'\0{image_format}'
+    digest = hashlib.sha1(key.encode('utf-8')).hexdigest()[:16]
+    return os.path.join(images_dir, f'math_{kind}_{digest}.{image_format}')
+
+
+def png_size(data):
+    """从 PNG 文件头（IHDR）读取图片的宽和高，不需要解码图片"""
+    if data[:8] != b'\x89PNG\r\n\x1a\n' or data[12:16] != b'IHDR':
+        raise ValueError("不是有效的 PNG 数据")
+    return int.from_bytes(data[16:20], 'big'), int.from_bytes(data[20:24], 'big')
+
+
+SVG_SIZE_PATTERN = re.compile(rb'<svg[^>]*?\bwidth="([0-9.]+)pt"[^>]*?\bheight="([0-9.]+)pt"')
+
+
+def svg_size(data, dpi):
+    """
+    从 matplotlib 输出的 SVG 根元素读取宽和高（磅），换算为 dpi 下的像素数，与同样 DPI 的 PNG 一致
+    """
+    match = SVG_SIZE_PATTERN.search(data[:2048])
+    if match is None:
+        raise ValueError("SVG 缺少以磅为单位的宽高")
+    return round(float(match.group(1)) * dpi / 72), round(float(match.group(2)) * dpi / 72)
+
+
+def formula_alt(latex_code):
+    """
+    公式图片的 alt 文本：转义后的 LaTeX 源码，也用于渲染失败或跳过时的占位文本
+    
+    图片无法显示时读者和屏幕阅读器能看到公式，分析工具（analyze_html.py）也据此找出重复的公式；
+    $ 也转义，之后匹配行内公式时不会从 alt 中误匹配；| 也转义，公式在表格中时不会被当作单元格分隔符
+    """
+    return html.escape(latex_code).replace('$', '&#36;').replace('|', '&#124;')
+
+
+class IsolatedWorker:
+    """
+    在独立子进程中执行渲染任务
+    
+    子进程自成一个进程组，超时后连同其启动的 latex/dvipng 一起杀掉，下次调用时重建。
+    调用方的 __main__ 无法在子进程中重新导入时（见 worker_processes_supported）改为在当前进程中执行，不再有时限
+    """
+    
+    def __init__(self):
+        self._process = None
+        self._conn = None
+    
+    def _start(self):
+        context = _worker_context()
+        parent_conn, child_conn = context.Pipe()
+        self._process = context.Process(target=_isolated_worker_main, args=(child_conn,), daemon=True)
+        self._process.start()
+        child_conn.close()
+        self._conn = parent_conn
+    
+    def call(self, func, args, timeout):
+        """
+        执行 func(*args)，超过 timeout 秒抛出 TimeoutError
+        """
+        if not worker_processes_supported():
+            try:
+                return func(*args)
+            except Exception as e:
+                raise RuntimeError(f"{type(e).__name__}: {e}")
+        if self._process is None or not self._process.is_alive():
+            self._start()
+        
+        try:
+            self._conn.send((func, args))
+            if not self._conn.poll(timeout):
+                self.kill()
+                raise TimeoutError(f"渲染超时 ({timeout:.1f}s)")
+            ok, result = self._conn.recv()
+        except (EOFError, OSError):
+            self.kill()
+            raise RuntimeError("渲染进程异常退出")
+        if not ok:
+            raise RuntimeError(result)
+        return result
+    
+    def kill(self):
+        """杀掉子进程及其进程组"""
+        if self._process is None:
+            return
+        if self._process.is_alive():
+            try:
+                if hasattr(os, 'killpg'):
+                    os.killpg(self._process.pid, signal.SIGKILL)
+                else:
+                    self._process.kill()
+            except (ProcessLookupError, PermissionError):
+                self._process.kill()
+        self._process.join()
+        self._conn.close()
+        self._process = None
+        self._conn = None
+    
+    def close(self):
+        """正常结束子进程"""
+        if self._process is None:
+            return
+        try:
+            self._conn.send(None)
+            self._process.join(timeout=5)
+        except (BrokenPipeError, OSError):
+            pass
+        self.kill()
+
+
+# 是否已经提示过改为在当前进程中渲染
+_in_process_warned = False
+
+
+def worker_processes_supported():
     """
-    将LaTeX数学公式转换为PNG图片，优先使用sympy，失败时降级到matplotlib
+    能否启动渲染子进程
+    
+    forkserver 和 spawn 启动的子进程会按路径重新导入调用方的 __main__；
+    __main__ 的 __file__ 不是真实文件时（python -、嵌入的解释器）子进程无法启动，返回 False 并提示一次
     """
-    return latex_to_image_sympy(latex_code, output_path, fontsize, dpi, is_inline)
+    global _in_process_warned
+    main_module = sys.modules.get('__main__')
+    main_path = getattr(main_module, '__file__', None)
+    if getattr(main_module, '__spec__', None) is not None or main_path is None or os.path.isfile(main_path):
+        return True
+    if not _in_process_warned:
+        _in_process_warned = True
+        logger.warning("主模块 %s 不是文件，无法启动渲染子进程，改为在当前进程中渲染公式（没有单个公式的时限）",
+                       main_path)
+    return False
+
+
+def _worker_context():
+    """
+    返回创建渲染子进程的 multiprocessing 上下文
+    
+    优先使用 forkserver：从多线程进程直接 fork 可能继承其他线程持有的锁而死锁
+    """
+    if 'forkserver' in multiprocessing.get_all_start_methods():
+        context = multiprocessing.get_context('forkserver')
+        # 渲染库在 forkserver 中预先导入一次，之后每个子进程 fork 出来即可使用
+        context.set_forkserver_preload(['matplotlib.figure', 'matplotlib.backends.backend_agg', 'sympy'])
+        return context
+    return multiprocessing.get_context('spawn')
+
+
+def _isolated_worker_main(conn):
+    """IsolatedWorker 子进程的主循环"""
+    if hasattr(os, 'setsid'):
+        os.setsid()
+    while True:
+        try:
+            task = conn.recv()
+        except EOFError:
+            break
+        if task is None:
+            break
+        func, args = task
+        try:
+            conn.send((True, func(*args)))
+        except Exception as e:
+            conn.send((False, f"{type(e).__name__}: {e}"))
+
+
+def latex_to_image(latex_code, output_path, fontsize=12, dpi=300, is_inline=False, timeout=None, worker=None,
+                   backends=None, image_format='png'):
+    """
+    将LaTeX数学公式转换为PNG图片，依次尝试 backends 中的后端（默认 MATH_BACKENDS 全部），失败立即换下一个
+    
+    指定 timeout 和 worker 时，每个后端都在 worker 的子进程中执行，超时即被杀掉；
+    image_format='svg' 时只尝试 backends 中能输出 SVG 的后端（没有时使用 SVG_BACKENDS 全部）
+    """
+    table = SVG_BACKENDS if image_format == 'svg' else MATH_BACKENDS
+    names = [name for name in backends or table if name in table] or list(table)
+    for name in names:
+        backend = table[name]
+        args = (latex_code, output_path, fontsize, dpi, is_inline)
+        if worker is None or timeout is None:
+            if backend(*args):
+                return True
+            continue
+        
+        try:
+            if worker.call(backend, args, timeout):
+                return True
+        except TimeoutError as e:
+            logger.warning("%s %s: %s", name, e, latex_code)
+        except RuntimeError as e:
+            logger.debug("%s 失败: %s", name, e)
+    return False
+
+
+# 每个进程只探测一次后端能力
+_probe_lock = threading.Lock()
+_probe_result = None
+
+# 探测时使用的测试公式和时限
+PROBE_FORMULA = r'\frac{a}{b} + x^2'
+PROBE_TIMEOUT = 30
+
+
+def _tool_version(tool):
+    """返回命令行工具的版本信息首行，不存在时返回 None"""
+    if shutil.which(tool) is None:
+        return None
+    try:
+        result = subprocess.run([tool, '--version'], capture_output=True, text=True, timeout=10)
+    except (OSError, subprocess.TimeoutExpired):
+        return None
+    lines = result.stdout.strip().splitlines()
+    return lines[0] if lines else ''
+
+
+def math_tools_key():
+    """探测结果（以及 preflight.py 实测耗时）的缓存键：PATH 与 latex、dvipng、matplotlib、sympy 的版本"""
+    import importlib.metadata
+    
+    parts = [os.environ.get('PATH', ''), str(_tool_version('latex')), str(_tool_version('dvipng'))]
+    for package in ('matplotlib', 'sympy'):
+        try:
+            parts.append(importlib.metadata.version(package))
+        except importlib.metadata.PackageNotFoundError:
+            parts.append('')
+    return hashlib.sha256('\n'.join(parts).encode('utf-8')).hexdigest()
+
+
+def _measure_backend(name, worker):
+    """用测试公式渲染两次，返回第二次的耗时（秒），失败返回 None"""
+    if name == 'tex' and not (shutil.which('latex') and shutil.which('dvipng')):
+        return None
+    
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        cost = None
+        for attempt in range(2):
+            output_path = os.path.join(tmp_dir, f'probe_{attempt}.png')
+            start = time.perf_counter()
+            try:
+                ok = worker.call(MATH_BACKENDS[name], (PROBE_FORMULA, output_path, 12, 300, False), PROBE_TIMEOUT)
+            except (TimeoutError, RuntimeError) as e:
+                logger.debug("探测后端 %s 失败: %s", name, e)
+                return None
+            if not ok or not os.path.exists(output_path):
+                return None
+            cost = time.perf_counter() - start
+        return cost
+
+
+def probe_math_backends(refresh=False):
+    """
+    探测公式渲染后端是否可用以及每个公式的渲染耗时
+    
+    每个进程只探测一次，结果按 PATH 和工具版本缓存到磁盘，refresh=True 时重新探测
+    
+    Returns:
+        {后端名: 每个公式的耗时（秒）或 None（不可用）}
+    """
+    global _probe_result
+    
+    with _probe_lock:
+        if _probe_result is not None and not refresh:
+            return _probe_result
+        
+        key = math_tools_key()
+        cache_path = os.path.join(get_cache_dir('probe'), 'math_backends.json')
+        cached = {}
+        if os.path.exists(cache_path):
+            try:
+                with open(cache_path, 'r', encoding='utf-8') as f:
+                    cached = json.load(f)
+            except (OSError, ValueError):
+                cached = {}
+        
+        if key in cached and not refresh:
+            _probe_result = cached[key]
+            logger.debug("使用缓存的后端探测结果: %s", _probe_result)
+            return _probe_result
+        
+        worker = IsolatedWorker()
+        try:
+            result = {name: _measure_backend(name, worker) for name in MATH_BACKENDS}
+        finally:
+            worker.close()
+        logger.debug("后端探测结果: %s", result)
+        
+        cached[key] = result
+        try:
+            with open(cache_path, 'w', encoding='utf-8') as f:
+                json.dump(cached, f, indent=2)
+        except OSError as e:
+            logger.debug("写入探测缓存失败: %s", e)
+        
+        _probe_result = result
+        return result
+
+
+def select_math_backends(mode='auto'):
+    """
+    按模式返回后端尝试顺序
+    
+    auto: 只使用探测可用的后端，按每个公式的耗时从快到慢排列
+    其余取值为 MATH_BACKENDS 中的后端名，只使用该后端，不做探测
+    """
+    if mode != 'auto':
+        if mode not in MATH_BACKENDS:
+            raise ValueError(f"未知的公式渲染后端: {mode}，可选: auto, {', '.join(MATH_BACKENDS)}")
+        return [mode]
+    
+    costs = probe_math_backends()
+    available = sorted((name for name, cost in costs.items() if cost is not None), key=lambda name: costs[name])
+    if not available:
+        logger.warning("没有探测到可用的公式渲染后端，依次尝试全部后端")
+        return list(MATH_BACKENDS)
+    return available
 
 
 def is_simple_inline_math(latex_code):
@@ -209,13 +551,178 @@ def convert_simple_inline_math(latex_code):
     return result
 
 
-def extract_and_replace_math(content):
+# 代码块、行内代码和公式的匹配规则，extract_and_replace_math 与 preflight.py 共用
+FENCED_CODE_PATTERN = re.compile(r'```[\s\S]*?```', re.MULTILINE)
+INLINE_CODE_PATTERN = re.compile(r'`[^`\n]+`')
+BLOCK_MATH_PATTERN = re.compile(r'\$\$(.*?)\$\$', re.DOTALL)
+INLINE_MATH_PATTERN = re.compile(r'(?<!\$)\$([^$\n]+?)\$(?!\$)')
+
+# 每个公式可选的输出方式，见 extract_and_replace_math 的 math_strategies
+MATH_STRATEGIES = ('png', 'svg', 'unicode', 'mathml')
+# 公式的默认输出方式：image 渲染为图片，mathml 转换为 MathML（无法转换的公式仍渲染为图片）
+MATH_OUTPUTS = ('image', 'mathml')
+
+
+def find_formulas(content):
+    """
+    不渲染，按 extract_and_replace_math 的规则找出文档中的公式（跳过代码块和行内代码）
+    
+    Returns:
+        [(kind, latex_code)]，kind 为 block 或 inline，先块级后行内，重复的公式也逐个列出
+    """
+    content = INLINE_CODE_PATTERN.sub('', FENCED_CODE_PATTERN.sub('', content))
+    formulas = [('block', match.group(1).strip()) for match in BLOCK_MATH_PATTERN.finditer(content)]
+    content = BLOCK_MATH_PATTERN.sub('', content)
+    formulas.extend(('inline', match.group(1).strip()) for match in INLINE_MATH_PATTERN.finditer(content))
+    return formulas
+
+
+# 公式拼图（math_sprite）每张图的最大宽高和公式之间的透明间隔（像素），间隔避免缩放时相邻公式渗入
+SPRITE_MAX_WIDTH = 2048
+SPRITE_MAX_HEIGHT = 4096
+SPRITE_PADDING = 2
+# 拼图中公式的占位符，全部公式渲染完、拼图生成后替换
+SPRITE_TOKEN_PATTERN = re.compile(r'md2html-sprite-(\d+)')
+# 拼图中公式的公共样式
+SPRITE_CSS = '.math-sprite { display: inline-block; vertical-align: middle; background-repeat: no-repeat; }'
+
+
+def pack_sprites(sizes, max_width=SPRITE_MAX_WIDTH, max_height=SPRITE_MAX_HEIGHT, padding=SPRITE_PADDING):
+    """
+    按行排列（shelf packing）把多张图片放进一张或几张拼图
+    
+    图片按高度从高到低依次放入当前行，放不下时换行，超出 max_height 时换一张新图；
+    行内公式的高度接近，这样排列几乎没有空隙
+    
+    Args:
+        sizes: [(宽, 高)]
+    
+    Returns:
+        (placements, sheets)：placements 与 sizes 一一对应，每项为 (拼图序号, x, y)；sheets 为每张拼图的 [宽, 高]
+    """
+    placements = [None] * len(sizes)
+    sheets = []
+    x = y = row_height = 0
+    for index in sorted(range(len(sizes)), key=lambda i: (-sizes[i][1], -sizes[i][0])):
+        width, height = sizes[index]
+        if x and x + width > max_width:
+            x, y, row_height = 0, y + row_height + padding, 0
+        if not sheets or (y and y + height > max_height):
+            sheets.append([0, 0])
+            x = y = row_height = 0
+        placements[index] = (len(sheets) - 1, x, y)
+        sheets[-1][0] = max(sheets[-1][0], x + width)
+        sheets[-1][1] = max(sheets[-1][1], y + height)
+        x += width + padding
+        row_height = max(row_height, height)
+    return placements, sheets
+
+
+def build_sprite_sheets(image_paths, images_dir):
+    """
+    把工作目录中的 PNG 公式图片拼成拼图，写到 images_dir 中
+    
+    公式图片按内容命名，拼图按其中的图片和排列参数命名，已存在时直接复用
+    
+    Returns:
+        (placements, sheets, sizes)：placements 见 pack_sprites，sheets 为每张拼图的 (路径, 宽, 高)，
+        sizes 为每张公式图片的 (宽, 高)
+    """
+    sizes = []
+    for img_path in image_paths:
+        with open(img_path, 'rb') as f:
+            sizes.append(png_size(f.read(24)))
+    placements, sheet_sizes = pack_sprites(sizes)
+    
+    key = '\0'.join([f'{SPRITE_MAX_WIDTH}:{SPRITE_MAX_HEIGHT}:{SPRITE_PADDING}']
+                     + [os.path.basename(img_path) for img_path in image_paths])
+    digest = hashlib.sha1(key.encode('utf-8')).hexdigest()[:16]
+    sheets = [(os.path.join(images_dir, f'math_sprite_{digest}_{index}.png'), width, height)
+              for index, (width, height) in enumerate(sheet_sizes)]
+    if all(os.path.exists(path) for path, _, _ in sheets):
+        return placements, sheets, sizes
+    
+    from PIL import Image, ImageChops
+    
+    images = [Image.new('RGBA', (width, height), (0, 0, 0, 0)) for _, width, height in sheets]
+    for img_path, (index, x, y) in zip(image_paths, placements):
+        with Image.open(img_path) as img:
+            images[index].paste(img.convert('RGBA'), (x, y))
+    for image, (path, _, _) in zip(images, sheets):
+        # 公式图片通常是灰度的，没有彩色时无损地保存为灰度加透明通道，体积约减半
+        red, green, blue, _ = image.split()
+        if ImageChops.difference(red, green).getbbox() is None and ImageChops.difference(red, blue).getbbox() is None:
+            image = image.convert('LA')
+        # 先写入临时文件再改名，与公式图片一样可以被同时运行的转换复用
+        tmp_path = f'{os.path.splitext(path)[0]}.{os.getpid()}-{threading.get_ident()}.tmp.png'
+        image.save(tmp_path, format='PNG', optimize=True)
+        os.replace(tmp_path, path)
+    logger.debug("公式拼图: %d 个公式 -> %s", len(image_paths),
+                 ", ".join(f'{width}x{height}px' for _, width, height in sheets))
+    return placements, sheets, sizes
+
+
+def _css_px(value):
+    return f'{round(value, 3):g}px'
+
+
+def extract_and_replace_math(content, stats=None, options=None):
     """
     提取LaTeX数学公式并替换为超高清PNG图片
     注意：需要先保护代码块内容，避免误处理
+    
+    stats: 可选的 Counter，累计 rendered（渲染）、cached（复用）、failed（失败）、
+           skipped（超出时间预算未渲染）、unicode（替换为文本）、mathml（转换为 MathML）的公式数量
+    options: 可选的转换选项：
+        formula_timeout: 单个公式每个后端的渲染时限（秒），在独立子进程中执行，默认 30；
+                         设为 None 时在当前进程中直接渲染
+        math_budget: 整个文档用于渲染公式的总时间（秒），超出后剩余公式不再渲染；
+                     从选择渲染后端之后开始计算，不含首次运行时探测后端的耗时
+        math_backend: 渲染后端 auto/tex/matplotlib，默认 auto，见 select_math_backends
+        math_font_size: 公式的显示字号（CSS 像素），默认 20
+        math_dpr: 目标设备像素比（1、2、3），默认 2，渲染 DPI 由字号和像素比算出，
+                  图片按像素数除以像素比的尺寸显示
+        workspace: 工作目录，公式图片保存在其中的 images/ 下，按内容命名，已存在时直接复用；
+                   默认使用临时目录并在返回前删除
+        math_output: 公式的默认输出方式 image（默认）或 mathml：在当前进程中用 latex_mathml 转换为
+                     MathML，浏览器直接显示，不需要图片和脚本；无法转换的公式仍渲染为图片
+        math_sprite: 把行内公式的 PNG 图片拼成一张或几张拼图（见 pack_sprites），页面中只嵌入一次，
+                     每个公式是按 CSS 背景位置显示拼图一部分的 <span role="img">，拼图的样式放在返回内容的开头；
+                     减少图片数量、PNG 文件头和浏览器解码的次数。块级公式仍为单独的图片，窄屏上可以按比例缩小
+        math_strategies: 可选的字典 {(kind, latex_code): 输出方式}，kind 为 block 或 inline，
+                         输出方式为 png（math_output 为 image 时的默认值）、svg（matplotlib 输出的矢量图）、
+                         unicode（只用于 is_simple_inline_math 的行内公式，其余按 png 处理）或 mathml，
+                         通常由 preflight.py 按时间或体积预算生成
+    
+    函数不依赖当前目录和任何全局状态，多个线程或进程可以同时调用
     """
-    if not os.path.exists('images'):
-        os.makedirs('images')
+    if stats is None:
+        stats = Counter()
+    if options is None:
+        options = {}
+    strategies = options.get('math_strategies') or {}
+    math_output = options.get('math_output', 'image')
+    if math_output not in MATH_OUTPUTS:
+        raise ValueError(f"未知的公式输出方式: {math_output}，可选: {', '.join(MATH_OUTPUTS)}")
+    default_strategy = 'mathml' if math_output == 'mathml' else 'png'
+    sprite = options.get('math_sprite', False)
+    
+    formula_timeout = options.get('formula_timeout', DEFAULT_FORMULA_TIMEOUT)
+    math_budget = options.get('math_budget')
+    # 时间预算从后端选择完成后开始计算，冷启动时的探测耗时不占用文档的预算
+    deadline = None
+    # 后端选择可能需要探测，等遇到第一个公式时再进行
+    backends = None
+    worker = IsolatedWorker() if formula_timeout else None
+    math_dpr = options.get('math_dpr', DEFAULT_MATH_DPR)
+    dpi = math_render_dpi(options.get('math_font_size', DEFAULT_MATH_FONT_SIZE), math_dpr)
+    
+    workspace = options.get('workspace')
+    temp_workspace = None
+    if workspace is None:
+        temp_workspace = workspace = tempfile.mkdtemp(prefix='md2html-')
+    images_dir = os.path.join(workspace, 'images')
+    os.makedirs(images_dir, exist_ok=True)
     
     # 第一步：保护代码块内容
     code_blocks = []
@@ -229,7 +736,7 @@ def extract_and_replace_math(content):
         return placeholder
     
     # 保护三个反引号代码块
-    protected_content = re.sub(r'```[\s\S]*?```', save_code_block, content, flags=re.MULTILINE)
+    protected_content = FENCED_CODE_PATTERN.sub(save_code_block, content)
     
     # 保护单行代码块
     inline_code_blocks = []
@@ -242,60 +749,211 @@ def extract_and_replace_math(content):
         return placeholder
     
     # 保护行内代码
-    protected_content = re.sub(r'`[^`\n]+`', save_inline_code, protected_content)
+    protected_content = INLINE_CODE_PATTERN.sub(save_inline_code, protected_content)
     
     # 第二步：处理数学公式
     math_counter = 0
+    # 同一文档中重复出现的公式只渲染一次
+    rendered_html = {}
+    
+    def render(latex_code, is_inline, image_format='png'):
+        """
+        在时间预算内渲染一个公式
+        
+        Returns:
+            (状态, 图片路径)，状态为 rendered、cached（工作目录中已有）、failed 或 skipped（预算耗尽）
+        """
+        nonlocal backends, deadline
+        if backends is None:
+            backends = select_math_backends(options.get('math_backend', 'auto'))
+            if math_budget:
+                deadline = time.monotonic() + math_budget
+        
+        kind = 'inline' if is_inline else 'block'
+        fontsize = MATH_RENDER_POINTS
+        img_path = formula_image_path(images_dir, kind, latex_code, dpi, backends, image_format)
+        if os.path.exists(img_path):
+            return 'cached', img_path
+        
+        timeout = formula_timeout
+        if deadline is not None:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return 'skipped', img_path
+            timeout = min(timeout, remaining) if timeout else None
+        
+        # 先写入临时文件再改名，其他同时使用该工作目录的转换不会读到不完整的图片
+        tmp_path = f'{os.path.splitext(img_path)[0]}.{os.getpid()}-{threading.get_ident()}.tmp.{image_format}'
+        if not latex_to_image(latex_code, tmp_path, fontsize=fontsize, dpi=dpi, is_inline=is_inline,
+                              timeout=timeout, worker=worker, backends=backends, image_format=image_format):
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+            logger.warning("公式渲染失败: %s", latex_code)
+            return 'failed', img_path
+        os.replace(tmp_path, img_path)
+        return 'rendered', img_path
+    
+    def embed(img_path):
+        """读取公式图片，返回 data URI 和显示尺寸（图片像素数除以设备像素比）"""
+        with open(img_path, 'rb') as img_file:
+            data = img_file.read()
+        if img_path.endswith('.svg'):
+            width, height = svg_size(data, dpi)
+            mime_type = 'image/svg+xml'
+        else:
+            width, height = png_size(data)
+            mime_type = 'image/png'
+        display_width = max(1, round(width / math_dpr))
+        display_height = max(1, round(height / math_dpr))
+        logger.debug("  公式图片尺寸: %dx%dpx -> 显示尺寸: %dx%dpx",
+                     width, height, display_width, display_height)
+        return f'data:{mime_type};base64,{base64.b64encode(data).decode()}', display_width, display_height
+    
+    def to_mathml(latex_code, display):
+        """转换为 MathML，无法转换时返回 None，由调用方改为渲染图片"""
+        from latex_mathml import MathMLError, latex_to_mathml
+        
+        try:
+            mathml = latex_to_mathml(latex_code, display=display)
+        except MathMLError as e:
+            logger.debug("无法转换为 MathML，改为渲染图片: %s", e)
+            return None
+        stats['mathml'] += 1
+        return mathml
+    
+    def inline_image_html(img_path, latex_code):
+        img_data, display_width, display_height = embed(img_path)
+        # 行内公式与块级公式使用相同的字号，按设备像素比换算出的尺寸显示
+        return f'<img src="{img_data}" alt="{formula_alt(latex_code)}" width="{display_width}" height="{display_height}" style="display: inline; vertical-align: middle;">'
+    
+    # 放入拼图的行内公式 (图片路径, LaTeX)，按占位符序号排列
+    sprite_items = []
+    
+    def insert_sprites(content):
+        """生成拼图，把占位符替换为显示拼图一部分的 <span>，拼图的样式放在内容开头"""
+        if len(sprite_items) < 2:
+            # 只有一个公式时拼图没有好处
+            return SPRITE_TOKEN_PATTERN.sub(lambda match: inline_image_html(*sprite_items[int(match.group(1))]),
+                                            content)
+        
+        placements, sheets, sizes = build_sprite_sheets([img_path for img_path, _ in sprite_items], images_dir)
+        rules = [SPRITE_CSS]
+        classes = []
+        for path, _, _ in sheets:
+            with open(path, 'rb') as f:
+                data = base64.b64encode(f.read()).decode()
+            classes.append(f'math-sprite-{os.path.basename(path)[12:-4]}')
+            rules.append(f'.{classes[-1]} {{ background-image: url(data:image/png;base64,{data}); }}')
+        
+        spans = []
+        for (_, latex_code), (index, x, y), (width, height) in zip(sprite_items, placements, sizes):
+            # 与单独的图片一样按设备像素比换算出的整数尺寸显示，背景按相同比例缩放
+            display_width = max(1, round(width / math_dpr))
+            display_height = max(1, round(height / math_dpr))
+            scale_x = display_width / width
+            scale_y = display_height / height
+            _, sheet_width, sheet_height = sheets[index]
+            style = (f'width: {display_width}px; height: {display_height}px; '
+                     f'background-size: {_css_px(sheet_width * scale_x)} {_css_px(sheet_height * scale_y)}; '
+                     f'background-position: -{_css_px(x * scale_x)} -{_css_px(y * scale_y)};')
+            spans.append(f'<span class="math-sprite {classes[index]}" role="img" '
+                         f'aria-label="{formula_alt(latex_code)}" style="{style}"></span>')
+        logger.debug("%d 个行内公式拼成 %d 张拼图", len(sprite_items), len(sheets))
+        content = SPRITE_TOKEN_PATTERN.sub(lambda match: spans[int(match.group(1))], content)
+        return f'<style>\n{chr(10).join(rules)}\n</style>\n\n{content}'
     
     # 处理块级数学公式 ($$...$$)
     def replace_block_math(match):
         nonlocal math_counter
-        math_counter += 1
         latex_code = match.group(1).strip()
         
-        print(f"处理块级公式 {math_counter}: {latex_code[:50]}...")
+        key = ('block', latex_code)
+        if key in rendered_html:
+            stats['cached'] += 1
+            logger.debug("复用块级公式: %.50s", latex_code)
+            return rendered_html[key]
         
-        # 生成超高清PNG
-        img_path = f'images/math_block_{math_counter}.png'
-        if latex_to_image(latex_code, img_path, fontsize=20, dpi=800, is_inline=False):
-            # 计算图片的实际像素高度
-            with Image.open(img_path) as img:
-                original_width = img.width
-                original_height = img.height
-                display_height = original_height // 4  # 1/4高度
-            
-            print(f"  块级公式图片尺寸: {original_width}x{original_height}px -> 显示高度: {display_height}px")
-            
-            with open(img_path, 'rb') as img_file:
-                img_data = base64.b64encode(img_file.read()).decode()
-            # 块级公式使用计算出的1/4高度，宽度自适应
-            img_html = f'<div class="math-block"><img src="data:image/png;base64,{img_data}" alt="Math formula" style="display: block; margin: 10px auto; height: {display_height}px; width: auto;"></div>'
-            return img_html
+        math_counter += 1
+        logger.debug("处理块级公式 %d: %.50s...", math_counter, latex_code)
+        
+        strategy = strategies.get(key, default_strategy)
+        if strategy == 'mathml':
+            mathml = to_mathml(latex_code, display=True)
+            if mathml is not None:
+                rendered_html[key] = f'<div class="math-block">{mathml}</div>'
+                return rendered_html[key]
+        
+        # 生成超高清PNG（或按 math_strategies 生成SVG）
+        image_format = 'svg' if strategy == 'svg' else 'png'
+        status, img_path = render(latex_code, is_inline=False, image_format=image_format)
+        stats[status] += 1
+        if status == 'skipped':
+            return f'<div class="math-error">Skipped: {formula_alt(latex_code)}</div>'
+        if status != 'failed':
+            img_data, display_width, display_height = embed(img_path)
+            # 块级公式按设备像素比换算出的尺寸显示，窄屏上按比例缩小
+            img_html = f'<div class="math-block"><img src="{img_data}" alt="{formula_alt(latex_code)}" width="{display_width}" height="{display_height}" style="display: block; margin: 10px auto; width: {display_width}px; max-width: 100%; height: auto;"></div>'
         else:
-            return f'<div class="math-error">Error rendering: {latex_code}</div>'
+            img_html = f'<div class="math-error">Error rendering: {formula_alt(latex_code)}</div>'
+        rendered_html[key] = img_html
+        return img_html
     
     # 处理行内数学公式 ($...$)
     def replace_inline_math(match):
         nonlocal math_counter
-        math_counter += 1
         latex_code = match.group(1).strip()
         
-        print(f"处理行内公式 {math_counter}: {latex_code}")
+        key = ('inline', latex_code)
+        if key in rendered_html:
+            stats['cached'] += 1
+            logger.debug("复用行内公式: %s", latex_code)
+            return rendered_html[key]
         
-        # 生成超高清PNG（行内公式使用大字体）
-        img_path = f'images/math_inline_{math_counter}.png'
-        if latex_to_image(latex_code, img_path, fontsize=20, dpi=800, is_inline=True):
-            with open(img_path, 'rb') as img_file:
-                img_data = base64.b64encode(img_file.read()).decode()
-            # 行内公式限制显示尺寸
-            img_html = f'<img src="data:image/png;base64,{img_data}" alt="Math formula" style="display: inline; vertical-align: middle; max-height: 1.2em; height: auto; width: auto;">'
+        math_counter += 1
+        logger.debug("处理行内公式 %d: %s", math_counter, latex_code)
+        
+        strategy = strategies.get(key, default_strategy)
+        if strategy == 'mathml':
+            mathml = to_mathml(latex_code, display=False)
+            if mathml is not None:
+                rendered_html[key] = mathml
+                return mathml
+        if strategy == 'unicode' and is_simple_inline_math(latex_code):
+            # 简单的行内公式替换为文本，不渲染图片
+            stats['unicode'] += 1
+            img_html = f'<span class="math-inline">{convert_simple_inline_math(html.escape(latex_code))}</span>'
+            rendered_html[key] = img_html
             return img_html
+        
+        # 生成超高清PNG（行内公式使用大字体）
+        status, img_path = render(latex_code, is_inline=True, image_format='svg' if strategy == 'svg' else 'png')
+        stats[status] += 1
+        if status == 'skipped':
+            return f'<span class="math-error">Skipped: {formula_alt(latex_code)}</span>'
+        if status != 'failed' and sprite and img_path.endswith('.png'):
+            img_html = f'md2html-sprite-{len(sprite_items)}'
+            sprite_items.append((img_path, latex_code))
+        elif status != 'failed':
+            img_html = inline_image_html(img_path, latex_code)
         else:
-            return f'<span class="math-error">Error: {latex_code}</span>'
+            img_html = f'<span class="math-error">Error: {formula_alt(latex_code)}</span>'
+        rendered_html[key] = img_html
+        return img_html
     
     # 现在可以安全地处理数学公式，因为代码块已经被保护
-    processed_content = re.sub(r'\$\$(.*?)\$\$', replace_block_math, protected_content, flags=re.DOTALL)
-    processed_content = re.sub(r'(?<!\$)\$([^$\n]+?)\$(?!\$)', replace_inline_math, processed_content)
+    try:
+        processed_content = BLOCK_MATH_PATTERN.sub(replace_block_math, protected_content)
+        processed_content = INLINE_MATH_PATTERN.sub(replace_inline_math, processed_content)
+        if sprite_items:
+            processed_content = insert_sprites(processed_content)
+    finally:
+        if worker is not None:
+            worker.close()
+        if temp_workspace is not None:
+            shutil.rmtree(temp_workspace, ignore_errors=True)
+    
+    if stats['skipped']:
+        logger.warning("公式渲染超出时间预算 %ss，跳过 %d 个公式", math_budget, stats['skipped'])
     
     # 第三步：恢复代码块内容
     # 恢复行内代码
@@ -311,116 +969,287 @@ def extract_and_replace_math(content):
     return processed_content
 
 
-def convert_local_images_to_base64(md_content, base_dir):
+# 匹配 ![alt](path) 格式的图片链接
+IMAGE_LINK_PATTERN = re.compile(r'!\[([^\]]*)\]\(([^)]+)\)')
+
+# 根据文件扩展名确定MIME类型
+IMAGE_MIME_TYPES = {
+    '.png': 'image/png',
+    '.jpg': 'image/jpeg',
+    '.jpeg': 'image/jpeg',
+    '.gif': 'image/gif',
+    '.bmp': 'image/bmp',
+    '.webp': 'image/webp'
+}
+
+# 超过该大小的图片不在内存中编码，写出HTML时再从 mmap 分块编码
+DEFAULT_STREAM_THRESHOLD = 1024 * 1024
+# 分块编码的块大小，必须是 3 的倍数，保证分块编码结果可以直接拼接
+STREAM_CHUNK_SIZE = 3 * 256 * 1024
+# 延迟编码图片的占位符
+ASSET_TOKEN_PATTERN = re.compile(r'md2html-asset-\d+')
+
+
+# 缩小图片时默认的设备像素比、输出格式和质量
+DEFAULT_IMAGE_DPR = 2
+DEFAULT_IMAGE_FORMAT = 'webp'
+DEFAULT_IMAGE_QUALITY = 82
+# 缩小图片的缓存版本，处理方式改变时递增，旧的缓存结果不再使用
+IMAGE_CACHE_VERSION = 2
+# EXIF 中的图片方向标签
+EXIF_ORIENTATION = 0x0112
+
+
+def downscale_image(full_path, max_width, dpr=DEFAULT_IMAGE_DPR, image_format=DEFAULT_IMAGE_FORMAT,
+                    quality=DEFAULT_IMAGE_QUALITY):
+    """
+    把宽度超过 max_width * dpr 像素的图片缩小并重新编码
+    
+    按 EXIF 方向旋转后再计算尺寸和缩小：显示尺寸与浏览器中看到的方向一致，重新编码丢掉 EXIF 后图片也不会横躺；
+    结果按源文件哈希和参数缓存在缓存目录中
+    
+    Returns:
+        (图片路径, MIME类型, (显示宽度, 显示高度))；不需要缩小时返回源文件路径
+    """
+    digest = hashlib.sha256()
+    with open(full_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+    digest.update(f'{IMAGE_CACHE_VERSION}:{max_width}:{dpr}:{image_format}:{quality}'.encode())
+    key = digest.hexdigest()
+    
+    cache_dir = get_cache_dir('images', key[:2])
+    meta_path = os.path.join(cache_dir, f'{key}.json')
+    if os.path.exists(meta_path):
+        with open(meta_path, 'r', encoding='utf-8') as f:
+            meta = json.load(f)
+        if meta['path'] == full_path or os.path.exists(meta['path']):
+            return meta['path'], meta['mime'], tuple(meta['size'])
+    
+    from PIL import Image, ImageOps
+    
+    _, ext = os.path.splitext(full_path)
+    with Image.open(full_path) as source:
+        img = source
+        if source.getexif().get(EXIF_ORIENTATION, 1) != 1:
+            img = ImageOps.exif_transpose(source)
+        width, height = img.size
+        display_width = min(width, max_width)
+        display_size = (display_width, max(1, round(height * display_width / width)))
+        target_width = int(max_width * dpr)
+        
+        if width <= target_width or getattr(source, 'is_animated', False):
+            meta = {'path': full_path, 'mime': IMAGE_MIME_TYPES.get(ext.lower(), 'image/png'), 'size': display_size}
+        else:
+            has_alpha = img.mode in ('RGBA', 'LA') or (img.mode == 'P' and 'transparency' in img.info)
+            output_format = image_format
+            if output_format == 'jpeg' and has_alpha:
+                output_format = 'png'
+            
+            resized = img.convert('RGBA' if has_alpha else 'RGB')
+            resized = resized.resize((target_width, max(1, round(height * target_width / width))), Image.LANCZOS)
+            
+            output_path = os.path.join(cache_dir, f'{key}.{output_format}')
+            tmp_path = f'{output_path}.{os.getpid()}.{threading.get_ident()}.tmp'
+            if output_format == 'png':
+                resized.save(tmp_path, format='PNG', optimize=True)
+            else:
+                resized.save(tmp_path, format=output_format.upper(), quality=quality)
+            os.replace(tmp_path, output_path)
+            
+            logger.debug("缩小图片: %s %dx%d -> %dx%d (%s)", full_path, width, height,
+                         resized.width, resized.height, output_format)
+            meta = {'path': output_path, 'mime': f'image/{output_format}', 'size': display_size}
+    
+    tmp_meta = f'{meta_path}.{os.getpid()}.{threading.get_ident()}.tmp'
+    with open(tmp_meta, 'w', encoding='utf-8') as f:
+        json.dump(meta, f)
+    os.replace(tmp_meta, meta_path)
+    return meta['path'], meta['mime'], tuple(meta['size'])
+
+
+def _load_image(full_path, stream_threshold, assets, options):
+    """
+    读取一张本地图片，返回 (MIME类型, base64内容或None, 显示尺寸或None)
+    
+    设置了 image_max_width 时先按显示宽度缩小图片；
+    assets 不为 None 且文件超过 stream_threshold 时不读取内容，返回 None 由调用方登记占位符
+    """
+    display_size = None
+    max_width = options.get('image_max_width')
+    if max_width:
+        full_path, mime_type, display_size = downscale_image(
+            full_path, max_width,
+            options.get('image_dpr', DEFAULT_IMAGE_DPR),
+            options.get('image_format', DEFAULT_IMAGE_FORMAT),
+            options.get('image_quality', DEFAULT_IMAGE_QUALITY)
+        )
+    else:
+        _, ext = os.path.splitext(full_path)
+        mime_type = IMAGE_MIME_TYPES.get(ext.lower(), 'image/png')
+    
+    if assets is not None and os.path.getsize(full_path) > stream_threshold:
+        return full_path, mime_type, None, display_size
+    
+    with open(full_path, 'rb') as img_file:
+        return full_path, mime_type, base64.b64encode(img_file.read()).decode('utf-8'), display_size
+
+
+def convert_local_images_to_base64(md_content, base_dir, options=None, assets=None):
     """
     将本地图片转换为base64编码
+    
+    图片在线程池中并发读取，同一文件（路径和修改时间相同）只读取一次
+    
+    options: 可选的转换选项：
+        image_workers: 读取图片的线程数（默认: 8）
+        stream_threshold: 大图片阈值（字节），见 assets
+        image_max_width: 图片的最大显示宽度（CSS像素）。设置后宽度超过 image_max_width * image_dpr
+                         的图片会被缩小，并重新编码为 image_format（默认 webp，质量 image_quality），
+                         所有图片都带上 width/height 属性
+    assets: 可选的字典。提供时超过阈值的大图片不读入内存，src 中只写入占位符，
+            并在 assets 中登记 占位符 -> 文件路径，由 write_html_with_assets 写出时分块编码
     """
+    if options is None:
+        options = {}
+    stream_threshold = options.get('stream_threshold', DEFAULT_STREAM_THRESHOLD)
+    
     # 匹配 ![alt](path) 格式的图片链接
-    img_pattern = r'!\[([^\]]*)\]\(([^)]+)\)'
+    img_pattern = IMAGE_LINK_PATTERN
+    
+    def resolve(img_path):
+        # 如果是相对路径，转换为绝对路径
+        if not os.path.isabs(img_path):
+            return os.path.join(base_dir, img_path)
+        return img_path
+    
+    # 第一步：找出所有存在的本地图片，按 (路径, 修改时间, 大小) 去重
+    file_keys = {}
+    for match in re.finditer(img_pattern, md_content):
+        img_path = match.group(2)
+        if re.match(r'^[a-zA-Z][a-zA-Z0-9+.-]*://', img_path):
+            continue
+        full_path = resolve(img_path)
+        try:
+            stat = os.stat(full_path)
+        except OSError:
+            continue
+        file_keys[full_path] = (os.path.abspath(full_path), stat.st_mtime_ns, stat.st_size)
     
+    # 第二步：并发读取并编码
+    loaded = {}
+    unique_keys = set(file_keys.values())
+    if unique_keys:
+        with ThreadPoolExecutor(max_workers=options.get('image_workers', 8)) as executor:
+            futures = {
+                key: executor.submit(_load_image, key[0], stream_threshold, assets, options)
+                for key in unique_keys
+            }
+            for key, future in futures.items():
+                try:
+                    data_path, mime_type, img_base64, display_size = future.result()
+                except Exception as e:
+                    logger.warning("处理图片失败: %s, 错误: %s", key[0], e)
+                    continue
+                if img_base64 is None:
+                    img_base64 = f'md2html-asset-{len(assets)}'
+                    assets[img_base64] = data_path
+                loaded[key] = (mime_type, img_base64, display_size)
+    
+    # 第三步：替换图片链接
     def replace_image(match):
         alt_text = match.group(1)
         img_path = match.group(2)
         
-        # 如果是相对路径，转换为绝对路径
-        if not os.path.isabs(img_path):
-            full_path = os.path.join(base_dir, img_path)
-        else:
-            full_path = img_path
+        if re.match(r'^[a-zA-Z][a-zA-Z0-9+.-]*://', img_path):
+            return match.group(0)  # 网络图片保持原样
         
-        # 检查文件是否存在
-        if os.path.exists(full_path):
-            try:
-                # 根据文件扩展名确定MIME类型
-                _, ext = os.path.splitext(full_path)
-                ext = ext.lower()
-                mime_types = {
-                    '.png': 'image/png',
-                    '.jpg': 'image/jpeg',
-                    '.jpeg': 'image/jpeg',
-                    '.gif': 'image/gif',
-                    '.bmp': 'image/bmp',
-                    '.webp': 'image/webp'
-                }
-                
-                mime_type = mime_types.get(ext, 'image/png')
-                
-                # 读取图片并转换为base64
-                with open(full_path, 'rb') as img_file:
-                    img_data = img_file.read()
-                    img_base64 = base64.b64encode(img_data).decode('utf-8')
-                    
-                # 返回base64编码的图片
-                return f'<img src="data:{mime_type};base64,{img_base64}" alt="{alt_text}" style="max-width:100%; height:auto;">'
-                
-            except Exception as e:
-                print(f"处理图片失败: {full_path}, 错误: {e}")
-                return match.group(0)  # 保持原样
-        else:
-            print(f"图片文件不存在: {full_path}")
+        full_path = resolve(img_path)
+        key = file_keys.get(full_path)
+        if key is None:
+            logger.warning("图片文件不存在: %s", full_path)
             return match.group(0)  # 保持原样
+        if key not in loaded:
+            return match.group(0)  # 读取失败，保持原样
+        
+        mime_type, img_base64, display_size = loaded[key]
+        # 明确的宽高让浏览器在解码前就能排版
+        size_attrs = f' width="{display_size[0]}" height="{display_size[1]}"' if display_size else ''
+        # 返回base64编码的图片
+        return f'<img src="data:{mime_type};base64,{img_base64}" alt="{alt_text}"{size_attrs} style="max-width:100%; height:auto;">'
     
     return re.sub(img_pattern, replace_image, md_content)
 
 
-def md_to_html_with_math_images(md_file, html_file):
+def write_html_with_assets(html_file, html, assets=None):
     """
-    将包含数学公式的Markdown文件转换为HTML文件
-    数学公式会被转换为高质量的图片
+    写出HTML文件，并把延迟编码图片的占位符替换为分块编码的base64内容
+    
+    大图片通过 mmap 按块编码后直接写入文件，不会整体放入内存；
+    先写入临时文件再改名，中途出错时不会留下不完整的HTML
     """
-    try:
-        # 确保输出文件在output目录中
-        output_dir = 'output'
-        os.makedirs(output_dir, exist_ok=True)
-        
-        # 如果html_file没有指定路径，放到output目录
-        if not os.path.dirname(html_file):
-            html_file = os.path.join(output_dir, html_file)
-        
-        # 读取markdown文件
-        with open(md_file, 'r', encoding='utf-8') as f:
-            md_content = f.read()
-        
-        # 创建临时目录存储图片
-        temp_dir = 'images'
-        os.makedirs(temp_dir, exist_ok=True)
+    with atomic_write(html_file, 'w', encoding='utf-8') as f:
+        if not assets:
+            f.write(html)
+            return
         
-        print(f"处理数学公式...")
-        
-        # 获取markdown文件的目录，用于处理相对路径的图片
-        base_dir = os.path.dirname(os.path.abspath(md_file))
-        
-        # 先转换本地图片为base64
-        md_content = convert_local_images_to_base64(md_content, base_dir)
-        
-        # 提取并替换数学公式
-        md_content_with_images = extract_and_replace_math(md_content)
-        
-        # 转换为HTML
-        html_content = markdown(md_content_with_images, extensions=[
-            'tables',
-            'fenced_code',
-            'codehilite'
-        ], extension_configs={
-            'codehilite': {
-                'css_class': 'highlight',
-                'use_pygments': True,
-                'noclasses': True  # 内联样式，不依赖外部CSS
-            }
-        })
-        
-        # 从文件名生成标题
-        title = os.path.splitext(os.path.basename(md_file))[0]
-        
-        # 创建完整的HTML文档用于调试
-        debug_html = f"""<!DOCTYPE html>
-<html lang="zh-CN">
-<head>
-    <meta charset="UTF-8">
-    <meta name="viewport" content="width=device-width, initial-scale=1.0">
-    <title>Markdown转换调试</title>
-    <style>
-        body {{
+        pos = 0
+        for match in ASSET_TOKEN_PATTERN.finditer(html):
+            path = assets.get(match.group(0))
+            if path is None:
+                continue
+            f.write(html[pos:match.start()])
+            _write_base64_stream(f, path)
+            pos = match.end()
+        f.write(html[pos:])
+
+
+def _write_base64_stream(f, path):
+    """把文件内容按块编码为base64写入文本文件对象"""
+    with open(path, 'rb') as img_file:
+        size = os.fstat(img_file.fileno()).st_size
+        if size == 0:
+            return
+        with mmap.mmap(img_file.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            for offset in range(0, size, STREAM_CHUNK_SIZE):
+                f.write(base64.b64encode(data[offset:offset + STREAM_CHUNK_SIZE]).decode('ascii'))
+
+
+def convert_markdown(md_content, base_dir, options=None, stats=None, assets=None, toc=None):
+    """
+    将Markdown内容转换为HTML片段：嵌入本地图片、把数学公式替换为图片，再解析Markdown
+    
+    Args:
+        md_content: Markdown 内容
+        base_dir: 解析相对路径图片的目录
+        options: 转换选项，见 convert_local_images_to_base64 和 extract_and_replace_math，另外支持：
+            markdown_backend: Markdown 解析后端 markdown（默认）、markdown-it、mistune 或 auto
+            heading_id_prefix: 标题 id 的前缀，合并多个文档时避免 id 冲突（仅在提供 toc 时使用）
+        stats: 可选的 Counter，累计公式统计
+        assets: 可选的字典，登记需要在写出时分块编码的大图片
+        toc: 可选的列表。提供时给标题加上 id，并追加 Markdown 解析时得到的标题树
+             （toc 扩展的 toc_tokens 格式，每项包含 level、id、name、children）
+    
+    Returns:
+        HTML 片段
+    """
+    if options is None:
+        options = {}
+    
+    # 先转换本地图片为base64
+    md_content = convert_local_images_to_base64(md_content, base_dir, options, assets)
+    
+    # 提取并替换数学公式
+    md_content_with_images = extract_and_replace_math(md_content, stats, options)
+    
+    # 转换为HTML
+    from markdown_backends import render_markdown
+    return render_markdown(md_content_with_images, options.get('markdown_backend', 'markdown'),
+                           toc=toc, heading_id_prefix=options.get('heading_id_prefix', ''))
+
+
+# 页面样式，单个文档和书籍模式共用
+PAGE_CSS = """        body {
             font-family: "Times New Roman", "SimSun", serif;
             line-height: 1.6;
             max-width: 800px;
@@ -428,80 +1257,80 @@ def md_to_html_with_math_images(md_file, html_file):
             padding: 20px;
             background-color: #fff;
             color: #333;
-        }}
-        h1, h2, h3, h4, h5, h6 {{
+        }
+        h1, h2, h3, h4, h5, h6 {
             color: #2c3e50;
             margin-top: 2em;
             margin-bottom: 1em;
-        }}
-        p {{
+        }
+        p {
             margin-bottom: 1em;
             text-align: justify;
-        }}
-        code {{
+        }
+        code {
             background-color: #f4f4f4;
             padding: 2px 4px;
             border-radius: 3px;
             font-family: "Courier New", monospace;
             font-size: 0.9em;
-        }}
-        pre {{
+        }
+        pre {
             background-color: #f4f4f4;
             padding: 15px;
             border-radius: 5px;
             overflow-x: auto;
             border: 1px solid #ddd;
             line-height: 1.45;
-        }}
-        pre code {{
+        }
+        pre code {
             background-color: transparent;
             padding: 0;
             font-size: 0.9em;
             line-height: inherit;
-        }}
+        }
         /* 代码高亮样式优化 */
-        .highlight {{
+        .highlight {
             background-color: #f4f4f4;
             border-radius: 5px;
             padding: 15px;
             overflow-x: auto;
             border: 1px solid #ddd;
             margin: 16px 0;
-        }}
-        .highlight pre {{
+        }
+        .highlight pre {
             background-color: transparent;
             border: none;
             padding: 0;
             margin: 0;
-        }}
-        blockquote {{
+        }
+        blockquote {
             border-left: 4px solid #3498db;
             padding-left: 15px;
             margin-left: 0;
             font-style: italic;
             color: #666;
-        }}
-        table {{
+        }
+        table {
             border-collapse: collapse;
             width: 100%;
             margin: 1em 0;
-        }}
-        th, td {{
+        }
+        th, td {
             border: 1px solid #ddd;
             padding: 12px;
             text-align: left;
-        }}
-        th {{
+        }
+        th {
             background-color: #f2f2f2;
             font-weight: bold;
-        }}
+        }
         /* 数学公式样式 */
-        .math-block {{
+        .math-block {
             text-align: center;
             margin: 20px 0;
             padding: 10px;
-        }}
-        .math-block img {{
+        }
+        .math-block img {
             display: block;
             margin: 0 auto;
             width: auto;
@@ -510,11 +1339,11 @@ def md_to_html_with_math_images(md_file, html_file):
             image-rendering: high-quality;
             image-rendering: -webkit-optimize-contrast;
             -ms-interpolation-mode: bicubic;
-        }}
-        .math-inline {{
+        }
+        .math-inline {
             display: inline;
-        }}
-        .math-inline img {{
+        }
+        .math-inline img {
             display: inline;
             vertical-align: middle;
             max-height: 1.2em;
@@ -524,66 +1353,258 @@ def md_to_html_with_math_images(md_file, html_file):
             image-rendering: high-quality;
             image-rendering: -webkit-optimize-contrast;
             -ms-interpolation-mode: bicubic;
-        }}
-        .math-error {{
+        }
+        /* MathML 公式使用数学字体 */
+        math {
+            font-family: "Latin Modern Math", "STIX Two Math", "Cambria Math", math;
+        }
+        .math-error {
             color: red;
             background-color: #ffe6e6;
             padding: 2px 4px;
             border-radius: 3px;
             font-family: monospace;
-        }}
+        }
         /* 优化高DPI图片显示 */
-        img[src*="base64"] {{
+        img[src*="base64"] {
             image-rendering: high-quality;
             image-rendering: -webkit-optimize-contrast;
             -ms-interpolation-mode: bicubic;
-        }}
+        }
         /* 针对数学公式图片的特殊优化 */
-        .math-block img, .math-inline img {{
+        .math-block img, .math-inline img {
             image-rendering: high-quality;
             image-rendering: -webkit-optimize-contrast;
             -ms-interpolation-mode: bicubic;
-        }}
-    </style>
+        }
+"""
+
+
+def md_to_html_with_math_images(md_file, html_file, options=None):
+    """
+    将包含数学公式的Markdown文件转换为HTML文件
+    数学公式会被转换为高质量的图片
+    
+    options: 可选的转换选项，公式相关选项见 extract_and_replace_math，另外支持：
+        output_dir: html_file 不含目录时放到该目录下（默认: output），设为 None 时按原样使用 html_file
+        minify: 压缩 HTML，<pre>、<code> 和公式脚本的内容保持原样（默认: False）
+        precompress: 在 HTML 旁边写出 .gz（安装了 brotli 时还有 .br）文件（默认: False）
+        raise_errors: 出错时抛出原来的异常，而不是记录日志后返回 False（默认: False）
+    
+    每次调用的状态都是独立的，多个线程或进程可以同时转换，
+    需要保留公式图片时通过 workspace 选项指定工作目录
+    """
+    if options is None:
+        options = {}
+    
+    try:
+        # 如果html_file没有指定路径，放到输出目录
+        output_dir = options.get('output_dir', 'output')
+        if output_dir and not os.path.dirname(html_file):
+            html_file = os.path.join(output_dir, html_file)
+        if os.path.dirname(html_file):
+            os.makedirs(os.path.dirname(html_file), exist_ok=True)
+        
+        # 读取markdown文件
+        with open(md_file, 'r', encoding='utf-8') as f:
+            md_content = f.read()
+        
+        logger.debug("处理数学公式...")
+        
+        # 获取markdown文件的目录，用于处理相对路径的图片
+        base_dir = os.path.dirname(os.path.abspath(md_file))
+        
+        # 大图片在写出时再分块编码
+        assets = {}
+        stats = Counter()
+        html_content = convert_markdown(md_content, base_dir, options, stats, assets)
+        logger.info("公式统计: 渲染 %d, 复用 %d, 失败 %d, 跳过 %d",
+                    stats['rendered'], stats['cached'], stats['failed'], stats['skipped'])
+        if stats['mathml']:
+            logger.info("转换为 MathML 的公式: %d", stats['mathml'])
+        
+        # 从文件名生成标题
+        title = os.path.splitext(os.path.basename(md_file))[0]
+        
+        # 创建完整的HTML文档用于调试
+        debug_html = f"""<!DOCTYPE html>
+<html lang="zh-CN">
+<head>
+    <meta charset="UTF-8">
+    <meta name="viewport" content="width=device-width, initial-scale=1.0">
+    <title>Markdown转换调试</title>
+    <style>
+{PAGE_CSS}    </style>
 </head>
 <body>
 {html_content}
 </body>
 </html>"""
         
+        minify_seconds = None
+        saved_bytes = 0
+        if options.get('minify', False):
+            from html_minify import minify_html
+            
+            # 延迟编码图片的占位符不受影响，写出时照常替换
+            start = time.perf_counter()
+            minified = minify_html(debug_html)
+            minify_seconds = time.perf_counter() - start
+            saved_bytes = len(debug_html.encode('utf-8')) - len(minified.encode('utf-8'))
+            debug_html = minified
+        
         # 保存HTML文件
-        with open(html_file, 'w', encoding='utf-8') as f:
-            f.write(debug_html)
+        write_html_with_assets(html_file, debug_html, assets)
         
-        print(f"转换完成: {html_file}")
-        print(f"数学公式图片已保存到: {temp_dir}/")
-        print("转换成功!")
+        if minify_seconds is not None or options.get('precompress', False):
+            from html_minify import format_report, write_precompressed
+            
+            compressed = write_precompressed(html_file) if options.get('precompress', False) else []
+            for line in format_report(html_file, minify_seconds, saved_bytes, compressed):
+                logger.info(line)
         
-        return True
+        logger.info("转换完成: %s", html_file)
+        if options.get('workspace'):
+            logger.debug("数学公式图片已保存到: %s/", os.path.join(options['workspace'], 'images'))
         
+        return True
+    
     except Exception as e:
-        print(f"转换失败: {e}")
+        if options.get('raise_errors'):
+            raise
+        logger.error("转换失败: %s", e)
         return False
 
 
-if __name__ == "__main__":
-    if len(sys.argv) != 3:
-        print("用法: python md2html_with_images.py <input.md> <output.html>")
+def main():
+    args = []
+    # 命令行默认把公式图片保存到当前目录的 images/ 下，并复用已有的图片
+    options = {"workspace": "."}
+    verbose = False
+    dry_run = False
+    
+    i = 1
+    while i < len(sys.argv):
+        arg = sys.argv[i]
+        if arg == "--verbose":
+            verbose = True
+            i += 1
+        elif arg == "--formula-timeout" and i + 1 < len(sys.argv):
+            timeout = float(sys.argv[i + 1])
+            options["formula_timeout"] = timeout if timeout > 0 else None
+            i += 2
+        elif arg == "--math-backend" and i + 1 < len(sys.argv):
+            options["math_backend"] = sys.argv[i + 1]
+            i += 2
+        elif arg == "--markdown-backend" and i + 1 < len(sys.argv):
+            options["markdown_backend"] = sys.argv[i + 1]
+            i += 2
+        elif arg == "--math-dpr" and i + 1 < len(sys.argv):
+            options["math_dpr"] = float(sys.argv[i + 1])
+            i += 2
+        elif arg == "--math-font-size" and i + 1 < len(sys.argv):
+            options["math_font_size"] = float(sys.argv[i + 1])
+            i += 2
+        elif arg == "--workspace" and i + 1 < len(sys.argv):
+            options["workspace"] = sys.argv[i + 1]
+            i += 2
+        elif arg == "--output-dir" and i + 1 < len(sys.argv):
+            options["output_dir"] = sys.argv[i + 1]
+            i += 2
+        elif arg == "--image-max-width" and i + 1 < len(sys.argv):
+            options["image_max_width"] = int(sys.argv[i + 1])
+            i += 2
+        elif arg == "--image-dpr" and i + 1 < len(sys.argv):
+            options["image_dpr"] = float(sys.argv[i + 1])
+            i += 2
+        elif arg == "--image-format" and i + 1 < len(sys.argv):
+            options["image_format"] = sys.argv[i + 1]
+            i += 2
+        elif arg == "--math-output" and i + 1 < len(sys.argv):
+            options["math_output"] = sys.argv[i + 1]
+            i += 2
+        elif arg == "--math-sprite":
+            options["math_sprite"] = True
+            i += 1
+        elif arg == "--math-budget" and i + 1 < len(sys.argv):
+            options["math_budget"] = float(sys.argv[i + 1])
+            i += 2
+        elif arg == "--math-plan" and i + 1 < len(sys.argv):
+            from preflight import load_plan
+            
+            try:
+                options["math_strategies"] = load_plan(sys.argv[i + 1])
+            except (OSError, ValueError, KeyError) as e:
+                print(f"无法读取策略文件: {e}")
+                sys.exit(1)
+            i += 2
+        elif arg == "--dry-run":
+            dry_run = True
+            i += 1
+        elif arg == "--minify":
+            options["minify"] = True
+            i += 1
+        elif arg == "--precompress":
+            options["precompress"] = True
+            i += 1
+        elif arg.startswith("--"):
+            print(f"未知选项: {arg}")
+            sys.exit(1)
+        else:
+            args.append(arg)
+            i += 1
+    
+    if dry_run and len(args) == 1:
+        # 只估算成本，不需要输出文件
+        args.append(None)
+    
+    if len(args) != 2:
+        print("用法: python md2html_with_images.py <input.md> <output.html> [选项]")
         print("功能:")
         print("  - 支持数学公式转换为高清图片")
         print("  - 支持本地图片base64编码")
         print("  - 生成完整的HTML文档")
+        print("选项:")
+        print(f"  --formula-timeout SEC  单个公式的渲染时限 (默认: {DEFAULT_FORMULA_TIMEOUT}，0 表示不限时且不使用子进程)")
+        print("  --math-budget SEC      整个文档渲染公式的总时间上限")
+        print("  --math-backend NAME    公式渲染后端: auto, tex, matplotlib (默认: auto，按探测结果选择最快的可用后端)")
+        print("  --markdown-backend NAME  Markdown 解析后端: markdown, markdown-it, mistune, auto (默认: markdown)")
+        print(f"  --math-dpr DPR         公式图片的目标设备像素比: 1, 2, 3 (默认: {DEFAULT_MATH_DPR})")
+        print(f"  --math-font-size PX    公式的显示字号 (默认: {DEFAULT_MATH_FONT_SIZE})")
+        print("  --workspace DIR        公式图片的工作目录，图片保存在 DIR/images/ 下 (默认: 当前目录)")
+        print("  --output-dir DIR       输出文件不含目录时放到该目录下 (默认: output)")
+        print("  --image-max-width W    缩小宽度超过 W * 像素比 的本地图片并重新编码，附带宽高属性")
+        print(f"  --image-dpr DPR        缩小图片时的设备像素比 (默认: {DEFAULT_IMAGE_DPR})")
+        print(f"  --image-format FMT     缩小后图片的格式: webp, jpeg, png (默认: {DEFAULT_IMAGE_FORMAT})")
+        print("  --math-output MODE     公式的输出方式: image（默认，渲染为图片）, mathml（转换为 MathML，无法转换的公式仍为图片）")
+        print("  --math-sprite          把行内公式图片拼成一张或几张拼图，减少图片数量和解码次数")
+        print("  --math-plan FILE       按 preflight.py --plan 写出的策略文件为每个公式选择 png、svg、unicode 或 mathml")
+        print("  --dry-run              不渲染，只扫描文档并估算耗时和输出体积（见 preflight.py）")
+        print("  --minify               压缩 HTML，<pre>、<code> 和公式的内容保持原样")
+        print("  --precompress          在 HTML 旁边写出 .gz（安装了 brotli 时还有 .br）文件")
+        print("  --verbose              输出每个公式的处理详情")
         sys.exit(1)
     
-    input_file = sys.argv[1]
-    output_file = sys.argv[2]
+    configure_logging(verbose)
+    
+    input_file, output_file = args
     
     if not os.path.exists(input_file):
         print(f"输入文件不存在: {input_file}")
         sys.exit(1)
     
-    if md_to_html_with_math_images(input_file, output_file):
+    if dry_run:
+        from preflight import format_report, preflight
+        
+        print(format_report(preflight([input_file], options)))
+        return
+    
+    if md_to_html_with_math_images(input_file, output_file, options):
         print("转换成功!")
     else:
         print("转换失败!")
-        sys.exit(1) 
\ No newline at end of file
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -9,9 +9,16 @@ import sys
 import os
 import tempfile
 import asyncio
+import logging
+import time
+import functools
 from pathlib import Path
 from md2html import md_to_html
-from html2image import HTML2Image
+from html2image import HTML2Image, parse_size, parse_variant
+from file_utils import configure_logging
+
+
+logger = logging.getLogger(__name__)
 
 
 class MD2Image:
@@ -19,6 +26,8 @@ class MD2Image:
     
     def __init__(self):
         self.html2image = HTML2Image()
+        # 公式的处理方式，见 md2html.md_to_html 的 math 参数；mathml 截图时不需要等待 MathJax
+        self.math = 'mathjax'
     
     async def convert_file(self, md_path, output_path, options=None):
         """
@@ -41,8 +50,8 @@ class MD2Image:
             temp_html_path = tmp_file.name
         
         try:
-            # 第一步：Markdown 转 HTML
-            md_to_html(md_path, temp_html_path)
+            # 第一步：Markdown 转 HTML，在线程池中执行，不阻塞事件循环
+            await self._md_to_html(md_path, temp_html_path)
             
             # 第二步：HTML 转图片
             await self.html2image.convert_file(temp_html_path, output_path, options)
@@ -52,6 +61,158 @@ class MD2Image:
             if os.path.exists(temp_html_path):
                 os.unlink(temp_html_path)
     
+    async def convert_files(self, jobs, options=None, queue_size=2, executor=None, callback=None):
+        """
+        批量将 Markdown 文件转换为图片，Markdown 转换与截图流水线并行
+        
+        第 N 个文档截图时，后续文档的 HTML 已经在执行器中生成，两个阶段之间用有界队列连接，
+        最多提前准备 queue_size 个文档；所有截图共用一个浏览器
+        
+        Args:
+            jobs: (Markdown 文件路径, 输出图片路径) 列表
+            options: 转换选项
+            queue_size: 提前准备好的 HTML 文档数量上限
+            executor: 执行 Markdown 转换的执行器，默认使用事件循环的线程池
+            callback: 可选，每个文档完成（成功或失败）时立即调用 callback(index, result)，
+                      result 与返回值中的元素相同
+        
+        Returns:
+            与 jobs 一一对应的结果列表，成功为输出路径，失败为异常对象
+        """
+        if options is None:
+            options = {}
+        
+        queue = asyncio.Queue(maxsize=queue_size)
+        results = [None] * len(jobs)
+        
+        def finish(index, result):
+            results[index] = result
+            if callback is not None:
+                callback(index, result)
+        
+        async def prepare():
+            """生产者：依次生成 HTML 放入队列"""
+            for index, (md_path, _) in enumerate(jobs):
+                with tempfile.NamedTemporaryFile(mode='w', suffix='.html', delete=False, encoding='utf-8') as tmp_file:
+                    temp_html_path = tmp_file.name
+                try:
+                    if not os.path.exists(md_path):
+                        raise FileNotFoundError(f"Markdown 文件不存在: {md_path}")
+                    await self._md_to_html(md_path, temp_html_path, executor)
+                except Exception as e:
+                    os.unlink(temp_html_path)
+                    finish(index, e)
+                    continue
+                await queue.put((index, temp_html_path))
+            await queue.put(None)
+        
+        async def capture():
+            """消费者：依次截图"""
+            while True:
+                item = await queue.get()
+                if item is None:
+                    break
+                index, temp_html_path = item
+                output_path = jobs[index][1]
+                try:
+                    await self.html2image.convert_file(temp_html_path, output_path, options)
+                except Exception as e:
+                    finish(index, e)
+                else:
+                    finish(index, output_path)
+                finally:
+                    os.unlink(temp_html_path)
+        
+        async with self.html2image:
+            producer = asyncio.create_task(prepare())
+            try:
+                await capture()
+            finally:
+                if not producer.done():
+                    producer.cancel()
+                    await asyncio.gather(producer, return_exceptions=True)
+                # 清理已生成但未截图的 HTML
+                while not queue.empty():
+                    item = queue.get_nowait()
+                    if item is not None:
+                        os.unlink(item[1])
+        
+        for (md_path, _), result in zip(jobs, results):
+            if isinstance(result, Exception):
+                logger.warning("转换失败: %s: %s", md_path, result)
+        return results
+    
+    async def _md_to_html(self, md_path, html_path, executor=None):
+        """在执行器中把 Markdown 文件转换为 HTML 文件"""
+        start = time.perf_counter()
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(executor, functools.partial(md_to_html, math=self.math), md_path, html_path)
+        logger.debug("Markdown 转 HTML 完成: %s (%.2fs)", md_path, time.perf_counter() - start)
+    
+    async def convert_file_variants(self, md_path, variants, options=None):
+        """
+        将 Markdown 文件转换为多个规格的图片，只转换和加载一次
+        
+        Args:
+            md_path: Markdown 文件路径
+            variants: 输出规格列表，见 HTML2Image.convert_file_variants
+            options: 转换选项
+        
+        Returns:
+            输出图片路径列表
+        """
+        if options is None:
+            options = {}
+        
+        # 验证输入文件
+        if not os.path.exists(md_path):
+            raise FileNotFoundError(f"Markdown 文件不存在: {md_path}")
+        
+        # 创建临时 HTML 文件
+        with tempfile.NamedTemporaryFile(mode='w', suffix='.html', delete=False, encoding='utf-8') as tmp_file:
+            temp_html_path = tmp_file.name
+        
+        try:
+            await self._md_to_html(md_path, temp_html_path)
+            return await self.html2image.convert_file_variants(temp_html_path, variants, options)
+            
+        finally:
+            # 清理临时文件
+            if os.path.exists(temp_html_path):
+                os.unlink(temp_html_path)
+    
+    async def convert_file_sections(self, md_path, output_dir, options=None):
+        """
+        将 Markdown 文件按章节转换为多张图片，只转换和加载一次
+        
+        Args:
+            md_path: Markdown 文件路径
+            output_dir: 输出目录
+            options: 转换选项，见 HTML2Image.convert_file_sections
+        
+        Returns:
+            章节清单列表，每项包含 index、title、path
+        """
+        if options is None:
+            options = {}
+        
+        # 验证输入文件
+        if not os.path.exists(md_path):
+            raise FileNotFoundError(f"Markdown 文件不存在: {md_path}")
+        
+        # 创建临时 HTML 文件
+        with tempfile.NamedTemporaryFile(mode='w', suffix='.html', delete=False, encoding='utf-8') as tmp_file:
+            temp_html_path = tmp_file.name
+        
+        try:
+            await self._md_to_html(md_path, temp_html_path)
+            return await self.html2image.convert_file_sections(temp_html_path, output_dir, options)
+            
+        finally:
+            # 清理临时文件
+            if os.path.exists(temp_html_path):
+                os.unlink(temp_html_path)
+    
     async def convert_md_string(self, md_content, output_path, options=None):
         """
         将 Markdown 字符串转换为图片
@@ -88,13 +249,30 @@ def main():
         print("  --height HEIGHT   设置页面高度 (默认: 800)")
         print("  --quality QUALITY 设置JPEG质量 (1-100, 默认: 90)")
         print("  --no-full-page    不截取整个页面，只截取可见区域")
+        print("  --tile-height H   按高度 H 分块截图后拼接，适合超长页面")
+        print("  --split-tiles     分块结果输出为单独的编号图片，不拼接")
+        print("  --scale SCALE     设置设备像素比 (默认: 1)")
+        print("  --max-bytes SIZE  JPEG/WEBP 的字节预算，如 200K，在 --quality 以内搜索满足预算的最高质量")
+        print("  --allow-scale     最低质量仍超出字节预算时缩小图片")
+        print("  --no-cache        不使用截图缓存，总是重新截图")
+        print("  --resource-policy P  未缓存的外部资源: fetch 联网并缓存, allow 联网, stub 返回空内容, block 拒绝 (默认: fetch)")
+        print("  --no-resource-cache  不使用外部资源缓存")
+        print("  --variant SPEC    额外输出规格，可重复，与主输出共用一次转换和页面加载")
+        print("                    格式: 路径[:width=W,quality=Q,scale=S,thumb=WxH,max_bytes=SIZE]")
+        print("  --sections LEVEL  按 h1~hLEVEL 标题把每个章节截为单独图片，输出参数作为目录")
+        print("  --section-selector SEL  按 CSS 选择器切分章节，输出参数作为目录")
+        print("  --no-daemon       不连接后台浏览器（html2image.py daemon start），总是启动新的浏览器")
+        print("  --math MODE       公式: mathjax（默认）, mathml（转换为 MathML，截图不依赖脚本和网络）")
+        print("  --verbose         输出详细的处理日志")
         print()
-        print("支持的图片格式: png, jpg, jpeg")
+        print("支持的图片格式: png, jpg, jpeg, webp")
         print()
         print("示例:")
         print("  python md2image.py document.md output.png")
         print("  python md2image.py document.md output.jpg --width 800 --quality 95")
         print("  python md2image.py document.md output.webp --width 1600 --height 1200")
+        print("  python md2image.py document.md output.png --variant output.jpg:width=800 --variant thumb.webp:thumb=400x300")
+        print("  python md2image.py document.md sections/ --sections 2")
         sys.exit(1)
     
     md_path = sys.argv[1]
@@ -107,6 +285,11 @@ def main():
         "quality": 90
     }
     
+    variants = []
+    sections = False
+    verbose = False
+    use_daemon = True
+    math = "mathjax"
     i = 3
     while i < len(sys.argv):
         arg = sys.argv[i]
@@ -122,16 +305,75 @@ def main():
         elif arg == "--no-full-page":
             options["full_page"] = False
             i += 1
+        elif arg == "--tile-height" and i + 1 < len(sys.argv):
+            options["tile_height"] = int(sys.argv[i + 1])
+            i += 2
+        elif arg == "--split-tiles":
+            options["tile_output"] = "split"
+            i += 1
+        elif arg == "--no-cache":
+            options["cache"] = False
+            i += 1
+        elif arg == "--resource-policy" and i + 1 < len(sys.argv):
+            options["resource_policy"] = sys.argv[i + 1]
+            i += 2
+        elif arg == "--no-resource-cache":
+            options["resource_cache"] = False
+            i += 1
+        elif arg == "--scale" and i + 1 < len(sys.argv):
+            options["device_scale_factor"] = float(sys.argv[i + 1])
+            i += 2
+        elif arg == "--max-bytes" and i + 1 < len(sys.argv):
+            options["max_bytes"] = parse_size(sys.argv[i + 1])
+            i += 2
+        elif arg == "--allow-scale":
+            options["allow_scale"] = True
+            i += 1
+        elif arg == "--variant" and i + 1 < len(sys.argv):
+            variants.append(parse_variant(sys.argv[i + 1]))
+            i += 2
+        elif arg == "--sections" and i + 1 < len(sys.argv):
+            options["section_level"] = int(sys.argv[i + 1])
+            sections = True
+            i += 2
+        elif arg == "--section-selector" and i + 1 < len(sys.argv):
+            options["section_selector"] = sys.argv[i + 1]
+            sections = True
+            i += 2
+        elif arg == "--no-daemon":
+            use_daemon = False
+            i += 1
+        elif arg == "--math" and i + 1 < len(sys.argv):
+            math = sys.argv[i + 1]
+            i += 2
+        elif arg == "--verbose":
+            verbose = True
+            i += 1
         else:
             print(f"未知选项: {arg}")
             sys.exit(1)
     
+    configure_logging(verbose)
+    
     # 创建转换器并执行转换
     converter = MD2Image()
+    converter.html2image.use_daemon = use_daemon
+    converter.math = math
     
     try:
-        asyncio.run(converter.convert_file(md_path, output_path, options))
-        print(f"转换完成: {output_path}")
+        if sections:
+            manifest = asyncio.run(converter.convert_file_sections(md_path, output_path, options))
+            for item in manifest:
+                print(f"  {item['path']}: {item['title']}")
+            print(f"转换完成: {len(manifest)} 个章节 -> {output_path}")
+        elif variants:
+            # 主输出与单独输出时一样遵守 --max-bytes
+            variants.insert(0, {"path": output_path, "max_bytes": options.get("max_bytes")})
+            outputs = asyncio.run(converter.convert_file_variants(md_path, variants, options))
+            print(f"转换完成: {', '.join(outputs)}")
+        else:
+            asyncio.run(converter.convert_file(md_path, output_path, options))
+            print(f"转换完成: {output_path}")
     except Exception as e:
         print(f"转换失败: {e}")
         sys.exit(1)
@@ -0,0 +1,590 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+转换前的成本预估
+一次扫描文档、不渲染任何内容：按复杂度统计公式，统计代码块、表格和本地图片的字节数，
+再按本机实测的单项耗时和体积估算渲染时间与输出大小。给出时间或体积预算时，
+为每个公式选择输出方式（unicode、mathml、svg、png 或复用已缓存的图片），
+策略文件可以交给 md2html_with_images.py --math-plan 使用
+
+用法: python preflight.py 文档.md... [--time-budget SEC] [--size-budget SIZE] [--plan FILE] [--json]
+                          [--workspace DIR] [--math-backend NAME] [--math-output MODE] [--math-dpr DPR]
+                          [--math-font-size PX] [--recalibrate]
+"""
+
+import os
+import re
+import sys
+import json
+import time
+import hashlib
+import tempfile
+from collections import Counter
+
+from md2html_with_images import (
+    DEFAULT_MATH_DPR, DEFAULT_MATH_FONT_SIZE, FENCED_CODE_PATTERN, IMAGE_LINK_PATTERN, MATH_RENDER_POINTS,
+    MATH_STRATEGIES, PAGE_CSS, PROBE_TIMEOUT, IsolatedWorker, convert_simple_inline_math, find_formulas, formula_alt,
+    formula_image_path, is_simple_inline_math, latex_to_image, math_render_dpi, math_tools_key,
+    select_math_backends
+)
+from file_utils import get_cache_dir
+from analyze_html import format_size
+
+
+# 公式的复杂度分类
+FORMULA_CLASSES = ("simple", "inline", "block", "environment")
+FORMULA_CLASS_LABELS = {
+    "simple": "简单",
+    "inline": "行内",
+    "block": "块级",
+    "environment": "环境",
+}
+# 实测各类公式耗时和体积用的样例
+CALIBRATION_SAMPLES = {
+    "simple": ("inline", "x^2"),
+    "inline": ("inline", r"x_{i+1} = \frac{a}{b} + \sqrt{x}"),
+    "block": ("block", r"\sum_{i=1}^{n} i^2 = \frac{n(n+1)(2n+1)}{6}"),
+    "environment": ("block", r"\begin{pmatrix} a & b \\ c & d \end{pmatrix}"),
+}
+# 实测代码高亮耗时用的样例
+CODE_SAMPLE = "\n".join(
+    f"def step_{index}(values, factor={index}):\n"
+    f"    \"\"\"scale values\"\"\"\n"
+    f"    return [value * factor for value in values if value % {index + 2}]  # {index}"
+    for index in range(10)
+)
+CALIBRATION_VERSION = 2
+# 公式图片的字节数按 (visual_length + LENGTH_OFFSET) 与样例的比值换算，短公式也有边距和文件头
+LENGTH_OFFSET = 3
+
+# 表格的分隔行，如 | --- | :---: |
+TABLE_DELIMITER_PATTERN = re.compile(r"^(?=[^\n]*\|)(?=[^\n]*-)[ \t|:-]+$", re.MULTILINE)
+REMOTE_URL_PATTERN = re.compile(r"^[a-zA-Z][a-zA-Z0-9+.-]*://")
+# 公式 <img> 标签除 data URI 和 alt 以外的字节数，以及渲染失败时的错误标签
+IMAGE_TAG_OVERHEAD = 160
+ERROR_TAG_OVERHEAD = 50
+# 页面模板中除 CSS 以外的部分
+PAGE_OVERHEAD = 1024
+
+
+def classify_formula(kind, latex_code):
+    """公式的复杂度：simple（可以替换为文本）、inline、block 或 environment（\\begin 环境）"""
+    if kind == "inline" and is_simple_inline_math(latex_code):
+        return "simple"
+    if "\\begin{" in latex_code:
+        return "environment"
+    return kind
+
+
+def visual_length(latex_code):
+    """公式大致显示的字符数：命令（\\alpha、\\frac）算一个字符，花括号、上下标符号和空白不算"""
+    return len(re.sub(r"[{}^_\s]", "", re.sub(r"\\[a-zA-Z]+", "x", latex_code)))
+
+
+def data_uri_bytes(size):
+    """size 字节的数据编码为 base64 后的字节数"""
+    return (size + 2) // 3 * 4
+
+
+def scan_document(path):
+    """
+    扫描一个文档，不渲染任何内容
+    
+    Returns:
+        {'file', 'markdown_bytes', 'formulas': [(kind, latex_code)], 'classes': Counter,
+         'code_blocks', 'code_lines', 'tables', 'images', 'image_bytes'（每次引用都计入，与嵌入后一致）}
+    """
+    with open(path, "r", encoding="utf-8") as f:
+        content = f.read()
+    base_dir = os.path.dirname(os.path.abspath(path))
+    
+    code_blocks = FENCED_CODE_PATTERN.findall(content)
+    text = FENCED_CODE_PATTERN.sub("", content)
+    formulas = find_formulas(content)
+    
+    images = 0
+    image_bytes = 0
+    for match in IMAGE_LINK_PATTERN.finditer(text):
+        img_path = match.group(2)
+        if REMOTE_URL_PATTERN.match(img_path):
+            continue
+        try:
+            image_bytes += os.path.getsize(os.path.join(base_dir, img_path))
+        except OSError:
+            continue
+        images += 1
+    
+    return {
+        "file": path,
+        "markdown_bytes": len(content.encode("utf-8")),
+        "formulas": formulas,
+        "classes": Counter(classify_formula(kind, latex_code) for kind, latex_code in formulas),
+        "code_blocks": len(code_blocks),
+        # 去掉开始和结束的 ``` 行
+        "code_lines": sum(max(block.count("\n") - 1, 0) for block in code_blocks),
+        "tables": len(TABLE_DELIMITER_PATTERN.findall(text)),
+        "images": images,
+        "image_bytes": image_bytes,
+    }
+
+
+def _measure_formula(latex_code, is_inline, dpi, backends, image_format, tmp_dir):
+    """渲染两次取第二次的耗时（秒）；返回 {'seconds', 'bytes'}，渲染失败时 bytes 为 None"""
+    result = None
+    for attempt in range(2):
+        output_path = os.path.join(tmp_dir, f"sample_{attempt}.{image_format}")
+        start = time.perf_counter()
+        ok = latex_to_image(latex_code, output_path, fontsize=MATH_RENDER_POINTS, dpi=dpi, is_inline=is_inline,
+                            backends=backends, image_format=image_format)
+        seconds = time.perf_counter() - start
+        result = {"seconds": seconds, "bytes": os.path.getsize(output_path) if ok else None}
+        if os.path.exists(output_path):
+            os.unlink(output_path)
+    return result
+
+
+def _measure_worker_start(dpi, backends, tmp_dir):
+    """
+    每个文档的公式在一个新的渲染子进程中渲染：子进程中第一个公式比之后的多出的耗时（秒）
+    """
+    latex_code = CALIBRATION_SAMPLES["simple"][1]
+    output_path = os.path.join(tmp_dir, "worker.png")
+    worker = IsolatedWorker()
+    try:
+        seconds = []
+        for _ in range(2):
+            start = time.perf_counter()
+            latex_to_image(latex_code, output_path, fontsize=MATH_RENDER_POINTS, dpi=dpi, is_inline=True,
+                           timeout=PROBE_TIMEOUT, worker=worker, backends=backends)
+            seconds.append(time.perf_counter() - start)
+    finally:
+        worker.close()
+    return max(seconds[0] - seconds[1], 0.0)
+
+
+def _measure_code():
+    """高亮样例代码两次取第二次，返回每行的耗时（秒）和 HTML 字节数"""
+    from markdown_backends import render_markdown
+    
+    source = f"```python\n{CODE_SAMPLE}\n```\n"
+    lines = CODE_SAMPLE.count("\n") + 1
+    for _ in range(2):
+        start = time.perf_counter()
+        html_content = render_markdown(source, "markdown")
+        seconds = time.perf_counter() - start
+    return {"seconds": seconds / lines, "bytes": len(html_content.encode("utf-8")) / lines}
+
+
+def calibrate(backends, dpi, refresh=False):
+    """
+    实测每类公式用 PNG 和 SVG 渲染的耗时和字节数，以及每行代码的高亮耗时
+    
+    结果按渲染工具的版本、后端和 DPI 缓存到磁盘，refresh=True 时重新测量
+    
+    Returns:
+        {'formula': {类别: {'png': {'seconds', 'bytes'}, 'svg': {...}}}, 'code_line': {'seconds', 'bytes'},
+         'worker_start': 启动渲染子进程的耗时}，bytes 为 None 表示该类公式用这种格式渲染会失败
+    """
+    key = hashlib.sha256(
+        f"{CALIBRATION_VERSION}\n{math_tools_key()}\n{','.join(backends)}\n{dpi}".encode("utf-8")
+    ).hexdigest()
+    cache_path = os.path.join(get_cache_dir("probe"), "preflight.json")
+    cached = {}
+    if os.path.exists(cache_path):
+        try:
+            with open(cache_path, "r", encoding="utf-8") as f:
+                cached = json.load(f)
+        except (OSError, ValueError):
+            cached = {}
+    if key in cached and not refresh:
+        return cached[key]
+    
+    costs = {"formula": {}}
+    with tempfile.TemporaryDirectory(prefix="md2html-preflight-") as tmp_dir:
+        for name, (kind, latex_code) in CALIBRATION_SAMPLES.items():
+            costs["formula"][name] = {
+                image_format: _measure_formula(latex_code, kind == "inline", dpi, backends, image_format, tmp_dir)
+                for image_format in ("png", "svg")
+            }
+        costs["worker_start"] = _measure_worker_start(dpi, backends, tmp_dir)
+    costs["code_line"] = _measure_code()
+    
+    cached[key] = costs
+    try:
+        with open(cache_path, "w", encoding="utf-8") as f:
+            json.dump(cached, f, indent=2)
+    except OSError:
+        pass
+    return costs
+
+
+def formula_options(kind, latex_code, costs, images_dir, dpi, backends, mathml=False):
+    """
+    一个公式可选的输出方式
+    
+    mathml: 公式可以转换为 MathML（math_output 为 mathml），能转换时加入 mathml 选项
+    
+    Returns:
+        {方式: (格式, 耗时, 每次出现的字节数, 是否已缓存)}，方式为 png、svg、unicode 或 mathml；
+        格式为写入策略文件的 MATH_STRATEGIES 之一。工作目录中已有图片的格式不计耗时，字节数按实际文件计算；
+        预计渲染失败且没有缓存的格式不作为选项，两种格式都不可用时只保留 png，按错误标签计算字节数
+    """
+    category = classify_formula(kind, latex_code)
+    alt_bytes = len(formula_alt(latex_code).encode("utf-8"))
+    options = {}
+    for image_format in ("png", "svg"):
+        img_path = None
+        if images_dir is not None:
+            img_path = formula_image_path(images_dir, kind, latex_code, dpi, backends, image_format)
+        if img_path is not None and os.path.exists(img_path):
+            # 转换时直接复用这个文件，不需要渲染
+            size = IMAGE_TAG_OVERHEAD + alt_bytes + data_uri_bytes(os.path.getsize(img_path))
+            options[image_format] = (image_format, 0.0, size, True)
+            continue
+        
+        measured = costs["formula"][category][image_format]
+        if measured["bytes"] is not None:
+            sample = CALIBRATION_SAMPLES[category][1]
+            scale = (visual_length(latex_code) + LENGTH_OFFSET) / (visual_length(sample) + LENGTH_OFFSET)
+            size = IMAGE_TAG_OVERHEAD + alt_bytes + data_uri_bytes(round(measured["bytes"] * scale))
+            options[image_format] = (image_format, measured["seconds"], size, False)
+    
+    if "png" not in options and "svg" not in options:
+        size = ERROR_TAG_OVERHEAD + len(latex_code.encode("utf-8"))
+        options["png"] = ("png", costs["formula"][category]["png"]["seconds"], size, False)
+    if category == "simple":
+        text = convert_simple_inline_math(latex_code)
+        options["unicode"] = ("unicode", 0.0, len(f'<span class="math-inline">{text}</span>'.encode("utf-8")), False)
+    if mathml:
+        # 转换在当前进程中进行，每个公式不到 1ms，与 unicode 一样不计耗时
+        from latex_mathml import MathMLError, latex_to_mathml
+        
+        try:
+            text = latex_to_mathml(latex_code, display=kind == "block")
+        except MathMLError:
+            pass
+        else:
+            if kind == "block":
+                text = f'<div class="math-block">{text}</div>'
+            options["mathml"] = ("mathml", 0.0, len(text.encode("utf-8")), False)
+    return options
+
+
+def _default_choice(options):
+    """
+    不考虑预算时的输出方式：与不带策略转换时一样，能转换为 MathML 时用 mathml，
+    否则用 png（只有 svg 可用时用 svg）；已缓存的图片在选项中不计耗时
+    """
+    for name in ("mathml", "png", "svg"):
+        if name in options:
+            return name
+
+
+def plan_strategies(formulas, options, time_budget=None, size_budget=None, base_bytes=0, choices=None):
+    """
+    在预算内为每个公式选择输出方式
+    
+    先按默认方式计算，超出时间预算时依次把最耗时的公式换成不需要渲染的方式（unicode、mathml 或已缓存的图片；
+    png 和 svg 由同一个后端渲染，耗时相近），超出体积预算时依次换成更小的方式；换成后不会让另一项超出预算
+    
+    Args:
+        formulas: {(kind, latex_code): 出现次数}
+        options: {(kind, latex_code): formula_options 的返回值}
+        base_bytes: 公式以外的输出字节数
+        choices: 默认方式 {(kind, latex_code): 方式}
+    
+    Returns:
+        (choices, 耗时, 字节数)。同一工作目录中重复的公式只渲染一次，耗时按不重复的公式计算，
+        每次出现都会嵌入一次图片，字节数按出现次数计算
+    """
+    choices = dict(choices)
+    
+    def totals():
+        seconds = sum(options[key][choices[key]][1] for key in formulas)
+        size = base_bytes + sum(options[key][choices[key]][2] * count for key, count in formulas.items())
+        return seconds, size
+    
+    seconds, size = totals()
+    for metric, budget in ((1, time_budget), (2, size_budget)):
+        if budget is None:
+            continue
+        other, other_budget = (2, size_budget) if metric == 1 else (1, time_budget)
+        
+        def scale(key, index):
+            return 1 if index == 1 else formulas[key]
+        
+        candidates = []
+        for key in formulas:
+            current = options[key][choices[key]]
+            names = [name for name in options[key] if metric == 2 or options[key][name][1] == 0]
+            if not names:
+                continue
+            best = min(names, key=lambda name: options[key][name][metric])
+            saving = (current[metric] - options[key][best][metric]) * scale(key, metric)
+            if saving > 0:
+                candidates.append((saving, key, best))
+        candidates.sort(key=lambda item: -item[0])
+        
+        for saving, key, best in candidates:
+            if (seconds, size)[metric - 1] <= budget:
+                break
+            current = options[key][choices[key]]
+            other_delta = (options[key][best][other] - current[other]) * scale(key, other)
+            if other_budget is not None and other_delta > 0 and (seconds, size)[other - 1] + other_delta > other_budget:
+                continue
+            choices[key] = best
+            seconds, size = totals()
+    return choices, seconds, size
+
+
+def _startup_seconds(documents, choices, options, costs):
+    """启动渲染子进程的总耗时：每个需要渲染新公式（没有缓存图片）的文档启动一次"""
+    rendered = set()
+    count = 0
+    for document in documents:
+        new = {key for key in document["formulas"] if not options[key][choices[key]][3]
+               and choices[key] in ("png", "svg")} - rendered
+        if new:
+            count += 1
+            rendered |= new
+    return count * costs["worker_start"]
+
+
+def preflight(paths, options=None, time_budget=None, size_budget=None, refresh=False):
+    """
+    扫描文档并估算转换成本
+    
+    Args:
+        paths: Markdown 文件列表
+        options: 与 md_to_html_with_math_images 相同的转换选项，使用其中的 math_backend、math_output、
+                 math_dpr、math_font_size 和 workspace（判断哪些公式已缓存）
+        time_budget: 整个转换的时间预算（秒，单进程）
+        size_budget: 全部输出 HTML 的体积预算（字节）
+        refresh: 重新实测单项耗时
+    
+    Returns:
+        报告字典，plan 为 {(kind, latex_code): 方式}
+    """
+    if options is None:
+        options = {}
+    backends = select_math_backends(options.get("math_backend", "auto"))
+    mathml = options.get("math_output", "image") == "mathml"
+    dpi = math_render_dpi(options.get("math_font_size", DEFAULT_MATH_FONT_SIZE),
+                          options.get("math_dpr", DEFAULT_MATH_DPR))
+    workspace = options.get("workspace")
+    images_dir = os.path.join(workspace, "images") if workspace else None
+    
+    start = time.perf_counter()
+    documents = [scan_document(path) for path in paths]
+    scan_seconds = time.perf_counter() - start
+    costs = calibrate(backends, dpi, refresh)
+    
+    formulas = Counter(formula for document in documents for formula in document["formulas"])
+    formula_source_bytes = sum(len(latex_code.encode("utf-8")) * count for (_, latex_code), count in formulas.items())
+    code_lines = sum(document["code_lines"] for document in documents)
+    code_seconds = code_lines * costs["code_line"]["seconds"]
+    # 公式以外的输出：正文按原样计入，代码按实测的高亮结果计入，图片按 base64 计入，每个文档一份页面模板
+    base_bytes = (sum(document["markdown_bytes"] for document in documents) - formula_source_bytes
+                  + round(code_lines * costs["code_line"]["bytes"])
+                  + sum(data_uri_bytes(document["image_bytes"]) for document in documents)
+                  + len(documents) * (len(PAGE_CSS.encode("utf-8")) + PAGE_OVERHEAD))
+    
+    choices = {}
+    per_formula = {}
+    for key in formulas:
+        per_formula[key] = formula_options(key[0], key[1], costs, images_dir, dpi, backends, mathml)
+        choices[key] = _default_choice(per_formula[key])
+    _, default_seconds, default_bytes = plan_strategies(formulas, per_formula, base_bytes=base_bytes, choices=choices)
+    default_seconds += code_seconds + _startup_seconds(documents, choices, per_formula, costs)
+    # 时间预算针对整个转换，代码高亮和启动子进程的耗时不能通过选择公式的输出方式减少
+    formula_budget = None
+    if time_budget is not None:
+        formula_budget = time_budget - code_seconds - _startup_seconds(documents, choices, per_formula, costs)
+    plan, seconds, size = plan_strategies(formulas, per_formula, formula_budget, size_budget, base_bytes, choices)
+    seconds += code_seconds + _startup_seconds(documents, plan, per_formula, costs)
+    
+    failing = 0
+    for key, choice in plan.items():
+        if choice in ("png", "svg") and not per_formula[key][choice][3] and costs["formula"][classify_formula(*key)][choice]["bytes"] is None:
+            failing += 1
+    
+    def strategies(selected):
+        # 复用缓存图片的公式单独计数
+        return Counter("cached" if per_formula[key][choice][3] else choice for key, choice in selected.items())
+    
+    return {
+        "documents": documents,
+        "backends": backends,
+        "dpi": dpi,
+        "costs": costs,
+        "scan_seconds": scan_seconds,
+        "unique_formulas": len(formulas),
+        "code_seconds": code_seconds,
+        "default": {"seconds": default_seconds, "bytes": default_bytes, "strategies": strategies(choices)},
+        "planned": {"seconds": seconds, "bytes": size, "strategies": strategies(plan)},
+        "failing": failing,
+        "time_budget": time_budget,
+        "size_budget": size_budget,
+        "plan": {key: per_formula[key][plan[key]][0] for key in formulas},
+    }
+
+
+def write_plan(report, path):
+    """写出策略文件，md2html_with_images.py --math-plan 读取"""
+    entries = [{"kind": kind, "latex": latex_code, "strategy": strategy}
+               for (kind, latex_code), strategy in report["plan"].items()]
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump({"version": 1, "math_strategies": entries}, f, ensure_ascii=False, indent=2)
+
+
+def load_plan(path):
+    """读取策略文件，返回 extract_and_replace_math 的 math_strategies 选项"""
+    with open(path, "r", encoding="utf-8") as f:
+        data = json.load(f)
+    strategies = {}
+    for entry in data.get("math_strategies", []):
+        if entry["strategy"] not in MATH_STRATEGIES:
+            raise ValueError(f"未知的公式输出方式: {entry['strategy']}，可选: {', '.join(MATH_STRATEGIES)}")
+        strategies[(entry["kind"], entry["latex"])] = entry["strategy"]
+    return strategies
+
+
+def _format_seconds(seconds):
+    return f"{seconds * 1000:.0f}ms" if seconds < 1 else f"{seconds:.1f}s"
+
+
+def _format_strategies(counter):
+    return "，".join(f"{name} {counter[name]}" for name in ("cached", "png", "svg", "unicode", "mathml")
+                     if counter[name])
+
+
+def format_report(report):
+    """文本报告"""
+    lines = []
+    for document in report["documents"]:
+        classes = document["classes"]
+        detail = "，".join(f"{FORMULA_CLASS_LABELS[name]} {classes[name]}" for name in FORMULA_CLASSES if classes[name])
+        lines.append(f"{document['file']}: 公式 {len(document['formulas'])}" + (f"（{detail}）" if detail else "")
+                     + f"，代码块 {document['code_blocks']}（{document['code_lines']} 行），表格 {document['tables']}，"
+                     f"图片 {document['images']}（{format_size(document['image_bytes'])}）")
+    
+    lines.append(f"扫描 {len(report['documents'])} 个文档耗时 {_format_seconds(report['scan_seconds'])}，"
+                 f"渲染后端 {', '.join(report['backends'])}，DPI {report['dpi']}")
+    unit_costs = []
+    for name in FORMULA_CLASSES:
+        png = report["costs"]["formula"][name]["png"]
+        unit_costs.append(f"{FORMULA_CLASS_LABELS[name]} "
+                          + (_format_seconds(png["seconds"]) if png["bytes"] is not None else "无法渲染"))
+    lines.append(f"每个公式的渲染耗时: {'，'.join(unit_costs)}")
+    
+    default = report["default"]
+    lines.append(f"不重复的公式 {report['unique_formulas']} 个（{_format_strategies(default['strategies']) or '无'}），"
+                 f"代码高亮约 {_format_seconds(report['code_seconds'])}")
+    lines.append(f"预计耗时 {_format_seconds(default['seconds'])}（单进程），预计输出 {format_size(default['bytes'])}")
+    if report["failing"]:
+        lines.append(f"其中 {report['failing']} 个公式当前后端预计无法渲染")
+    
+    if report["time_budget"] is not None or report["size_budget"] is not None:
+        planned = report["planned"]
+        lines.append(f"按预算选择: {_format_strategies(planned['strategies']) or '无'}")
+        lines.append(f"预计耗时 {_format_seconds(planned['seconds'])}，预计输出 {format_size(planned['bytes'])}")
+        for label, budget, value, text in (
+                ("时间", report["time_budget"], planned["seconds"], _format_seconds),
+                ("体积", report["size_budget"], planned["bytes"], format_size)):
+            if budget is not None:
+                state = "满足" if value <= budget else "超出"
+                lines.append(f"{label}预算 {text(budget)}: {state}")
+    return "\n".join(lines)
+
+
+def within_budget(report):
+    planned = report["planned"]
+    return ((report["time_budget"] is None or planned["seconds"] <= report["time_budget"])
+            and (report["size_budget"] is None or planned["bytes"] <= report["size_budget"]))
+
+
+def main():
+    """命令行主函数"""
+    from html2image import parse_size
+    
+    paths = []
+    options = {}
+    time_budget = None
+    size_budget = None
+    plan_path = None
+    as_json = False
+    refresh = False
+    i = 1
+    while i < len(sys.argv):
+        arg = sys.argv[i]
+        if arg == "--time-budget" and i + 1 < len(sys.argv):
+            time_budget = float(sys.argv[i + 1])
+            i += 2
+        elif arg == "--size-budget" and i + 1 < len(sys.argv):
+            size_budget = parse_size(sys.argv[i + 1])
+            i += 2
+        elif arg == "--plan" and i + 1 < len(sys.argv):
+            plan_path = sys.argv[i + 1]
+            i += 2
+        elif arg == "--workspace" and i + 1 < len(sys.argv):
+            options["workspace"] = sys.argv[i + 1]
+            i += 2
+        elif arg == "--math-backend" and i + 1 < len(sys.argv):
+            options["math_backend"] = sys.argv[i + 1]
+            i += 2
+        elif arg == "--math-output" and i + 1 < len(sys.argv):
+            options["math_output"] = sys.argv[i + 1]
+            i += 2
+        elif arg == "--math-dpr" and i + 1 < len(sys.argv):
+            options["math_dpr"] = float(sys.argv[i + 1])
+            i += 2
+        elif arg == "--math-font-size" and i + 1 < len(sys.argv):
+            options["math_font_size"] = float(sys.argv[i + 1])
+            i += 2
+        elif arg == "--json":
+            as_json = True
+            i += 1
+        elif arg == "--recalibrate":
+            refresh = True
+            i += 1
+        elif arg.startswith("--"):
+            print(f"未知选项: {arg}")
+            sys.exit(1)
+        else:
+            paths.append(arg)
+            i += 1
+    
+    if not paths:
+        print("用法: python preflight.py 文档.md... [选项]")
+        print("  不渲染任何内容，估算转换耗时和输出体积，并可按预算为每个公式选择输出方式")
+        print("选项:")
+        print("  --time-budget SEC      转换的时间预算（秒，单进程）")
+        print("  --size-budget SIZE     全部输出 HTML 的体积预算，如 5M")
+        print("  --plan FILE            写出策略文件，转换时用 md2html_with_images.py --math-plan FILE")
+        print("  --workspace DIR        公式图片的工作目录，已缓存的公式不计渲染耗时 (默认: 当前目录)")
+        print("  --math-backend NAME    公式渲染后端: auto, tex, matplotlib (默认: auto)")
+        print("  --math-output MODE     公式的默认输出方式: image（默认）, mathml（能转换的公式不计渲染耗时）")
+        print(f"  --math-dpr DPR         公式图片的目标设备像素比 (默认: {DEFAULT_MATH_DPR})")
+        print(f"  --math-font-size PX    公式的显示字号 (默认: {DEFAULT_MATH_FONT_SIZE})")
+        print("  --recalibrate          重新实测每类公式和代码的耗时")
+        print("  --json                 输出 JSON")
+        sys.exit(1)
+    
+    options.setdefault("workspace", ".")
+    report = preflight(paths, options, time_budget, size_budget, refresh)
+    if plan_path:
+        write_plan(report, plan_path)
+    
+    if as_json:
+        output = dict(report, plan=[{"kind": kind, "latex": latex_code, "strategy": strategy}
+                                    for (kind, latex_code), strategy in report["plan"].items()])
+        output["documents"] = [dict(document, formulas=len(document["formulas"])) for document in report["documents"]]
+        print(json.dumps(output, ensure_ascii=False, indent=2))
+    else:
+        print(format_report(report))
+    if not within_budget(report):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,270 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+外部资源缓存
+截图时拦截页面的网络请求，已缓存的外部资源（MathJax 脚本、远程图片、字体等）直接从磁盘返回，
+未缓存的按策略联网获取、返回空内容或拒绝，截图不再依赖网络
+"""
+
+import os
+import re
+import sys
+import json
+import time
+import hashlib
+import logging
+import tempfile
+from urllib.parse import urldefrag, urljoin
+from file_utils import get_cache_dir
+from screenshot_cache import RESOURCE_PATTERN
+
+
+logger = logging.getLogger(__name__)
+
+# 未缓存外部资源的处理策略：
+#   fetch: 联网获取并写入缓存（默认）
+#   allow: 联网获取，不写入缓存
+#   stub:  返回空内容，不联网
+#   block: 拒绝请求，不联网
+RESOURCE_POLICIES = ("fetch", "allow", "stub", "block")
+DEFAULT_RESOURCE_POLICY = "fetch"
+# 耗时超过该值（毫秒）的请求在日志中列出
+DEFAULT_SLOW_REQUEST_MS = 500
+# 预先下载资源的超时（秒）
+SEED_TIMEOUT = 30
+# 缓存的响应头，其余响应头与截图无关
+CACHED_HEADERS = ("content-type", "access-control-allow-origin")
+
+# 1x1 透明 PNG，用于替代未缓存的图片
+TRANSPARENT_PNG = bytes.fromhex(
+    "89504e470d0a1a0a0000000d4948445200000001000000010806000000"
+    "1f15c4890000000d49444154789c6360000000000500010d0a2db40000000049454e44ae426082"
+)
+# 按资源类型返回的空内容：(Content-Type, 内容)
+STUB_RESPONSES = {
+    "script": ("application/javascript", b""),
+    "stylesheet": ("text/css", b""),
+    "image": ("image/png", TRANSPARENT_PNG),
+}
+
+# CSS 中 @import 和 url() 引用的资源
+CSS_URL_PATTERN = re.compile(r'''url\(\s*["']?([^"')]+)["']?\s*\)|@import\s+["']([^"']+)["']''')
+
+
+def is_remote_url(url):
+    """是否为需要联网的 http(s) 地址"""
+    return url.startswith(("http://", "https://"))
+
+
+def find_remote_resources(html_content):
+    """返回 HTML 直接引用的外部资源地址（去重并排序），// 开头的地址按 https 处理"""
+    urls = set()
+    for match in RESOURCE_PATTERN.finditer(html_content):
+        ref = match.group(1) or match.group(2)
+        if ref.startswith("//"):
+            ref = "https:" + ref
+        if is_remote_url(ref):
+            urls.add(urldefrag(ref)[0])
+    return sorted(urls)
+
+
+class ResourceCache:
+    """按 URL 保存外部资源的响应内容和必要的响应头"""
+    
+    def __init__(self, cache_dir=None):
+        self.cache_dir = cache_dir or get_cache_dir("resources")
+        os.makedirs(self.cache_dir, exist_ok=True)
+    
+    def _entry_path(self, url):
+        key = hashlib.sha256(urldefrag(url)[0].encode("utf-8")).hexdigest()
+        return os.path.join(self.cache_dir, key[:2], key)
+    
+    def get(self, url):
+        """
+        返回缓存的响应 (状态码, 响应头字典, 内容)，未缓存时返回 None
+        """
+        entry = self._entry_path(url)
+        try:
+            with open(entry + ".json", "r", encoding="utf-8") as f:
+                meta = json.load(f)
+            with open(entry, "rb") as f:
+                body = f.read()
+        except (FileNotFoundError, ValueError):
+            return None
+        return meta["status"], meta["headers"], body
+    
+    def put(self, url, status, headers, body):
+        """保存响应，先写内容再写元数据，读取方只会看到完整的条目"""
+        entry = self._entry_path(url)
+        os.makedirs(os.path.dirname(entry), exist_ok=True)
+        headers = {k.lower(): v for k, v in headers.items() if k.lower() in CACHED_HEADERS}
+        meta = {"url": urldefrag(url)[0], "status": status, "headers": headers}
+        for path, data in ((entry, body), (entry + ".json", json.dumps(meta).encode("utf-8"))):
+            fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(entry), suffix=".tmp")
+            try:
+                with os.fdopen(fd, "wb") as f:
+                    f.write(data)
+                os.replace(tmp_path, path)
+            finally:
+                if os.path.exists(tmp_path):
+                    os.unlink(tmp_path)
+    
+    def seed(self, url):
+        """
+        下载一个资源写入缓存；CSS 中引用的字体、图片等也一并下载
+        
+        Returns:
+            写入缓存的资源数量
+        """
+        import urllib.request
+        
+        url = urldefrag(url)[0]
+        if self.get(url) is not None:
+            return 0
+        request = urllib.request.Request(url, headers={"User-Agent": "md2html-resource-cache"})
+        with urllib.request.urlopen(request, timeout=SEED_TIMEOUT) as response:
+            body = response.read()
+            headers = dict(response.headers.items())
+            self.put(url, response.status, headers, body)
+        logger.info("已缓存: %s (%d 字节)", url, len(body))
+        count = 1
+        
+        if "css" in headers.get("Content-Type", headers.get("content-type", "")):
+            for match in CSS_URL_PATTERN.finditer(body.decode("utf-8", errors="replace")):
+                ref = urljoin(url, match.group(1) or match.group(2))
+                if is_remote_url(ref):
+                    count += self.seed(ref)
+        return count
+
+
+class RequestRouter:
+    """
+    页面级的请求拦截器
+    
+    外部资源优先从 ResourceCache 返回，未缓存时按策略处理；同时记录每个请求的耗时，
+    用于找出拖慢页面加载的请求
+    """
+    
+    def __init__(self, cache, policy=DEFAULT_RESOURCE_POLICY):
+        if policy not in RESOURCE_POLICIES:
+            raise ValueError(f"未知的资源策略: {policy}. 支持的策略: {', '.join(RESOURCE_POLICIES)}")
+        self.cache = cache
+        self.policy = policy
+        # 请求 -> 开始时间
+        self._started = {}
+        # (耗时毫秒, 来源, URL)
+        self.timings = []
+        # 请求 -> 来源（cache、network、stub、block、failed、local）
+        self._sources = {}
+    
+    async def install(self, page):
+        """在页面上注册拦截和计时，必须在加载页面之前调用"""
+        page.on("request", self._on_request)
+        page.on("requestfinished", self._on_done)
+        page.on("requestfailed", self._on_done)
+        await page.route("**/*", self._handle)
+    
+    def _on_request(self, request):
+        self._started[request] = time.perf_counter()
+    
+    def _on_done(self, request):
+        start = self._started.pop(request, None)
+        if start is not None:
+            elapsed = (time.perf_counter() - start) * 1000
+            self.timings.append((elapsed, self._sources.pop(request, "local"), request.url))
+    
+    async def _handle(self, route, request):
+        url = request.url
+        if not is_remote_url(url):
+            # file:、data: 等本地资源不拦截
+            await route.continue_()
+            return
+        
+        cached = self.cache.get(url) if self.cache is not None else None
+        if cached is not None:
+            status, headers, body = cached
+            self._sources[request] = "cache"
+            await route.fulfill(status=status, headers=headers, body=body)
+            return
+        
+        if self.policy == "block":
+            self._sources[request] = "block"
+            logger.debug("拒绝未缓存的请求: %s", url)
+            await route.abort("blockedbyclient")
+        elif self.policy == "stub":
+            self._sources[request] = "stub"
+            logger.debug("未缓存的请求返回空内容: %s", url)
+            content_type, body = STUB_RESPONSES.get(request.resource_type, ("text/plain", b""))
+            await route.fulfill(status=200, content_type=content_type, body=body,
+                                headers={"access-control-allow-origin": "*"})
+        elif self.policy == "allow" or self.cache is None:
+            self._sources[request] = "network"
+            await route.continue_()
+        else:
+            # 处理拦截时 playwright 已经导入
+            from playwright.async_api import Error as PlaywrightError
+            
+            self._sources[request] = "network"
+            try:
+                response = await route.fetch()
+                body = await response.body()
+            except PlaywrightError as e:
+                # 离线、DNS 失败等：中止请求，页面不会一直等待到导航超时
+                self._sources[request] = "failed"
+                logger.warning("获取资源失败: %s (%s)", url, str(e).splitlines()[0])
+                await route.abort("failed")
+                return
+            if response.ok:
+                self.cache.put(url, response.status, response.headers, body)
+                logger.debug("已缓存: %s (%d 字节)", url, len(body))
+            await route.fulfill(response=response, body=body)
+    
+    def report(self, label, slow_ms=DEFAULT_SLOW_REQUEST_MS):
+        """在日志中列出耗时超过 slow_ms 毫秒的请求，并输出各来源的请求数"""
+        counts = {}
+        for _, source, _ in self.timings:
+            counts[source] = counts.get(source, 0) + 1
+        logger.debug("%s: 请求 %s", label, ", ".join(f"{k} {v}" for k, v in sorted(counts.items())) or "无")
+        
+        for elapsed, source, url in sorted(self.timings, reverse=True):
+            if elapsed < slow_ms:
+                break
+            logger.info("%s: 慢请求 %.0fms [%s] %s", label, elapsed, source, url)
+        self.timings = []
+
+
+def main():
+    """命令行主函数：预先下载外部资源，之后截图时不需要联网"""
+    if len(sys.argv) < 3 or sys.argv[1] != "seed":
+        print("用法: python resource_cache.py seed <URL 或 HTML 文件>...")
+        print("说明:")
+        print("  下载 URL 或 HTML 文件中引用的外部资源（脚本、样式、图片、字体）到本地缓存，")
+        print("  之后截图时直接从缓存返回。脚本运行时动态加载的资源可以用")
+        print("  --resource-policy fetch（默认）截图一次来补全缓存")
+        sys.exit(1)
+    
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+    cache = ResourceCache()
+    
+    urls = []
+    for arg in sys.argv[2:]:
+        if is_remote_url(arg):
+            urls.append(arg)
+        else:
+            with open(arg, "r", encoding="utf-8", errors="replace") as f:
+                urls.extend(find_remote_resources(f.read()))
+    
+    count = failed = 0
+    for url in urls:
+        try:
+            count += cache.seed(url)
+        except Exception as e:
+            failed += 1
+            print(f"下载失败: {url} ({e})")
+    print(f"缓存完成: 新增 {count} 个资源，失败 {failed} 个 -> {cache.cache_dir}")
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,139 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+截图结果缓存
+按最终 HTML、引用的本地资源和转换选项的哈希保存截图，内容不变时直接复用，不需要启动浏览器
+"""
+
+import os
+import re
+import json
+import shutil
+import hashlib
+import logging
+import tempfile
+from urllib.parse import urlparse, unquote
+from file_utils import get_cache_dir
+
+
+logger = logging.getLogger(__name__)
+
+# 缓存格式变化时修改，使旧缓存失效
+CACHE_VERSION = "1"
+# 默认缓存上限 500MB，超出后按最近使用时间淘汰
+DEFAULT_MAX_BYTES = 500 * 1024 * 1024
+# 只控制缓存本身、不影响截图结果的选项，不参与计算缓存键
+CACHE_OPTION_KEYS = ("cache", "cache_dir", "cache_max_bytes", "resource_cache_dir", "slow_request_ms")
+
+# HTML 中引用资源的属性和 CSS url()
+RESOURCE_PATTERN = re.compile(r'''(?:\bsrc|\bhref)\s*=\s*["']([^"']+)["']|url\(\s*["']?([^"')]+)["']?\s*\)''')
+
+
+def find_local_resources(html_content, base_dir):
+    """返回 HTML 引用的、存在于本地的资源文件绝对路径（去重并排序）"""
+    resources = set()
+    for match in RESOURCE_PATTERN.finditer(html_content):
+        ref = match.group(1) or match.group(2)
+        parsed = urlparse(ref)
+        if parsed.scheme == "file":
+            path = unquote(parsed.path)
+        elif parsed.scheme or ref.startswith(("//", "#")):
+            # data:、http(s): 等非本地资源
+            continue
+        else:
+            path = os.path.join(base_dir, unquote(parsed.path))
+        if os.path.isfile(path):
+            resources.add(os.path.abspath(path))
+    return sorted(resources)
+
+
+class ScreenshotCache:
+    """截图结果缓存，按大小上限淘汰最久未使用的条目"""
+    
+    def __init__(self, cache_dir=None, max_bytes=DEFAULT_MAX_BYTES):
+        self.cache_dir = cache_dir or get_cache_dir("screenshots")
+        self.max_bytes = max_bytes
+        os.makedirs(self.cache_dir, exist_ok=True)
+    
+    def make_key(self, html_content, base_dir, options, output_format):
+        """
+        计算缓存键
+        
+        Args:
+            html_content: 最终的 HTML 内容
+            base_dir: 解析相对路径资源的目录，None 表示不检查本地资源
+            options: 转换选项
+            output_format: 输出格式
+        """
+        digest = hashlib.sha256()
+        digest.update(CACHE_VERSION.encode())
+        digest.update(output_format.encode())
+        
+        render_options = {k: v for k, v in options.items() if k not in CACHE_OPTION_KEYS}
+        digest.update(json.dumps(render_options, sort_keys=True, default=str).encode())
+        digest.update(html_content.encode("utf-8"))
+        
+        if base_dir is not None:
+            for path in find_local_resources(html_content, base_dir):
+                digest.update(path.encode("utf-8"))
+                with open(path, "rb") as f:
+                    for chunk in iter(lambda: f.read(1024 * 1024), b""):
+                        digest.update(chunk)
+        
+        return digest.hexdigest()
+    
+    def _entry_path(self, key, output_format):
+        return os.path.join(self.cache_dir, key[:2], f"{key}.{output_format}")
+    
+    def fetch(self, key, output_format, output_path):
+        """命中时把缓存的截图复制到 output_path 并返回 True"""
+        entry = self._entry_path(key, output_format)
+        if not os.path.exists(entry):
+            return False
+        shutil.copyfile(entry, output_path)
+        # 更新修改时间，作为最近使用时间
+        os.utime(entry)
+        return True
+    
+    def store(self, key, output_format, output_path):
+        """保存截图，并在超出大小上限时淘汰旧条目"""
+        entry = self._entry_path(key, output_format)
+        os.makedirs(os.path.dirname(entry), exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(entry), suffix=".tmp")
+        os.close(fd)
+        try:
+            shutil.copyfile(output_path, tmp_path)
+            os.replace(tmp_path, entry)
+        finally:
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+        self.evict()
+    
+    def evict(self):
+        """按最近使用时间从旧到新删除条目，直到总大小不超过上限"""
+        entries = []
+        total = 0
+        for root, _, files in os.walk(self.cache_dir):
+            for name in files:
+                if name.endswith(".tmp"):
+                    continue
+                path = os.path.join(root, name)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, path))
+                total += stat.st_size
+        
+        if total <= self.max_bytes:
+            return
+        
+        for _, size, path in sorted(entries):
+            try:
+                os.unlink(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+            logger.debug("淘汰截图缓存: %s", path)
+            if total <= self.max_bytes:
+                break
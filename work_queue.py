@@ -0,0 +1,398 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+共享目录工作队列
+多台机器通过共享卷（如 NFS）上的同一个目录分发批量转换任务，不需要消息中间件：
+
+    队列目录/pending/<任务>.json            等待处理
+    队列目录/claimed/<任务>@<工作进程>.json  已被某个工作进程领取，工作进程定期更新其修改时间作为心跳
+    队列目录/done/<任务>.json               已完成，带有输出的哈希
+    队列目录/failed/<任务>.json             失败次数达到上限
+
+领取任务通过把文件从 pending/ 改名到 claimed/ 完成，改名是原子的，同一个任务只有一个进程能领到；
+心跳超时的任务由其他工作进程放回 pending/ 重新处理。工作进程中途被杀掉时任务可能被执行两次，
+输出总是先写临时文件再改名，重复执行不会产生不完整的文件
+
+用法:
+    python work_queue.py submit 队列目录 html|image 输入文件或目录... -o 输出目录 [--max-attempts N]
+    python work_queue.py worker 队列目录 [--claim N] [--follow] [--heartbeat SEC] [--stale-after SEC]
+    python work_queue.py status 队列目录
+"""
+
+import os
+import re
+import sys
+import json
+import time
+import random
+import socket
+import hashlib
+import logging
+import threading
+from collections import defaultdict
+from batch import BATCH_MODES, DEFAULT_MAX_ATTEMPTS, collect_jobs, convert_html_jobs, convert_image_jobs
+from file_utils import atomic_write, configure_logging, file_sha256
+
+
+logger = logging.getLogger(__name__)
+
+QUEUE_STATES = ("pending", "claimed", "done", "failed")
+# 心跳间隔和判定领取失效的时间（秒）
+DEFAULT_HEARTBEAT = 10
+DEFAULT_STALE_AFTER = 60
+# 队列为空时轮询的间隔（秒）
+POLL_INTERVAL = 2
+# 每次领取时从最早的若干个任务中随机挑选，减少多个进程争抢同一个文件
+CLAIM_WINDOW = 64
+# 默认每次领取的任务数，image 模式一次领取的任务共用一个浏览器
+DEFAULT_CLAIM_SIZE = 4
+# 任务文件名；写出时的临时文件（见 file_utils.atomic_write）不匹配
+JOB_FILE_PATTERN = re.compile(r'^[0-9a-f]{16}\.json$')
+CLAIM_FILE_PATTERN = re.compile(r'^[0-9a-f]{16}@.+\.json$')
+
+
+def default_worker_id():
+    """主机名加进程号，在所有机器上唯一"""
+    return f"{socket.gethostname()}-{os.getpid()}"
+
+
+def job_id(output):
+    """按输出路径生成任务文件名；同一个输出重复提交时覆盖等待中的任务，不会重复排队"""
+    return hashlib.sha1(os.path.abspath(output).encode("utf-8")).hexdigest()[:16]
+
+
+class WorkQueue:
+    """共享目录上的工作队列，每个工作进程创建一个实例"""
+    
+    def __init__(self, root, worker_id=None, stale_after=DEFAULT_STALE_AFTER):
+        self.root = root
+        self.worker_id = worker_id or default_worker_id()
+        self.stale_after = stale_after
+        for state in QUEUE_STATES:
+            os.makedirs(os.path.join(root, state), exist_ok=True)
+        os.makedirs(os.path.join(root, "clock"), exist_ok=True)
+        # 本进程持有的领取文件，由心跳线程定期更新
+        self._held = set()
+        self._lock = threading.Lock()
+    
+    def _path(self, state, name):
+        return os.path.join(self.root, state, name)
+    
+    def _names(self, state):
+        """某个状态下的任务文件名（已排序）"""
+        pattern = CLAIM_FILE_PATTERN if state == "claimed" else JOB_FILE_PATTERN
+        return sorted(name for name in os.listdir(os.path.join(self.root, state)) if pattern.match(name))
+    
+    def now(self):
+        """
+        以共享卷的时钟为准的当前时间
+        
+        心跳时间是共享卷上的文件修改时间，各机器的本地时钟可能不一致，
+        所以比较前先更新一个本进程的文件，读取它的修改时间
+        """
+        path = os.path.join(self.root, "clock", self.worker_id)
+        with open(path, "a"):
+            pass
+        os.utime(path)
+        return os.stat(path).st_mtime
+    
+    def submit(self, jobs, mode, options=None, max_attempts=DEFAULT_MAX_ATTEMPTS):
+        """
+        提交任务
+        
+        Args:
+            jobs: (Markdown 文件路径, 输出文件路径) 列表，路径在所有工作机器上都要有效
+            mode: html 或 image，见 batch.run_batch
+            options: 转换选项，需要能序列化为 JSON
+            max_attempts: 每个任务最多尝试的次数
+        """
+        if mode not in BATCH_MODES:
+            raise ValueError(f"未知的批量转换模式: {mode}. 支持的模式: {', '.join(BATCH_MODES)}")
+        submitted = time.time()
+        for md_path, output_path in jobs:
+            job = {
+                "id": job_id(output_path),
+                "mode": mode,
+                "input": os.path.abspath(md_path),
+                "output": os.path.abspath(output_path),
+                "options": options or {},
+                "attempts": 0,
+                "max_attempts": max_attempts,
+                "submitted": submitted
+            }
+            with atomic_write(self._path("pending", f"{job['id']}.json"), "w", encoding="utf-8") as f:
+                json.dump(job, f, ensure_ascii=False)
+        return len(jobs)
+    
+    def claim(self, count=1):
+        """
+        领取最多 count 个任务
+        
+        Returns:
+            [(领取文件路径, 任务)]，队列为空时为空列表
+        """
+        claimed = []
+        candidates = self._names("pending")[:CLAIM_WINDOW]
+        random.shuffle(candidates)
+        for name in candidates:
+            if len(claimed) >= count:
+                break
+            claim_path = self._path("claimed", f"{name[:-5]}@{self.worker_id}.json")
+            try:
+                os.rename(self._path("pending", name), claim_path)
+            except FileNotFoundError:
+                # 被其他进程领走了
+                continue
+            # 改名保留了提交时的修改时间，立即更新，避免被当作失效的领取
+            os.utime(claim_path)
+            with self._lock:
+                self._held.add(claim_path)
+            with open(claim_path, "r", encoding="utf-8") as f:
+                job = json.load(f)
+            if os.path.exists(self._path("done", name)) and self._done_is_current(name, job):
+                # 领取失效被收回后，原来的进程仍然完成了任务
+                self._release(claim_path)
+                continue
+            claimed.append((claim_path, job))
+        return claimed
+    
+    def _done_is_current(self, name, job):
+        try:
+            with open(self._path("done", name), "r", encoding="utf-8") as f:
+                done = json.load(f)
+        except (FileNotFoundError, ValueError):
+            return False
+        return done.get("submitted") == job.get("submitted")
+    
+    def heartbeat(self):
+        """更新本进程所有领取文件的修改时间；领取已被其他进程收回时停止跟踪"""
+        with self._lock:
+            held = list(self._held)
+        for claim_path in held:
+            try:
+                os.utime(claim_path)
+            except FileNotFoundError:
+                logger.warning("领取已失效，任务可能会被重复执行: %s", os.path.basename(claim_path))
+                with self._lock:
+                    self._held.discard(claim_path)
+    
+    def _release(self, claim_path):
+        with self._lock:
+            self._held.discard(claim_path)
+        try:
+            os.unlink(claim_path)
+        except FileNotFoundError:
+            pass
+    
+    def complete(self, claim_path, job, output_sha256):
+        """记录任务完成并释放领取"""
+        result = dict(job, worker=self.worker_id, output_sha256=output_sha256, finished=time.time())
+        with atomic_write(self._path("done", f"{job['id']}.json"), "w", encoding="utf-8") as f:
+            json.dump(result, f, ensure_ascii=False)
+        self._release(claim_path)
+    
+    def fail(self, claim_path, job, error):
+        """记录一次失败：未达到次数上限时放回 pending/，否则移到 failed/"""
+        job = dict(job, attempts=job["attempts"] + 1, error=str(error), worker=self.worker_id)
+        state = "pending" if job["attempts"] < job["max_attempts"] else "failed"
+        with atomic_write(self._path(state, f"{job['id']}.json"), "w", encoding="utf-8") as f:
+            json.dump(job, f, ensure_ascii=False)
+        self._release(claim_path)
+        return state
+    
+    def reclaim_stale(self):
+        """
+        把心跳超时的领取放回 pending/，计为一次失败
+        
+        先把领取文件改名为本进程的名字（原子操作，只有一个进程能成功），再写回 pending/
+        """
+        now = self.now()
+        reclaimed = 0
+        for name in self._names("claimed"):
+            path = self._path("claimed", name)
+            try:
+                if now - os.stat(path).st_mtime < self.stale_after:
+                    continue
+                task = name.split("@", 1)[0]
+                own_path = self._path("claimed", f"{task}@{self.worker_id}.reclaim.json")
+                os.rename(path, own_path)
+                os.utime(own_path)
+                with open(own_path, "r", encoding="utf-8") as f:
+                    job = json.load(f)
+            except FileNotFoundError:
+                continue
+            state = self.fail(own_path, job, f"领取失效: {name}")
+            logger.warning("收回失效的领取 %s，任务%s", name, "重新排队" if state == "pending" else "已达到重试上限")
+            reclaimed += 1
+        return reclaimed
+    
+    def status(self):
+        """各状态的任务数"""
+        return {state: len(self._names(state)) for state in QUEUE_STATES}
+
+
+def _heartbeat_loop(queue, interval, stop):
+    while not stop.wait(interval):
+        queue.heartbeat()
+
+
+def _run_claimed(queue, claimed):
+    """按模式和选项分组执行领取的任务，每完成一个立即记录"""
+    groups = defaultdict(list)
+    for claim_path, job in claimed:
+        groups[(job["mode"], json.dumps(job["options"], sort_keys=True))].append((claim_path, job))
+    
+    for (mode, _), items in groups.items():
+        by_job = {(job["input"], job["output"]): (claim_path, job) for claim_path, job in items}
+        options = items[0][1]["options"]
+        
+        def record(pair, result):
+            claim_path, job = by_job[pair]
+            if isinstance(result, Exception):
+                state = queue.fail(claim_path, job, result)
+                logger.warning("任务失败（第 %d 次）: %s: %s%s", job["attempts"] + 1, job["input"], result,
+                               "" if state == "pending" else "，已达到重试上限")
+            else:
+                queue.complete(claim_path, job, file_sha256(job["output"]))
+                logger.info("完成: %s", job["output"])
+        
+        pairs = list(by_job)
+        for _, output_path in pairs:
+            if os.path.dirname(output_path):
+                os.makedirs(os.path.dirname(output_path), exist_ok=True)
+        if mode == "html":
+            convert_html_jobs(pairs, options, record, len(pairs))
+        else:
+            convert_image_jobs(pairs, options, record)
+
+
+def run_worker(queue, claim_size=DEFAULT_CLAIM_SIZE, follow=False, heartbeat=DEFAULT_HEARTBEAT):
+    """
+    工作进程主循环：收回失效的领取、领取任务、执行，直到队列处理完
+    
+    Args:
+        queue: WorkQueue
+        claim_size: 每次领取的任务数
+        follow: 为 True 时队列为空后继续等待新任务，否则没有等待和处理中的任务时退出
+        heartbeat: 心跳间隔（秒），应明显小于 queue.stale_after
+    
+    Returns:
+        本进程完成的任务数
+    """
+    stop = threading.Event()
+    beater = threading.Thread(target=_heartbeat_loop, args=(queue, heartbeat, stop), daemon=True)
+    beater.start()
+    finished = 0
+    try:
+        while True:
+            queue.reclaim_stale()
+            claimed = queue.claim(claim_size)
+            if claimed:
+                _run_claimed(queue, claimed)
+                finished += len(claimed)
+                continue
+            if not follow and not queue.status()["claimed"]:
+                break
+            # 其他进程还在处理（可能在失效后被收回），或者在等待新任务
+            time.sleep(POLL_INTERVAL)
+    finally:
+        stop.set()
+        beater.join()
+    return finished
+
+
+def main():
+    """命令行主函数"""
+    args = []
+    output_dir = None
+    max_attempts = DEFAULT_MAX_ATTEMPTS
+    claim_size = DEFAULT_CLAIM_SIZE
+    follow = False
+    heartbeat = DEFAULT_HEARTBEAT
+    stale_after = DEFAULT_STALE_AFTER
+    options = {}
+    verbose = False
+    
+    i = 1
+    while i < len(sys.argv):
+        arg = sys.argv[i]
+        if arg in ("-o", "--output") and i + 1 < len(sys.argv):
+            output_dir = sys.argv[i + 1]
+            i += 2
+        elif arg == "--max-attempts" and i + 1 < len(sys.argv):
+            max_attempts = int(sys.argv[i + 1])
+            i += 2
+        elif arg == "--claim" and i + 1 < len(sys.argv):
+            claim_size = int(sys.argv[i + 1])
+            i += 2
+        elif arg == "--follow":
+            follow = True
+            i += 1
+        elif arg == "--heartbeat" and i + 1 < len(sys.argv):
+            heartbeat = float(sys.argv[i + 1])
+            i += 2
+        elif arg == "--stale-after" and i + 1 < len(sys.argv):
+            stale_after = float(sys.argv[i + 1])
+            i += 2
+        elif arg == "--math-backend" and i + 1 < len(sys.argv):
+            options["math_backend"] = sys.argv[i + 1]
+            i += 2
+        elif arg == "--math-output" and i + 1 < len(sys.argv):
+            options["math_output"] = sys.argv[i + 1]
+            i += 2
+        elif arg == "--workspace" and i + 1 < len(sys.argv):
+            options["workspace"] = os.path.abspath(sys.argv[i + 1])
+            i += 2
+        elif arg == "--width" and i + 1 < len(sys.argv):
+            options["viewport"] = {"width": int(sys.argv[i + 1]), "height": 800}
+            i += 2
+        elif arg == "--verbose":
+            verbose = True
+            i += 1
+        elif arg.startswith("-"):
+            print(f"未知选项: {arg}")
+            sys.exit(1)
+        else:
+            args.append(arg)
+            i += 1
+    
+    command = args[0] if args else None
+    if command not in ("submit", "worker", "status") or len(args) < 2 or \
+            (command == "submit" and (len(args) < 4 or args[2] not in BATCH_MODES or output_dir is None)):
+        print("用法:")
+        print("  python work_queue.py submit 队列目录 html|image 输入文件或目录... -o 输出目录 [选项]")
+        print("  python work_queue.py worker 队列目录 [选项]")
+        print("  python work_queue.py status 队列目录")
+        print("submit 选项:")
+        print(f"  --max-attempts N     每个任务最多尝试的次数 (默认: {DEFAULT_MAX_ATTEMPTS})")
+        print("  --math-backend NAME  html 模式的公式渲染后端")
+        print("  --math-output MODE   html 模式的公式输出: image（默认）, mathml")
+        print("  --workspace DIR      html 模式的公式图片工作目录（放在共享卷上时各机器共用已渲染的公式）")
+        print("  --width W            image 模式的视口宽度 (默认: 1200)")
+        print("worker 选项:")
+        print(f"  --claim N            每次领取的任务数 (默认: {DEFAULT_CLAIM_SIZE})")
+        print("  --follow             队列为空后继续等待新任务，默认处理完后退出")
+        print(f"  --heartbeat SEC      心跳间隔 (默认: {DEFAULT_HEARTBEAT})")
+        print(f"  --stale-after SEC    心跳超过该时间的领取放回队列 (默认: {DEFAULT_STALE_AFTER})")
+        print("  --verbose            输出详细的处理日志")
+        sys.exit(1)
+    
+    configure_logging(verbose, "%(asctime)s %(message)s")
+    
+    queue = WorkQueue(args[1], stale_after=stale_after)
+    if command == "submit":
+        mode = args[2]
+        jobs = collect_jobs(args[3:], output_dir, BATCH_MODES[mode])
+        print(f"已提交 {queue.submit(jobs, mode, options, max_attempts)} 个任务")
+    elif command == "worker":
+        finished = run_worker(queue, claim_size, follow, heartbeat)
+        print(f"工作进程 {queue.worker_id} 执行了 {finished} 次任务（含重试）")
+    
+    status = queue.status()
+    print("，".join(f"{state} {status[state]}" for state in QUEUE_STATES))
+    if command == "status" and status["failed"]:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()